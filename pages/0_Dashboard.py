@@ -11,8 +11,8 @@ from utils.authentication import Authentication
 from utils.config import get_config
 from utils.improved_data_loader import get_improved_data_loader, ImprovedDataLoader # Ensure ImprovedDataLoader is importable for type hinting or direct use if needed
 from utils.loading_dialog import loading_data_dialog # Import the refactored dialog
+from utils.kpi_snapshot import get_latest_kpi_snapshot
 from supabase import create_client, Client
-from collections import Counter
 from utils.google_cloud_utils import render_vm_control_button
 
 # Initialize Authentication
@@ -29,6 +29,7 @@ def initialize_session_state_for_loading():
         "dialog_overall_success": True,
         "dialog_loader_thread_active": False,
         "data_loaded_once": False, # Tracks if data has been successfully loaded at least once
+        "data_load_cancelled": False, # Set when the user cancels a load; suppresses the automatic restart
         "trigger_initial_load": False # This can be set by authentication.py upon new login
     }
     for key, value in default_states.items():
@@ -52,31 +53,43 @@ if not supabase_url or not supabase_key:
 
 # progress_callback_for_ui is removed as updates will be handled via queue
 
-def _execute_data_loading():
-    """Target function for the data loading thread."""
+def _execute_data_loading(data_loader, progress_queue, cancel_event, reload=False):
+    """Target function for the data loading thread.
+
+    Carga en el ImprovedDataLoader compartido las tablas que usan las demás páginas; las
+    búsquedas (planificador de consultas), los KPIs del dashboard y el cubo de gasto se
+    resuelven después con esos snapshots en memoria.
+
+    Args:
+        data_loader (ImprovedDataLoader): Cargador compartido por todas las sesiones.
+        progress_queue (queue.Queue): Recibe los mensajes de progreso para el diálogo.
+        cancel_event (threading.Event): Se activa con el botón Cancelar del diálogo o al cerrar sesión.
+            Solo detiene la espera de esta sesión; una tabla que otra sesión sigue esperando
+            termina de cargarse.
+        reload (bool): Vuelve a descargar las tablas aunque ya estén cargadas (Recargar datos).
+    """
     try:
-        # Simular progreso para que el usuario sepa que la aplicación está inicializando
-        # En este nuevo enfoque, no cargamos datos globalmente, cada página lo hace por su cuenta
+        overall_success, _ = data_loader.load_all_required_tables(
+            progress_queue=progress_queue, cancel_event=cancel_event, reload=reload
+        )
         
-        # Emitir mensajes de progreso a través de la cola
-        progress_steps = [
-            {"progress": 0.2, "message": "Inicializando aplicación...", "status_type": "info", "table_name": "Sistema"},
-            {"progress": 0.5, "message": "Preparando la interfaz...", "status_type": "info", "table_name": "Sistema"},
-            {"progress": 0.8, "message": "Configurando conexiones...", "status_type": "info", "table_name": "Sistema"},
-            {"progress": 1.0, "message": "¡Listo! Aplicación inicializada correctamente", "status_type": "success", "table_name": "Sistema"}
-        ]
-        
-        for step in progress_steps:
-            st.session_state.progress_queue.put(step)
-            time.sleep(0.5)  # Simular tiempo de carga
+        # Las páginas consultan Supabase directamente si una tabla no está en memoria, así que
+        # la navegación se habilita aunque la carga falle o se cancele
+        st.session_state.data_fully_loaded = True  # Agregar esta bandera para habilitar la navegación
+
+        if cancel_event.is_set():
+            st.session_state.dialog_overall_success = False
+            st.session_state.data_load_cancelled = True
+            progress_queue.put({"progress": 1.0, "message": "Carga cancelada.", "status_type": "warning", "table_name": "Sistema"})
+            return
             
-        # Marcar como exitoso
-        st.session_state.dialog_overall_success = True
+        # Si alguna tabla falló, el diálogo muestra los errores
+        st.session_state.dialog_overall_success = overall_success
         st.session_state.data_loaded_once = True
-        st.session_state.data_fully_loaded = True  # Agregar esta bandera para habilitar la navegación
         st.session_state.data_load_timestamp = datetime.now()
     except Exception as e:
         st.session_state.dialog_overall_success = False
+        st.session_state.data_fully_loaded = True
         st.session_state.dialog_detailed_messages.append({
             "type": "error", "table": "Sistema", "message": f"Error al inicializar la aplicación: {str(e)}"
         })
@@ -86,14 +99,17 @@ def _execute_data_loading():
         st.session_state.dialog_loader_thread_active = False
 
 def start_threaded_data_load(clear_cache=False):
-    """Inicia el proceso de inicialización de la aplicación en un hilo separado."""
+    """Inicia la carga de las tablas compartidas en un hilo separado.
+
+    Args:
+        clear_cache (bool): Vuelve a descargar las tablas aunque ya estén en memoria. Los
+            snapshots actuales se conservan (otras sesiones los usan) hasta que llegan los nuevos.
+    """
     if st.session_state.get('dialog_loader_thread_active', False):
         st.toast("La inicialización ya está en progreso.", icon="⏳")
         return
 
     if clear_cache:
-        # Ya no usamos data_loader.clear_cache()
-        # Simplemente reiniciamos los estados de sesión relevantes
         st.session_state.data_loaded_once = False
 
     # Reset dialog state for a new loading operation
@@ -104,12 +120,20 @@ def start_threaded_data_load(clear_cache=False):
     st.session_state.dialog_loading_finished = False
     st.session_state.dialog_overall_success = True # Assume success until failure
     st.session_state.dialog_loader_thread_active = True
+    st.session_state.dialog_close_requested = False
 
     # Initialize the progress queue in session state
     st.session_state.progress_queue = queue.Queue()
+    
+    # Cancellation token for this session's load (Cancelar button in the dialog, logout)
+    st.session_state.data_load_cancelled = False
+    st.session_state.load_cancel_event = threading.Event()
 
     # Create and start the thread, ensuring Streamlit context
-    thread = threading.Thread(target=_execute_data_loading)
+    thread = threading.Thread(
+        target=_execute_data_loading,
+        args=(get_improved_data_loader(), st.session_state.progress_queue, st.session_state.load_cancel_event, clear_cache)
+    )
     add_script_run_ctx(thread)
     thread.start()
     st.rerun() # Immediately rerun to show the dialog and start its update cycle
@@ -254,41 +278,25 @@ if st.session_state.get('trigger_initial_load', False) and \
     st.session_state.trigger_initial_load = False # Reset trigger
     start_threaded_data_load()
 
-# 2. If dialog is open, display it and process queue.
+# 2. If dialog is open, display it. Its progress fragment drains the queue on its own timer
+#    and requests a full rerun only once loading has finished.
 if st.session_state.get('dialog_is_open', False):
-    loading_data_dialog() 
-
-    if st.session_state.get('dialog_loader_thread_active', False):
-        try:
-            while not st.session_state.progress_queue.empty(): # Process all messages in queue
-                item = st.session_state.progress_queue.get_nowait()
-                st.session_state.dialog_progress_value = item.get("progress", st.session_state.dialog_progress_value)
-                st.session_state.dialog_progress_message = item.get("message", st.session_state.dialog_progress_message)
-                
-                if not isinstance(st.session_state.get('dialog_detailed_messages'), list):
-                    st.session_state.dialog_detailed_messages = []
-                
-                st.session_state.dialog_detailed_messages.append({
-                    "type": item.get("status_type", "info"),
-                    "table": item.get("table_name", "N/A"),
-                    "message": item.get("message", "")
-                })
-        except queue.Empty:
-            pass # No new messages
-        
-        # If the thread is still active (meaning loading is ongoing), schedule a rerun to check queue again.
-        if st.session_state.get('dialog_loader_thread_active', False):
-            time.sleep(0.2) # Polling frequency
-            st.rerun()
-    # If the dialog is open, but the loader thread is NOT active AND loading is marked as finished:
-    elif not st.session_state.get('dialog_loader_thread_active', False) and \
-         st.session_state.get('dialog_loading_finished', False):
+    if not st.session_state.get('dialog_loader_thread_active', False) and \
+       st.session_state.get('dialog_loading_finished', False):
         # Loading thread is done, and loading process is marked as finished.
         # Close the dialog automatically to allow user interaction with the app.
         st.session_state.dialog_is_open = False
+        st.session_state.dialog_close_requested = False
         st.rerun() # Rerun to hide dialog and show main content/updated state
+    else:
+        loading_data_dialog()
 
 # 3. If dialog is NOT open:
+elif st.session_state.get('data_load_cancelled', False) and \
+     not st.session_state.get('data_loaded_once', False):
+    # The user cancelled the load: do not restart it automatically
+    st.info("La carga de datos se canceló. Use **Recargar datos** para reanudarla.")
+
 elif not st.session_state.get('data_loaded_once', False) and \
      not st.session_state.get('dialog_loader_thread_active', False):
     # Data not loaded, no thread active, dialog not open.
@@ -387,74 +395,91 @@ Explore las siguientes secciones para aprovechar al máximo la plataforma:
         else:
             return str(date_value)
 
+    def format_dashboard_kpis(kpis):
+        """Convierte los KPIs crudos en los valores que muestran las tarjetas del dashboard.
+        
+        Espera las claves obras_count, total_facturado, total_conceptos, ultima_factura,
+        ultimo_registro y top_subcategorias; las que falten conservan su valor por defecto.
+        """
+        formatted = {}
+        if not kpis:
+            return formatted
+        
+        # 1. Cantidad de obras únicas
+        if kpis.get('obras_count') is not None:
+            formatted['obras_count'] = int(kpis['obras_count'])
+        
+        # 2. Total facturado
+        total_facturado = float(kpis.get('total_facturado') or 0)
+        formatted['total_facturado_fmt'] = f"${total_facturado:,.2f}" if total_facturado else "$0.00"
+        
+        # 3. Última actualización de datos (fecha más reciente de 'fecha_factura')
+        if kpis.get('ultima_factura'):
+            formatted['ultima_actualizacion_fmt'] = format_date_to_spanish(pd.to_datetime(kpis['ultima_factura']))
+        
+        # 4. Total de conceptos (filas de portal_desglosado)
+        if kpis.get('total_conceptos') is not None:
+            formatted['total_conceptos'] = int(kpis['total_conceptos'])
+        
+        # 5. Último registro (fecha de captura más reciente)
+        if kpis.get('ultimo_registro'):
+            formatted['ultimo_registro'] = format_date_to_spanish(pd.to_datetime(kpis['ultimo_registro']))
+        
+        # 6. Conceptos más facturados (Top 2), unidos con ' - '
+        if kpis.get('top_subcategorias'):
+            formatted['nombres'] = ' - '.join(kpis['top_subcategorias'])
+        
+        return formatted
+
+    METRICAS_POR_DEFECTO = {
+        'obras_count': 0,
+        'total_facturado_fmt': "$0.00",
+        'ultima_actualizacion_fmt': "No disponible",
+        'total_conceptos': 0,
+        'ultimo_registro': "No disponible",
+        'top_concepto': "No disponible",
+        'nombres': "No disponible"
+    }
+    
     @st.cache_data(ttl=3600)  # Cachear por 1 hora (3600 segundos)
     def get_dashboard_metrics():
         """Obtener métricas para el dashboard desde Supabase con caché"""
         # Initialize metrics with default values
-        metrics = {
-            'obras_count': 0,
-            'total_facturado_fmt': "$0.00",
-            'ultima_actualizacion_fmt': "No disponible",
-            'total_conceptos': 0,
-            'ultimo_registro': "No disponible",
-            'top_concepto': "No disponible",
-            'nombres': "No disponible"
-        }
+        metrics = dict(METRICAS_POR_DEFECTO)
         
         # Inicializar cliente Supabase directamente con las variables ya obtenidas
         try:
             supabase = create_client(supabase_url, supabase_key)
             
-            # 1. Cantidad de obras únicas
-            obras_response = supabase.table("portal_desglosado").select("obra").execute()
-            obras_data = obras_response.data
-            unique_obras = list({item["obra"] for item in obras_data if "obra" in item})
-            metrics['obras_count'] = len(unique_obras)
-            
-            # 2. Total facturado
-            total_facturado_response = supabase.table("portal_desglosado").select("subtotal").execute()
-            total_facturado_data = total_facturado_response.data
-            total_facturado = sum(item.get('subtotal', 0) for item in total_facturado_data)
-            metrics['total_facturado_fmt'] = f"${total_facturado:,.2f}" if total_facturado else "$0.00"
-            
-            # 3. Última actualización de datos (basado en la fecha más reciente de 'fecha_factura')
-            latest_date_response = supabase.table("portal_desglosado").select("fecha_factura").order("fecha_factura", desc=True).limit(1).maybe_single().execute()
-            latest_date_data = latest_date_response.data
-            if latest_date_data and latest_date_data.get("fecha_factura"):
-                metrics['ultima_actualizacion_fmt'] = format_date_to_spanish(pd.to_datetime(latest_date_data["fecha_factura"]))
-            
-            # 4. Total de conceptos únicos
-            metrics['total_conceptos'] = len(obras_response.data)  # Total number of rows returned
-            
-            # 5. Último registro (concepto más reciente)
-            latest_date_response = supabase.table("portal_concentrado").select("fecha_consulta").order("fecha_consulta", desc=True).limit(1).maybe_single().execute()
-            latest_date_data = latest_date_response.data
-            if latest_date_data and latest_date_data.get("fecha_consulta"):
-                metrics['ultimo_registro'] = format_date_to_spanish(pd.to_datetime(latest_date_data["fecha_consulta"]))
-            
-            # 6. Concepto más facturado (Top 1)
-            subcategoria_response = supabase.table("portal_desglosado").select("subcategoria").execute()
-            subcategoria_data = subcategoria_response.data
-            
-            # Extract subcategoria values into a list
-            subcategorias = [item["subcategoria"] for item in subcategoria_data if item.get("subcategoria")]
-            
-            # Count frequencies and get the top 2 most common
-            if subcategorias:
-                subcategoria_counts = Counter(subcategorias)
-                top_2_subcategorias = subcategoria_counts.most_common(2)
-                # Extraer los nombres de las subcategorías
-                nombres_list = [item[0] for item in top_2_subcategorias]
-                # Unir los nombres en una cadena con ' - '
-                metrics['nombres'] = ' - '.join(nombres_list)
+            # Snapshot diario calculado en el servidor tras cada carga completa (sql/migrations/003_dashboard_kpis_snapshot.sql)
+            try:
+                kpis = get_latest_kpi_snapshot(supabase, max_age=get_config("KPI_SNAPSHOT_MAX_AGE"))
+            except Exception as e:
+                print(f"DEBUG - Snapshot de KPIs no disponible: {e}")
+                kpis = None
+            if not kpis:
+                # Una sola RPC calcula los seis KPIs en el servidor (sql/migrations/002_dashboard_kpis.sql)
+                kpis = supabase.rpc("get_dashboard_kpis").execute().data
+            metrics.update(format_dashboard_kpis(kpis))
                 
         except Exception as e:
             st.error(f"Error al calcular métricas del dashboard desde Supabase: {e}")
             
         return metrics
     
-    # Obtener métricas cacheadas
-    dashboard_metrics = get_dashboard_metrics()
+    # Tras la carga del diálogo, las tablas en memoria resuelven las métricas sin llamadas de red
+    # (get_snapshot_kpis las guarda por versión del snapshot); si no están cargadas o están
+    # vencidas, se consultan en Supabase
+    try:
+        snapshot_kpis = get_improved_data_loader().get_snapshot_kpis()
+    except Exception as e:
+        print(f"DEBUG - KPIs en memoria no disponibles: {e}")
+        snapshot_kpis = None
+    
+    if snapshot_kpis:
+        dashboard_metrics = {**METRICAS_POR_DEFECTO, **format_dashboard_kpis(snapshot_kpis)}
+    else:
+        dashboard_metrics = get_dashboard_metrics()
     
     # Extraer valores de las métricas
     obras_count = dashboard_metrics['obras_count']
@@ -2,11 +2,14 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import os
-import plotly.express as px
 import matplotlib.pyplot as plt
 from utils.authentication import Authentication
 from utils.config import get_config
 from pages.utils_3 import get_data_loader_instance
+from utils.spend_cube import CubeRollup, build_spend_cube, filter_cube, get_spend_cube_provider
+from utils.aggregation import DatabaseRollup
+from utils.chart_figures import build_bar_figure, build_heatmap_figure, build_line_figure, build_top_subcategorias_figure
+from utils.kpi_snapshot import get_kpi_snapshot_marker
 from supabase import create_client, Client
 
 # --- Verificar si los datos están completamente cargados ---
@@ -47,9 +50,9 @@ else:
 
 # Contenido principal
 
-# Inicializar variables para los dataframes
-data = pd.DataFrame()
-filtered_data = pd.DataFrame()
+# Datos agregados de las gráficas y líneas que cumplen los filtros
+chart_data = None
+line_count = 0
 
 # Función para obtener datos filtrados de Supabase
 def get_filtered_data(client, categorias, subcategorias, cuentas_gasto):
@@ -92,6 +95,103 @@ def get_filtered_data(client, categorias, subcategorias, cuentas_gasto):
         st.error(f"Error al obtener datos filtrados: {e}")
         return pd.DataFrame()
 
+# Fuente de datos de las gráficas con los filtros aplicados. Devuelve (fuente, líneas que cumplen los filtros)
+def get_spend_source(client, categorias, subcategorias, cuentas_gasto):
+    # Con portal_desglosado cargado en memoria, el cubo ya está agregado y solo se filtra
+    cached = get_spend_cube_provider().get_cube()
+    if cached is not None:
+        cube, version = cached
+        print(f"DEBUG - Visualización desde el cubo en memoria v{version}")
+        source = CubeRollup(filter_cube(cube, categorias, subcategorias, cuentas_gasto))
+        return source, source.line_count()
+    
+    # Si no, cada gráfica pide a la base de datos solo sus filas agregadas (GROUP BY)
+    source = DatabaseRollup(client, categorias, subcategorias, cuentas_gasto)
+    lineas = source.line_count()
+    if lineas is not None:
+        return source, lineas
+    
+    # Sin agregaciones en el servidor se consultan las líneas y se agregan una sola vez
+    source = CubeRollup(build_spend_cube(get_filtered_data(client, categorias, subcategorias, cuentas_gasto)))
+    return source, source.line_count()
+
+# Firma canónica de los filtros: el orden de selección no cambia la clave de caché
+def filter_signature(categorias, subcategorias, cuentas_gasto):
+    return tuple(tuple(sorted(set(values or []))) for values in (categorias, subcategorias, cuentas_gasto))
+
+# Marca de la última modificación de portal_desglosado; se relee cada VIZ_DATA_VERSION_TTL segundos
+@st.cache_data(ttl=get_config("VIZ_DATA_VERSION_TTL"), show_spinner=False)
+def get_database_version(_client):
+    try:
+        return get_kpi_snapshot_marker(_client)
+    except Exception as e:
+        print(f"DEBUG - Versión de datos del servidor no disponible: {e}")
+        return None
+
+# Versión de los datos: la del cubo en memoria o, para los resultados del servidor, la marca de
+# la última modificación de portal_desglosado (sin marca, los resultados solo vencen por TTL)
+def current_data_version(client):
+    cached = get_spend_cube_provider().get_cube()
+    if cached is not None:
+        return f"cubo-v{cached[1]}"
+    marker = get_database_version(client)
+    return f"db-{marker}" if marker else "db"
+
+# Agregaciones de todas las gráficas, compartidas entre sesiones con los mismos filtros
+@st.cache_data(ttl=get_config("VIZ_CACHE_TTL"), show_spinner=False)
+def get_chart_data(_client, signature, data_version):
+    categorias, subcategorias, cuentas_gasto = (list(values) for values in signature)
+    spend, lineas = get_spend_source(_client, categorias, subcategorias, cuentas_gasto)
+    data = {"line_count": lineas}
+    if not lineas:
+        return data
+    
+    # Total por categoría y obra; las variantes de una obra ('/Servicios', '/Garantías', etc.)
+    # quedan como barras separadas
+    data["bar"] = spend.rollup(['categoria_id', 'obra'])
+    
+    # Promedio mensual por obra (suma / número de importes); sin meses inválidos
+    data["line"] = spend.rollup(['mes', 'obra']).sort_values('mes')
+    
+    # Total por subcategoría (sin subcategorías vacías), solo totales positivos
+    subcat_data = spend.rollup(['subcategoria'])
+    data["subcategorias"] = subcat_data[subcat_data['total'] > 0]
+    
+    # Matriz de las 10 subcategorías con mayor total por obra
+    data["heatmap"] = None
+    if not data["subcategorias"].empty:
+        top_subcats = data["subcategorias"].sort_values('total', ascending=False).head(10)['subcategoria'].tolist()
+        data["heatmap"] = spend.rollup(['subcategoria', 'obra'], where={'subcategoria': top_subcats})
+    return data
+
+# Figuras Plotly ya construidas para la misma firma de filtros y versión de datos
+@st.cache_data(ttl=get_config("VIZ_CACHE_TTL"), show_spinner=False)
+def get_chart_figures(_chart_data, signature, data_version):
+    figures = {"bar": None, "line": None, "top_subcategorias": None, "heatmap": None, "heatmap_error": None}
+    if not _chart_data.get("line_count"):
+        return figures
+    if not _chart_data["bar"].empty:
+        figures["bar"] = build_bar_figure(_chart_data["bar"], "Total por Categoría y Obra")
+    if not _chart_data["line"].empty:
+        figures["line"] = build_line_figure(_chart_data["line"], "Tendencia Temporal por Obra")
+    if not _chart_data["subcategorias"].empty:
+        top_subcats_chart = _chart_data["subcategorias"].sort_values('total', ascending=False).head(15)
+        figures["top_subcategorias"] = build_top_subcategorias_figure(top_subcats_chart)
+    if _chart_data["heatmap"] is not None:
+        try:
+            # Cross-tabulation of Subcategorias vs Obras with sums of TOTAL
+            heatmap_data = _chart_data["heatmap"].pivot_table(
+                index='subcategoria',
+                columns='obra',
+                values='total',
+                aggfunc='sum',
+                fill_value=0
+            )
+            figures["heatmap"] = build_heatmap_figure(heatmap_data)
+        except Exception as e:
+            figures["heatmap_error"] = str(e)
+    return figures
+
 # Inicializar variables de estado si no existen
 if 'viz_selected_categories' not in st.session_state:
     st.session_state.viz_selected_categories = []
@@ -99,16 +199,8 @@ if 'viz_selected_subcategorias' not in st.session_state:
     st.session_state.viz_selected_subcategorias = []
 if 'viz_selected_obras' not in st.session_state:
     st.session_state.viz_selected_obras = []
-if 'viz_data' not in st.session_state:
-    st.session_state.viz_data = pd.DataFrame()
-if 'viz_filtered_data' not in st.session_state:
-    st.session_state.viz_filtered_data = pd.DataFrame()
 if 'viz_submitted' not in st.session_state:
     st.session_state.viz_submitted = False
-    
-# Inicializar variables locales para evitar errores de referencia
-data = st.session_state.viz_data
-filtered_data = st.session_state.viz_filtered_data
 
 # Sidebar con filtros globales y configuración
 with st.sidebar:    
@@ -196,13 +288,11 @@ if 'clear_button' in locals() and clear_button:
     st.session_state.viz_selected_categories = []
     st.session_state.viz_selected_subcategorias = []
     st.session_state.viz_selected_obras = []
-    st.session_state.viz_data = pd.DataFrame()
-    st.session_state.viz_filtered_data = pd.DataFrame()
     st.session_state.viz_submitted = False
     
     # Limpiar las variables locales también
-    data = pd.DataFrame()
-    filtered_data = pd.DataFrame()
+    chart_data = None
+    line_count = 0
     st.rerun()
     
 # Cuando se hace clic en el botón de Graficar dentro del formulario
@@ -236,43 +326,20 @@ if ('submitted' in locals() and submitted) or st.session_state.viz_submitted:
                 st.session_state.viz_selected_obras = selected_obras
                 st.session_state.viz_submitted = True
                 
-                # Obtener los datos filtrados
-                data = get_filtered_data(
-                    supabase_client_chatbot, 
-                    filter_categories, 
-                    filter_subcategorias, 
-                    selected_cuentas_gasto  # Pasar las cuentas_gasto en lugar de las obras
-                )
-                
-                # Guardar los datos en session_state
-                st.session_state.viz_data = data
-                st.session_state.viz_filtered_data = data.copy()
-            else:
-                # Verificamos si hay datos guardados en session_state
-                if not st.session_state.viz_data.empty:
-                    # Obtener los datos guardados en session_state
-                    data = get_filtered_data(
-                        supabase_client_chatbot, 
-                        filter_categories, 
-                        filter_subcategorias, 
-                        selected_cuentas_gasto  # Pasar las cuentas_gasto en lugar de las obras
-                    )
-                    
-                    # Actualizar los datos en session_state
-                    st.session_state.viz_data = data
-                    st.session_state.viz_filtered_data = data.copy()
-                else:
-                    # No hay datos, usar DataFrames vacíos
-                    data = pd.DataFrame()
-                    st.session_state.viz_data = data
-                    st.session_state.viz_filtered_data = data.copy()
-                    
-            # Asegurarse de que filtered_data siempre esté definida
-            filtered_data = st.session_state.viz_filtered_data
+            # Obtener las agregaciones de las gráficas con los filtros vigentes. Se guardan en caché
+            # por firma de filtros y versión de datos: los reruns no vuelven a consultar la red
+            signature = filter_signature(
+                filter_categories, 
+                filter_subcategorias, 
+                selected_cuentas_gasto  # Pasar las cuentas_gasto en lugar de las obras
+            )
+            data_version = current_data_version(supabase_client_chatbot)
+            chart_data = get_chart_data(supabase_client_chatbot, signature, data_version)
+            line_count = chart_data["line_count"]
             
             # Mostrar resumen de datos obtenidos
-            if not data.empty:
-                st.success(f"Datos obtenidos: {len(data)} registros")
+            if line_count:
+                st.success(f"Datos obtenidos: {line_count} registros")
                 
                 # Mostrar resumen de filtros aplicados
                 filter_summary = []
@@ -292,278 +359,54 @@ if ('submitted' in locals() and submitted) or st.session_state.viz_submitted:
         else:
             st.error("No se pudo conectar a Supabase. Verifique la conexión.")
 
-# Asegurarse de que filtered_data esté definida incluso fuera del flujo principal
-if 'filtered_data' not in locals() or filtered_data is None:
-    filtered_data = st.session_state.viz_filtered_data
-
-# Mostrar información sobre los filtros aplicados
-if not data.empty:
+# Las figuras vienen de la caché; solo se dibujan
+if chart_data is not None and line_count:
+    figures = get_chart_figures(chart_data, signature, data_version)
     
     # --- Sección de Gráficas por Categoría y Tendencia ---
-    if not filtered_data.empty:
-        # Create two columns for side-by-side charts
-        bar_col, line_col = st.columns(2)
-            
-        # Bar Chart in first column - agrupado por OBRA
-        with bar_col:
-            # Verificar que existan las columnas necesarias para el gráfico de barras
-            has_category = 'categoria_id' in filtered_data.columns
-            has_total = 'total' in filtered_data.columns
-            has_obra = 'obra' in filtered_data.columns
-            
-            if has_category and has_total:
-                # Verificar si existe la columna cuenta_gasto
-                has_cuenta_gasto = 'cuenta_gasto' in filtered_data.columns
-                
-                # Título según si tenemos datos de obra y cuenta_gasto
-                title = "Total por Categoría y Obra" if has_obra else "Total por Categoría"
-                st.subheader(title)
-                
-                # Preparar datos para el gráfico
-                if has_obra and has_category and has_cuenta_gasto:
-                    # Copiar los datos filtrados para no modificar el original
-                    temp_data = filtered_data.copy()
-                    
-                    # Extraer la obra base de cada nombre de obra (quitar '/Servicios', '/Garantías', etc.)
-                    temp_data['obra_base'] = temp_data['obra'].str.split('/').str[0].str.strip()
-                    
-                    # Agrupar por categoría y cuenta_gasto (para barras separadas)
-                    # y luego por obra (para apilar variantes dentro de cada cuenta_gasto)
-                    bar_chart_data = temp_data.groupby(['categoria_id', 'obra_base', 'obra'])['total'].sum().reset_index()
-                    
-                    # Usar barmode='group' para tener barras separadas por obra_base
-                    # Las variantes se apilarán dentro de cada obra_base
-                    barmode = 'group'
-                elif has_obra and has_category:
-                    # Agrupar por categoría y obra cuando no hay cuenta_gasto
-                    bar_chart_data = filtered_data.groupby(['categoria_id', 'obra'])['total'].sum().reset_index()
-                    barmode = 'group'  # Barras agrupadas (no apiladas)
-                else:
-                    # Solo agrupar por categoría
-                    bar_chart_data = filtered_data.groupby('categoria_id')['total'].sum().reset_index()
-                    barmode = 'relative'
-                
-                # Crear gráfico si hay datos
-                if not bar_chart_data.empty:
-                    # Crear el gráfico dependiendo del caso
-                    if has_cuenta_gasto and 'cuenta_gasto' in bar_chart_data.columns:
-                        # Crear gráfico con barras agrupadas por obra_base
-                        fig_bar = px.bar(
-                            bar_chart_data,
-                            x='categoria_id',  # Categoría en el eje X
-                            y='total',
-                            color='obra',  # Colorear por obra completa (para distinguir variantes)
-                            barmode=barmode,  # 'group' para barras agrupadas por obra_base
-                            facet_row=None,  # No usar facetas
-                            title=title,
-                            labels={'categoria_id': 'Categoría', 'total': 'Total', 'obra': 'Obra', 'obra_base': 'Obra Base'},
-                            # Agrupar por obra_base para tener barras independientes
-                            # pero preservar la relación visual entre variantes de la misma obra
-                            custom_data=['obra_base']
-                        )
-                    else:
-                        # Gráfico estándar sin cuenta_gasto
-                        fig_bar = px.bar(
-                            bar_chart_data,
-                            x='categoria_id',  # Usar categoría como eje X
-                            y='total',
-                            color='obra',  # Colorear por obra
-                            barmode=barmode,
-                            title=title,
-                            labels={'categoria_id': 'Categoría', 'total': 'Total', 'obra': 'Obra'},
-                        )
-                    # Ajustar el diseño para mejorar la visualización
-                    fig_bar.update_layout(
-                        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
-                        margin=dict(t=100),  # Mayor margen superior para la leyenda
-                        xaxis_title="Categoría"  # Cambiar el título del eje X a 'Obra'
-                    )
-                    st.plotly_chart(fig_bar, use_container_width=True)
-                else:
-                    st.info("No hay datos para el gráfico de barras con los filtros seleccionados.")
-            else:
-                missing_cols = []
-                if not has_category: missing_cols.append("'categoria_id'")
-                if not has_total: missing_cols.append("'total'")
-                st.warning(f"Columnas necesarias ({', '.join(missing_cols)}) no encontradas para el gráfico de barras.")
-
-        # Line Chart in second column
-        with line_col:
-            # Verificar que existan las columnas necesarias para el gráfico de líneas
-            has_date = 'fecha_factura' in filtered_data.columns and not filtered_data['fecha_factura'].isna().all()
-            has_total = 'total' in filtered_data.columns
-            has_obra = 'obra' in filtered_data.columns
-            
-            if has_date and has_total:
-                # Título según si tenemos datos de obra o no
-                title = "Tendencia Temporal por Obra" if has_obra else "Tendencia Temporal"
-                st.subheader(title)
-                
-                # Preparar datos para el gráfico
-                temp_data = filtered_data.copy()
-                
-                # Asegurar que la fecha sea datetime y normalizar zona horaria
-                if not pd.api.types.is_datetime64_any_dtype(temp_data['fecha_factura']):
-                    temp_data['fecha_factura'] = pd.to_datetime(temp_data['fecha_factura'], errors='coerce')
-                # Eliminar filas con fechas inválidas
-                temp_data = temp_data[~temp_data['fecha_factura'].isna()]
-                # Normalizar zona horaria (quitar zona horaria si existe)
-                if hasattr(temp_data['fecha_factura'].dtype, 'tz'):
-                    temp_data['fecha_factura'] = temp_data['fecha_factura'].dt.tz_localize(None)
-                
-                # Agrupar datos según si tenemos obra o no
-                if has_obra:
-                    # Agrupar por fecha y obra
-                    line_data = temp_data.sort_values('fecha_factura').groupby(['fecha_factura', 'obra'])['total'].mean().reset_index()
-                    color_by = 'obra'
-                else:
-                    # Solo agrupar por fecha
-                    line_data = temp_data.sort_values('fecha_factura').groupby('fecha_factura')['total'].mean().reset_index()
-                    color_by = None
-                
-                # Crear gráfico si hay datos
-                if not line_data.empty:
-                    # Configuración básica del gráfico
-                    line_args = {
-                        'x': 'fecha_factura',
-                        'y': 'total',
-                        'title': title,
-                        'labels': {'fecha_factura': 'Fecha Factura', 'total': 'Total Promedio'}
-                    }
-                    
-                    # Añadir color por obra si está disponible
-                    if color_by:
-                        line_args['color'] = color_by
-                        line_args['labels']['obra'] = 'Obra'
-                    
-                    # Crear gráfico de líneas
-                    fig_line = px.line(line_data, **line_args)
-                    
-                    # Ajustar diseño si hay múltiples líneas (por obra)
-                    if color_by:
-                        fig_line.update_layout(
-                            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
-                            margin=dict(t=100)  # Mayor margen superior para la leyenda
-                        )
-                    
-                    st.plotly_chart(fig_line, use_container_width=True)
-                else:
-                    st.info("No hay datos para el gráfico de líneas con los filtros seleccionados.")
-            elif not has_date and 'fecha_factura' in data.columns:
-                # La columna fecha existe en los datos originales pero no hay datos válidos después del filtrado
-                st.info("No hay datos de fecha válidos con los filtros seleccionados para generar el gráfico de tendencia temporal.")
-            elif not has_date:
-                # La columna fecha no existe en los datos originales
-                st.info("No hay datos de fecha válidos en la fuente original para generar el gráfico de tendencia temporal.")
-            else:
-                st.warning("Columna 'total' no encontrada para el gráfico de líneas.")
+    # Create two columns for side-by-side charts
+    bar_col, line_col = st.columns(2)
+        
+    # Bar Chart in first column - agrupado por OBRA
+    with bar_col:
+        st.subheader("Total por Categoría y Obra")
+        if figures["bar"] is not None:
+            st.plotly_chart(figures["bar"], use_container_width=True)
+        else:
+            st.info("No hay datos para el gráfico de barras con los filtros seleccionados.")
 
-    else: # If filtered_data is empty after applying filters
-        st.warning("No hay datos que coincidan con los filtros aplicados.")
+    # Line Chart in second column
+    with line_col:
+        st.subheader("Tendencia Temporal por Obra")
+        if figures["line"] is not None:
+            st.plotly_chart(figures["line"], use_container_width=True)
+        else:
+            st.info("No hay datos de fecha válidos con los filtros seleccionados para generar el gráfico de tendencia temporal.")
 
     # --- Sección de Análisis por Subcategoría y Obra ---
     st.divider()
     st.subheader("📊 Análisis por Subcategoría y Obra")
 
-    if not filtered_data.empty and 'subcategoria' in filtered_data.columns and 'total' in filtered_data.columns:
-        # Ensure TOTAL is numeric before aggregation
-        filtered_data_numeric = filtered_data.copy()
-        filtered_data_numeric['total'] = pd.to_numeric(filtered_data_numeric['total'], errors='coerce')
-        filtered_data_agg = filtered_data_numeric.dropna(subset=['total', 'subcategoria'])  # Drop rows where essential columns are NaN
-
-        # Two columns layout for provider charts
-        bar_h_col, heatmap_col = st.columns(2)
+    # Two columns layout for provider charts
+    bar_h_col, heatmap_col = st.columns(2)
 
-        with bar_h_col:
-            # Top 15 subcategorias horizontal bar chart
-            st.subheader("Top 15 Subcategorías por Total")
-
-            # Aggregate data by subcategoria
-            subcat_data = filtered_data_agg.groupby('subcategoria')['total'].sum().reset_index()
-            subcat_data = subcat_data[subcat_data['total'] > 0]  # Consider only positive totals
-
-            if not subcat_data.empty:
-                # Sort by TOTAL descending and get top 15
-                top_subcats_chart = subcat_data.sort_values('total', ascending=False).head(15)
-
-                fig_bar_h = px.bar(
-                    top_subcats_chart,
-                    y='subcategoria',
-                    x='total',
-                    orientation='h',
-                    title='Top 15 Subcategorías por Total',
-                    labels={'subcategoria': 'Subcategoría', 'total': 'Total Acumulado'},
-                    height=500,
-                    color='total',
-                    color_continuous_scale=px.colors.sequential.Blues,
-                    text='total'  # Display total value on bars
-                )
-                fig_bar_h.update_traces(texttemplate='%{text:,.2f}', textposition='outside')
-                fig_bar_h.update_layout(
-                    yaxis={'categoryorder': 'total ascending'},
-                    uniformtext_minsize=8, uniformtext_mode='hide'
-                )
-                st.plotly_chart(fig_bar_h, use_container_width=True)
-            else:
-                st.info("No hay datos de subcategorías con total positivo para mostrar.")
-
-        with heatmap_col:
-            # Heatmap of Subcategorias vs Obras
-            st.subheader("Matriz de Subcategorías por Obra")
-
-            if not filtered_data_agg.empty and 'obra' in filtered_data_agg.columns:
-                # Create a cross-tabulation of Subcategorias vs Obras with sums of TOTAL
-                try:
-                    # Group by subcategoria and obra, summing the totals
-                    heatmap_data = filtered_data_agg.pivot_table(
-                        index='subcategoria',
-                        columns='obra',
-                        values='total',
-                        aggfunc='sum',
-                        fill_value=0
-                    )
-
-                    # Filter to include only top subcategorias (for readability)
-                    top_subcats = subcat_data.sort_values('total', ascending=False).head(10)['subcategoria'].tolist()
-                    heatmap_data = heatmap_data.loc[heatmap_data.index.isin(top_subcats)]
-
-                    # Create heatmap with Plotly
-                    fig_heatmap = px.imshow(
-                        heatmap_data.values,
-                        labels=dict(x="Obra", y="Subcategoría", color="Total"),
-                        x=heatmap_data.columns.tolist(),
-                        y=heatmap_data.index.tolist(),
-                        color_continuous_scale="Blues",
-                        title="Relación Subcategoría-Obra (Montos)"
-                    )
-                    
-                    # Add text annotations with the values
-                    fig_heatmap.update_traces(text=heatmap_data.values, texttemplate="%{z:,.0f}")
-                    
-                    # Adjust layout for better visualization
-                    fig_heatmap.update_layout(
-                        height=500,
-                        margin=dict(l=50, r=50, t=80, b=50)
-                    )
-                    
-                    st.plotly_chart(fig_heatmap, use_container_width=True)
-                except Exception as e:
-                    st.info(f"No se pudo generar la matriz de calor: {e}\nIntenta seleccionar menos filtros o más datos.")
-            else:
-                st.info("Datos insuficientes para generar la matriz de calor Subcategoría-Obra.")
-
-    # Handle missing data or columns
-    elif filtered_data.empty:
-        st.warning("No hay datos que coincidan con los filtros aplicados.")
-    elif not ('subcategoria' in filtered_data.columns and 'total' in filtered_data.columns):
-        missing_cols = []
-        if 'subcategoria' not in filtered_data.columns: missing_cols.append("'subcategoria'")
-        if 'total' not in filtered_data.columns: missing_cols.append("'total'")
-        st.warning(f"Columnas necesarias ({', '.join(missing_cols)}) no encontradas para generar gráficos de subcategoría.")
-
-    # Mensaje si no hay datos originales
-    if data.empty:
-        st.warning("No hay datos disponibles para cargar.")
+    with bar_h_col:
+        # Top 15 subcategorias horizontal bar chart
+        st.subheader("Top 15 Subcategorías por Total")
+        if figures["top_subcategorias"] is not None:
+            st.plotly_chart(figures["top_subcategorias"], use_container_width=True)
+        else:
+            st.info("No hay datos de subcategorías con total positivo para mostrar.")
+
+    with heatmap_col:
+        # Heatmap of Subcategorias vs Obras
+        st.subheader("Matriz de Subcategorías por Obra")
+        if figures["heatmap"] is not None:
+            st.plotly_chart(figures["heatmap"], use_container_width=True)
+        elif figures["heatmap_error"]:
+            st.info(f"No se pudo generar la matriz de calor: {figures['heatmap_error']}\nIntenta seleccionar menos filtros o más datos.")
+        else:
+            st.info("Datos insuficientes para generar la matriz de calor Subcategoría-Obra.")
 
 
 # La sección del mapa (tab3) ha sido eliminada según los requerimientos
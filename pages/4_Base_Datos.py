@@ -10,6 +10,11 @@ import matplotlib.pyplot as plt
 import tempfile
 from utils.authentication import Authentication
 from utils.dataframe_utils import custom_dataframe_explorer
+from utils.paginated_grid import paginated_dataframe
+from utils.selection_store import CONCENTRADO, DESGLOSADO, get_selection_store
+from utils.invoice_rules import get_rule_flags
+from utils.concentrado_builder import UuidCrossIndex
+from utils.explorer_engine import get_filter_mask
 from utils.config import get_config
 from utils.download_utils import GestorDescargas, preparar_ruta_destino, CombinadorPDF, sanitizar_nombre_archivo
 
@@ -39,7 +44,8 @@ st.title(":file_cabinet: Base de Datos Portal de Proveedores")
 st.markdown("Impulsado por PalmaTerra 360 | Módulo Facturas :speech_balloon: :llama:", help="Explora y consulta la base de datos de la empresa")
 
 # Importar las funciones centralizadas desde el módulo de utilidades
-from utils.chatbot_supabase import init_chatbot_supabase_client, get_chatbot_filter_options, get_filtered_data_multiselect
+from utils.chatbot_supabase import init_chatbot_supabase_client, get_chatbot_filter_options
+from utils.search_service import run_invoice_search
 
 # Inicializar variables para el sistema de toasts
 if 'toast_message' not in st.session_state:
@@ -59,6 +65,13 @@ if 'saved_selections' not in st.session_state:
 if 'saved_selections_desglosado' not in st.session_state:
     st.session_state.saved_selections_desglosado = pd.DataFrame()
 
+def rebase_selection_store():
+    """Separa las filas del registro temporal del snapshot de búsqueda que está por reemplazarse."""
+    selection_store = get_selection_store()
+    version = st.session_state.get('search_version', 0)
+    selection_store.rebase(CONCENTRADO, st.session_state.get('saved_data_contabilidad', pd.DataFrame()), version)
+    selection_store.rebase(DESGLOSADO, st.session_state.get('saved_data', pd.DataFrame()), version)
+
 # Usar las funciones centralizadas con caché
 supabase_client_chatbot = init_chatbot_supabase_client()
 
@@ -191,6 +204,9 @@ try:
         st.session_state.saved_data = pd.DataFrame()
     if 'saved_data_contabilidad' not in st.session_state:
         st.session_state.saved_data_contabilidad = pd.DataFrame()
+    # Versión de los datos guardados: el explorer reutiliza sus metadatos mientras no cambie
+    if 'search_version' not in st.session_state:
+        st.session_state.search_version = 0
         
     # Usar datos guardados o inicializar nuevos
     data = st.session_state.saved_data
@@ -204,9 +220,13 @@ try:
             st.session_state.pop('desglosado_explorer')
         if 'concentrado_explorer' in st.session_state:
             st.session_state.pop('concentrado_explorer')
+        # Conservar el registro temporal antes de descartar el snapshot de la búsqueda
+        rebase_selection_store()
         # Reiniciar los dataframes en session_state
         st.session_state.saved_data = pd.DataFrame()
         st.session_state.saved_data_contabilidad = pd.DataFrame()
+        st.session_state.saved_concentrado_codes = None
+        st.session_state.search_version += 1
         data = pd.DataFrame()
         data_contabilidad = pd.DataFrame()
         # Recargar la página para restablecer todos los widgets
@@ -242,7 +262,7 @@ try:
             "obra, tipo_gasto, cuenta_gasto, proveedor, residente, folio, estatus, "
             "fecha_factura, fecha_recepcion, fecha_pagada, fecha_autorizacion, clave_producto, clave_unidad, "
             "categoria_id, subcategoria, descripcion, cantidad, unidad, precio_unitario, subtotal, descuento, venta_tasa_0, venta_tasa_16, moneda, total_iva, "
-            "total_ish, retencion_isr, retencion_iva, total, serie, url_pdf, url_oc, url_rem, xml_uuid, sat"
+            "total_ish, retencion_isr, retencion_iva, total, serie, url_pdf, url_oc, url_rem, xml_uuid, sat, uuid_concepto"
         )
         
         # Definir columnas para portal_contabilidad
@@ -252,11 +272,12 @@ try:
             "total_ish, retencion_isr, retencion_iva, total, serie, url_pdf, url_oc, url_rem, xml_uuid"
         )
 
-        # Obtener datos para la tabla 'portal_desglosado'
-        data = get_filtered_data_multiselect(
-            _client=supabase_client_chatbot,
-            table_name="portal_desglosado",
-            select_columns=desglosado_columns,
+        # Obtener las líneas de 'portal_desglosado'; el concentrado se deriva localmente de ellas
+        # (o se consulta 'portal_contabilidad' en paralelo si no es posible)
+        data, data_contabilidad, concentrado_codes, tiempos_busqueda = run_invoice_search(
+            supabase_client_chatbot,
+            desglosado_columns,
+            contabilidad_columns,
             obras_seleccionadas=obras_seleccionadas,
             proveedores_seleccionados=proveedores_seleccionados,
             fecha_inicio=fecha_inicio,
@@ -264,27 +285,17 @@ try:
             estatus_seleccionados=estatus_seleccionados,
             fecha_seleccionada=fecha_seleccionada
         )
-        
-        # Obtener datos para la tabla 'portal_contabilidad'
-        data_contabilidad = get_filtered_data_multiselect(
-            _client=supabase_client_chatbot,
-            table_name="portal_contabilidad", 
-            select_columns=contabilidad_columns,  # O especificar columnas si se conocen
-            obras_seleccionadas=obras_seleccionadas, 
-            proveedores_seleccionados=proveedores_seleccionados,
-            fecha_inicio=fecha_inicio,
-            fecha_fin=fecha_fin,
-            estatus_seleccionados=estatus_seleccionados,
-            fecha_seleccionada=fecha_seleccionada
-        )
 
         # Guardar en session_state para persistencia entre reruns
+        rebase_selection_store()
         st.session_state.saved_data = data
         st.session_state.saved_data_contabilidad = data_contabilidad
+        st.session_state.saved_concentrado_codes = concentrado_codes
+        st.session_state.search_version += 1
         
         # Mostrar un mensaje de éxito si se encontraron datos
         if not data.empty:
-            st.session_state.toast_message = f'Se encontraron **{len(data_contabilidad)} facturas** que coinciden con los filtros seleccionados.'
+            st.session_state.toast_message = f'Se encontraron **{len(data_contabilidad)} facturas** que coinciden con los filtros seleccionados ({tiempos_busqueda["total"]:.1f} s).'
             st.session_state.toast_icon = '✅'  # Icono de éxito (check verde)
             # Forzar rerun para actualizar y mostrar toast
             st.rerun()
@@ -327,6 +338,15 @@ if not data.empty or not data_contabilidad.empty:
     if not st.session_state.saved_data.empty:
         st.session_state.saved_data.rename(columns=column_mapping, inplace=True, errors='ignore')
         
+    # Registro temporal: la selección guarda claves y las tablas se materializan del snapshot actual
+    selection_store = get_selection_store()
+    st.session_state.saved_selections = selection_store.view(
+        CONCENTRADO, st.session_state.saved_data_contabilidad, st.session_state.search_version
+    )
+    st.session_state.saved_selections_desglosado = selection_store.view(
+        DESGLOSADO, st.session_state.saved_data, st.session_state.search_version
+    )
+
     # Guardar dataframes renombrados en session_state para facilitar acceso desde dialogs
     st.session_state.df_desglosado = display_data_renamed.copy()
     st.session_state.df_concentrado = st.session_state.saved_data_contabilidad.copy() if not st.session_state.saved_data_contabilidad.empty else pd.DataFrame()
@@ -372,7 +392,7 @@ if not data.empty or not data_contabilidad.empty:
                 pass 
             else:
                 # Definir las columnas que no deben aparecer en las opciones de filtrado
-                excluded_columns = numeric_columns + ["Factura", "Orden de Compra", "Remisión", "Cuenta Gasto", "sat", "Serie"]
+                excluded_columns = numeric_columns + ["Factura", "Orden de Compra", "Remisión", "Cuenta Gasto", "sat", "Serie", "ID Concepto"]
                 
                 filtered_df_renamed = custom_dataframe_explorer(
                     df=display_data_renamed, 
@@ -383,7 +403,8 @@ if not data.empty or not data_contabilidad.empty:
                     numeric_columns=numeric_columns,
                     text_columns=text_columns,
                     excluded_filter_columns=excluded_columns,  # Excluir columnas especificadas
-                    container=st.sidebar  # Mostrar los filtros en la barra lateral
+                    container=st.sidebar,  # Mostrar los filtros en la barra lateral
+                    dataset_version=st.session_state.search_version
                 )
                 # Update the session state with filtered desglosado data
                 st.session_state.df_desglosado = filtered_df_renamed.copy()
@@ -413,16 +434,18 @@ if not data.empty or not data_contabilidad.empty:
                      help=f"Enlace al documento PDF ({col})",
                      width="small"
                  )
+        # El identificador de la línea solo se usa para la selección; no se muestra
+        column_config_dict["ID Concepto"] = None
         # -------------------------------------------------------
 
-        # Mostrar el dataframe filtrado CON configuración de columnas con selección habilitada
-        selection_event_desglosado = st.dataframe(
+        # Mostrar el dataframe filtrado por páginas con selección habilitada (las líneas se
+        # identifican por su etiqueta de índice, estable durante la misma búsqueda)
+        selected_keys_desglosado = paginated_dataframe(
             filtered_df_renamed,
-            use_container_width=True,
+            grid_id="desglosado_grid",
+            dataset_version=st.session_state.search_version,
             column_config=column_config_dict, # Aplicar la configuración
-            height=525,  # Aumentar la altura para aprovechar el espacio
-            on_select="rerun",
-            selection_mode="multi-row"
+            height=525  # Aumentar la altura para aprovechar el espacio
         )
 
         # Información sobre el número de filas mostradas con estilo mejorado
@@ -449,11 +472,29 @@ if not data.empty or not data_contabilidad.empty:
         # Also ensure base data_contabilidad (from main search) is available and has 'xml_uuid'
         if not filtered_df_renamed.empty and "UUID" in filtered_df_renamed.columns and \
            not data_contabilidad.empty and "UUID" in data_contabilidad.columns:
-            
-            unique_uuids_from_tab1 = filtered_df_renamed["UUID"].unique()
+            # Índice línea -> factura construido una vez por búsqueda (reutiliza los códigos del
+            # concentrado derivado localmente cuando existen)
+            cross_index_cache = st.session_state.get('uuid_cross_index')
+            if cross_index_cache is None or cross_index_cache[0] != st.session_state.search_version:
+                cross_index = UuidCrossIndex(
+                    display_data_renamed["UUID"], data_contabilidad["UUID"],
+                    st.session_state.get('saved_concentrado_codes')
+                )
+                st.session_state.uuid_cross_index = (st.session_state.search_version, cross_index)
+            else:
+                cross_index = cross_index_cache[1]
+
+            # Máscara del explorer sobre las líneas; si no corresponde al resultado mostrado se
+            # reconstruye a partir de las etiquetas del índice
+            lineas_presentes = get_filter_mask("desglosado_explorer", st.session_state.search_version)
+            if lineas_presentes is None or len(lineas_presentes) != len(display_data_renamed) or \
+               int(lineas_presentes.sum()) != len(filtered_df_renamed):
+                posiciones = display_data_renamed.index.get_indexer(filtered_df_renamed.index)
+                lineas_presentes = np.zeros(len(display_data_renamed), dtype=bool)
+                lineas_presentes[posiciones[posiciones >= 0]] = True
 
-            # Filter data_contabilidad based on the UUIDs present in tab1's filtered_df_renamed
-            data_contabilidad_for_tab2 = data_contabilidad[data_contabilidad['UUID'].isin(unique_uuids_from_tab1)].copy()
+            # Concentrado con las facturas de las líneas que pasan los filtros
+            data_contabilidad_for_tab2 = data_contabilidad.loc[cross_index.concentrado_mask(lineas_presentes)].copy()
 
         # Now, use data_contabilidad_for_tab2 to prepare filtered_concentrado for display
         if not data_contabilidad_for_tab2.empty:
@@ -502,14 +543,14 @@ if not data.empty or not data_contabilidad.empty:
         if 'saved_selections_desglosado' not in st.session_state:
             st.session_state.saved_selections_desglosado = pd.DataFrame()
         
-        # Mostrar el dataframe concentrado con selección de filas habilitada
-        selection_event = st.dataframe(
+        # Mostrar el dataframe concentrado por páginas; la selección se conserva por UUID
+        selected_keys_concentrado = paginated_dataframe(
             filtered_concentrado,
-            use_container_width=True,
+            grid_id="concentrado_grid",
+            key_column="UUID",
+            dataset_version=st.session_state.search_version,
             column_config=concentrado_config_dict,
-            height=525,
-            on_select="rerun",
-            selection_mode="multi-row"
+            height=525
         )
 
         st.info(f"📊 Mostrando {len(filtered_concentrado):,} de {len(data_contabilidad):,} facturas")
@@ -541,46 +582,22 @@ if not data.empty or not data_contabilidad.empty:
         desglosado_seleccionado = False
         
         # Verificar si hay selecciones en el dataframe concentrado
-        if selection_event.selection and len(selection_event.selection['rows']) > 0:
-            # Obtener los índices de las filas seleccionadas
-            selected_indices = selection_event.selection['rows']
-            # Filtrar el dataframe para obtener solo las filas seleccionadas
-            selected_rows = filtered_concentrado.iloc[selected_indices]
+        if selected_keys_concentrado and "UUID" in filtered_concentrado.columns:
+            # Filtrar el dataframe para obtener solo las facturas seleccionadas (en cualquier página)
+            selected_rows = filtered_concentrado[filtered_concentrado["UUID"].isin(selected_keys_concentrado)]
             
-            # Guardar las filas seleccionadas en session state
-            # Si ya hay filas guardadas, concatenar con las nuevas
-            if not st.session_state.saved_selections.empty:
-                # Concatenar sin duplicados (basado en índices o alguna columna única)
-                combined = pd.concat([st.session_state.saved_selections, selected_rows])
-                # Eliminar duplicados si existe alguna columna que sea identificador único
-                if 'xml_uuid' in combined.columns:
-                    st.session_state.saved_selections = combined.drop_duplicates(subset=['xml_uuid'])
-                else:
-                    st.session_state.saved_selections = combined.drop_duplicates()
-            else:
-                st.session_state.saved_selections = selected_rows
+            # Guardar las claves de las filas seleccionadas en el registro temporal
+            selection_store.add(CONCENTRADO, selected_rows)
                 
             concentrado_seleccionado = True
         
         # Verificar si hay selecciones en el dataframe desglosado
-        if selection_event_desglosado.selection and len(selection_event_desglosado.selection['rows']) > 0:
-            # Obtener los índices de las filas seleccionadas
-            selected_indices_desglosado = selection_event_desglosado.selection['rows']
-            # Filtrar el dataframe para obtener solo las filas seleccionadas
-            selected_rows_desglosado = filtered_df_renamed.iloc[selected_indices_desglosado]
+        if selected_keys_desglosado:
+            # Filtrar el dataframe para obtener solo las líneas seleccionadas (en cualquier página)
+            selected_rows_desglosado = filtered_df_renamed[filtered_df_renamed.index.isin(selected_keys_desglosado)]
             
-            # Guardar las filas seleccionadas en session state
-            # Si ya hay filas guardadas, concatenar con las nuevas
-            if not st.session_state.saved_selections_desglosado.empty:
-                # Concatenar sin duplicados (basado en índices o alguna columna única)
-                combined = pd.concat([st.session_state.saved_selections_desglosado, selected_rows_desglosado])
-                # Eliminar duplicados si existe alguna columna que sea identificador único
-                if 'xml_uuid' in combined.columns:
-                    st.session_state.saved_selections_desglosado = combined.drop_duplicates(subset=['xml_uuid'])
-                else:
-                    st.session_state.saved_selections_desglosado = combined.drop_duplicates()
-            else:
-                st.session_state.saved_selections_desglosado = selected_rows_desglosado
+            # Guardar las claves de las filas seleccionadas en el registro temporal
+            selection_store.add(DESGLOSADO, selected_rows_desglosado)
                 
             desglosado_seleccionado = True
         
@@ -588,9 +605,9 @@ if not data.empty or not data_contabilidad.empty:
         if concentrado_seleccionado or desglosado_seleccionado:
             mensaje = []
             if concentrado_seleccionado:
-                mensaje.append(f"{len(selection_event.selection['rows'])} facturas de Concentrado")
+                mensaje.append(f"{len(selected_rows)} facturas de Concentrado")
             if desglosado_seleccionado:
-                mensaje.append(f"{len(selection_event_desglosado.selection['rows'])} conceptos de Desglosado")
+                mensaje.append(f"{len(selected_rows_desglosado)} conceptos de Desglosado")
                 
             st.session_state.sidebar_toast_message = f"Guardadas: {' y '.join(mensaje)}"
             st.session_state.sidebar_toast_icon = '✅'  # Icono de éxito (check verde)
@@ -602,6 +619,7 @@ if not data.empty or not data_contabilidad.empty:
 
     # Botón para limpiar selección
     if col_clear.button("🗑️ Limpiar filas seleccionadas", key="clear_selection"):
+        selection_store.clear()
         st.session_state.saved_selections = pd.DataFrame()
         st.session_state.saved_selections_desglosado = pd.DataFrame()
         st.session_state.sidebar_toast_message = "Tablas temporales limpiadas correctamente"
@@ -612,55 +630,25 @@ if not data.empty or not data_contabilidad.empty:
     st.sidebar.markdown("---")
     st.sidebar.subheader("Filtros automáticos")
     
-    # Botón para filtrar y guardar facturas con descuento > 0
-    col1, col2 = st.sidebar.columns(2)
-    
-    if col2.button("🔍 Facturas con descuento", key="filter_descuento"):
+    # Bits de las reglas de INVOICE_RULES, calculados una vez por búsqueda sobre cada snapshot
+    flags_concentrado = get_rule_flags(CONCENTRADO, st.session_state.saved_data_contabilidad, st.session_state.search_version)
+    flags_desglosado = get_rule_flags(DESGLOSADO, st.session_state.saved_data, st.session_state.search_version)
+    invoice_rules = get_config("INVOICE_RULES")
+
+    def guardar_por_reglas(rule_names, mode="all"):
+        """Guarda en el registro temporal las facturas y conceptos de las vistas filtradas que cumplen las reglas."""
+        etiqueta = (" y " if mode == "all" else " o ").join(invoice_rules[name]["label"] for name in rule_names)
         try:
-            # Variables para contar facturas encontradas
-            num_facturas_concentrado = 0
-            num_facturas_desglosado = 0
-            
-            # Filtrar en dataframe concentrado
-            if 'Descuento' in filtered_concentrado.columns:
-                # Filtrar facturas con descuento > 0
-                df_con_descuento = filtered_concentrado[filtered_concentrado['Descuento'] > 0].copy()
-                num_facturas_concentrado = len(df_con_descuento)
-                
-                if num_facturas_concentrado > 0:
-                    # Guardar en el dataframe temporal
-                    if not st.session_state.saved_selections.empty:
-                        # Concatenar con selecciones existentes
-                        combined = pd.concat([st.session_state.saved_selections, df_con_descuento])
-                        # Eliminar duplicados si existe una columna identificadora única
-                        if 'xml_uuid' in combined.columns:
-                            st.session_state.saved_selections = combined.drop_duplicates(subset=['xml_uuid'])
-                        else:
-                            st.session_state.saved_selections = combined.drop_duplicates()
-                    else:
-                        # Guardar directamente si no hay selecciones previas
-                        st.session_state.saved_selections = df_con_descuento
-            
-            # Filtrar en dataframe desglosado
-            if 'Descuento' in filtered_df_renamed.columns:
-                # Filtrar facturas con descuento > 0
-                df_desglosado_con_descuento = filtered_df_renamed[filtered_df_renamed['Descuento'] > 0].copy()
-                num_facturas_desglosado = len(df_desglosado_con_descuento)
-                
-                if num_facturas_desglosado > 0:
-                    # Guardar en el dataframe temporal
-                    if not st.session_state.saved_selections_desglosado.empty:
-                        # Concatenar con selecciones existentes
-                        combined = pd.concat([st.session_state.saved_selections_desglosado, df_desglosado_con_descuento])
-                        # Eliminar duplicados si existe una columna identificadora única
-                        if 'xml_uuid' in combined.columns:
-                            st.session_state.saved_selections_desglosado = combined.drop_duplicates(subset=['xml_uuid'])
-                        else:
-                            st.session_state.saved_selections_desglosado = combined.drop_duplicates()
-                    else:
-                        # Guardar directamente si no hay selecciones previas
-                        st.session_state.saved_selections_desglosado = df_desglosado_con_descuento
-            
+            # Filtrar en Concentrado y Desglosado con los bits precalculados
+            df_concentrado_reglas = filtered_concentrado[flags_concentrado.mask(rule_names, mode, filtered_concentrado.index)]
+            df_desglosado_reglas = filtered_df_renamed[flags_desglosado.mask(rule_names, mode, filtered_df_renamed.index)]
+            num_facturas_concentrado = len(df_concentrado_reglas)
+            num_facturas_desglosado = len(df_desglosado_reglas)
+
+            # Guardar las claves en el registro temporal
+            selection_store.add(CONCENTRADO, df_concentrado_reglas)
+            selection_store.add(DESGLOSADO, df_desglosado_reglas)
+
             # Mostrar mensaje según resultados
             if num_facturas_concentrado > 0 or num_facturas_desglosado > 0:
                 mensaje = []
@@ -668,265 +656,45 @@ if not data.empty or not data_contabilidad.empty:
                     mensaje.append(f":blue[**{num_facturas_concentrado} facturas**]")
                 if num_facturas_desglosado > 0:
                     mensaje.append(f":green[**{num_facturas_desglosado} conceptos**]")
-                st.session_state.sidebar_toast_message = f"Se guardaron: {' y '.join(mensaje)} *con descuento*"
+                st.session_state.sidebar_toast_message = f"Se guardaron: {' y '.join(mensaje)} *{etiqueta}*"
                 st.session_state.sidebar_toast_icon = '✅'  # Icono de éxito
-                st.rerun()
             else:
-                st.session_state.sidebar_toast_message = "No se encontraron facturas con descuento en ninguna vista"
+                st.session_state.sidebar_toast_message = f"No se encontraron facturas {etiqueta} en ninguna vista"
                 st.session_state.sidebar_toast_icon = '⚠️'  # Icono de advertencia
-                st.rerun()
         except Exception as e:
             st.session_state.sidebar_toast_message = f"Error al filtrar: {e}"
             st.session_state.sidebar_toast_icon = '🚨'  # Icono de error
-            st.rerun()
-    
-    # Botón para filtrar y guardar facturas con retenciones (ISH, Retención IVA, Retención ISR)
+        st.rerun()
+
+    # Botones para filtrar y guardar facturas con descuento > 0 y con retenciones (ISH, Retención IVA, Retención ISR)
+    col1, col2 = st.sidebar.columns(2)
+    if col2.button("🔍 Facturas con descuento", key="filter_descuento"):
+        guardar_por_reglas(["has_descuento"])
     if col1.button("🔍 Facturas con retenciones", key="filter_retenciones"):
-        try:
-            # Variables para contar facturas encontradas
-            num_facturas_concentrado = 0
-            num_facturas_desglosado = 0
-            
-            # Filtrar en dataframe concentrado
-            columnas_retenciones = ['ISH', 'Retención IVA', 'Retención ISR']
-            
-            # Concentrado
-            columnas_existentes_concentrado = [col for col in columnas_retenciones if col in filtered_concentrado.columns]
-            if len(columnas_existentes_concentrado) > 0:
-                # Crear máscara para cada columna existente
-                mask = pd.Series([False] * len(filtered_concentrado), index=filtered_concentrado.index)
-                
-                # Sumar las máscaras para cada columna
-                for col in columnas_existentes_concentrado:
-                    mask = mask | (filtered_concentrado[col] != 0)
-                
-                # Filtrar las facturas que cumplen con al menos una condición
-                df_con_retenciones = filtered_concentrado[mask].copy()
-                num_facturas_concentrado = len(df_con_retenciones)
-                
-                if num_facturas_concentrado > 0:
-                    # Guardar en el dataframe temporal
-                    if not st.session_state.saved_selections.empty:
-                        # Concatenar con selecciones existentes
-                        combined = pd.concat([st.session_state.saved_selections, df_con_retenciones])
-                        # Eliminar duplicados si existe una columna identificadora única
-                        if 'xml_uuid' in combined.columns:
-                            st.session_state.saved_selections = combined.drop_duplicates(subset=['xml_uuid'])
-                        else:
-                            st.session_state.saved_selections = combined.drop_duplicates()
-                    else:
-                        # Guardar directamente si no hay selecciones previas
-                        st.session_state.saved_selections = df_con_retenciones
-            
-            # Desglosado
-            columnas_existentes_desglosado = [col for col in columnas_retenciones if col in filtered_df_renamed.columns]
-            if len(columnas_existentes_desglosado) > 0:
-                # Crear máscara para cada columna existente
-                mask = pd.Series([False] * len(filtered_df_renamed), index=filtered_df_renamed.index)
-                
-                # Sumar las máscaras para cada columna
-                for col in columnas_existentes_desglosado:
-                    mask = mask | (filtered_df_renamed[col] != 0)
-                
-                # Filtrar las facturas que cumplen con al menos una condición
-                df_desglosado_con_retenciones = filtered_df_renamed[mask].copy()
-                num_facturas_desglosado = len(df_desglosado_con_retenciones)
-                
-                if num_facturas_desglosado > 0:
-                    # Guardar en el dataframe temporal
-                    if not st.session_state.saved_selections_desglosado.empty:
-                        # Concatenar con selecciones existentes
-                        combined = pd.concat([st.session_state.saved_selections_desglosado, df_desglosado_con_retenciones])
-                        # Eliminar duplicados si existe una columna identificadora única
-                        if 'xml_uuid' in combined.columns:
-                            st.session_state.saved_selections_desglosado = combined.drop_duplicates(subset=['xml_uuid'])
-                        else:
-                            st.session_state.saved_selections_desglosado = combined.drop_duplicates()
-                    else:
-                        # Guardar directamente si no hay selecciones previas
-                        st.session_state.saved_selections_desglosado = df_desglosado_con_retenciones
-            
-            # Mostrar mensaje según resultados
-            if num_facturas_concentrado > 0 or num_facturas_desglosado > 0:
-                mensaje = []
-                if num_facturas_concentrado > 0:
-                    mensaje.append(f":blue[**{num_facturas_concentrado} facturas**]")
-                if num_facturas_desglosado > 0:
-                    mensaje.append(f":green[**{num_facturas_desglosado} conceptos**]")
-                st.session_state.sidebar_toast_message = f"Se guardaron: {' y '.join(mensaje)} *con retenciones*"
-                st.session_state.sidebar_toast_icon = '✅'  # Icono de éxito
-                st.rerun()
-            else:
-                st.session_state.sidebar_toast_message = "No se encontraron facturas con retenciones en ninguna vista"
-                st.session_state.sidebar_toast_icon = '⚠️'  # Icono de advertencia
-                st.rerun()
-        except Exception as e:
-            st.session_state.sidebar_toast_message = f"Error al filtrar: {e}"
-            st.session_state.sidebar_toast_icon = '🚨'  # Icono de error
-            st.rerun()
-    
-    # Botón para filtrar y guardar facturas con Tasa 0 y facturas en USD
+        guardar_por_reglas(["has_retenciones"])
+
+    # Botones para filtrar y guardar facturas con Tasa 0 y facturas en USD
     col3, col4 = st.sidebar.columns(2)
     if col3.button("🔍 Facturas con Impuesto Tasa 0", key="filter_tasa0"):
-        try:
-            # Variables para contar facturas encontradas
-            num_facturas_concentrado = 0
-            num_facturas_desglosado = 0
-            columnas_tasas = ['Venta Tasa 0%', 'Venta Tasa 16%']
-            
-            # Filtrar en Concentrado
-            columnas_existentes_concentrado = [col for col in columnas_tasas if col in filtered_concentrado.columns]
-            if len(columnas_existentes_concentrado) > 0:
-                # Crear máscaras para las condiciones
-                mask_total = pd.Series([False] * len(filtered_concentrado), index=filtered_concentrado.index)
-                
-                # Condición 1: Venta Tasa 0% > 0
-                if 'Venta Tasa 0%' in filtered_concentrado.columns:
-                    mask_tasa0_mayor_0 = filtered_concentrado['Venta Tasa 0%'] > 0
-                    mask_total = mask_total | mask_tasa0_mayor_0
-                
-                # Condición 2: Ambas tasas son 0
-                if all(col in filtered_concentrado.columns for col in columnas_tasas):
-                    mask_ambas_0 = (filtered_concentrado['Venta Tasa 0%'] == 0) & (filtered_concentrado['Venta Tasa 16%'] == 0)
-                    mask_total = mask_total | mask_ambas_0
-                
-                # Filtrar las facturas que cumplen con alguna condición
-                df_tasa0 = filtered_concentrado[mask_total].copy()
-                num_facturas_concentrado = len(df_tasa0)
-                
-                if num_facturas_concentrado > 0:
-                    # Guardar en el dataframe temporal
-                    if not st.session_state.saved_selections.empty:
-                        # Concatenar con selecciones existentes
-                        combined = pd.concat([st.session_state.saved_selections, df_tasa0])
-                        # Eliminar duplicados
-                        if 'xml_uuid' in combined.columns:
-                            st.session_state.saved_selections = combined.drop_duplicates(subset=['xml_uuid'])
-                        else:
-                            st.session_state.saved_selections = combined.drop_duplicates()
-                    else:
-                        # Guardar directamente si no hay selecciones previas
-                        st.session_state.saved_selections = df_tasa0
-            
-            # Filtrar en Desglosado
-            columnas_existentes_desglosado = [col for col in columnas_tasas if col in filtered_df_renamed.columns]
-            if len(columnas_existentes_desglosado) > 0:
-                # Crear máscaras para las condiciones
-                mask_total = pd.Series([False] * len(filtered_df_renamed), index=filtered_df_renamed.index)
-                
-                # Condición 1: Venta Tasa 0% > 0
-                if 'Venta Tasa 0%' in filtered_df_renamed.columns:
-                    mask_tasa0_mayor_0 = filtered_df_renamed['Venta Tasa 0%'] > 0
-                    mask_total = mask_total | mask_tasa0_mayor_0
-                
-                # Condición 2: Ambas tasas son 0
-                if all(col in filtered_df_renamed.columns for col in columnas_tasas):
-                    mask_ambas_0 = (filtered_df_renamed['Venta Tasa 0%'] == 0) & (filtered_df_renamed['Venta Tasa 16%'] == 0)
-                    mask_total = mask_total | mask_ambas_0
-                
-                # Filtrar las facturas que cumplen con alguna condición
-                df_desglosado_tasa0 = filtered_df_renamed[mask_total].copy()
-                num_facturas_desglosado = len(df_desglosado_tasa0)
-                
-                if num_facturas_desglosado > 0:
-                    # Guardar en el dataframe temporal
-                    if not st.session_state.saved_selections_desglosado.empty:
-                        # Concatenar con selecciones existentes
-                        combined = pd.concat([st.session_state.saved_selections_desglosado, df_desglosado_tasa0])
-                        # Eliminar duplicados
-                        if 'xml_uuid' in combined.columns:
-                            st.session_state.saved_selections_desglosado = combined.drop_duplicates(subset=['xml_uuid'])
-                        else:
-                            st.session_state.saved_selections_desglosado = combined.drop_duplicates()
-                    else:
-                        # Guardar directamente si no hay selecciones previas
-                        st.session_state.saved_selections_desglosado = df_desglosado_tasa0
-            
-            # Mostrar mensaje según resultados
-            if num_facturas_concentrado > 0 or num_facturas_desglosado > 0:
-                mensaje = []
-                if num_facturas_concentrado > 0:
-                    mensaje.append(f":blue[**{num_facturas_concentrado} facturas**]")
-                if num_facturas_desglosado > 0:
-                    mensaje.append(f":green[**{num_facturas_desglosado} conceptos**]")
-                st.session_state.sidebar_toast_message = f"Se guardaron: {' y '.join(mensaje)} *con Tasa 0*"
-                st.session_state.sidebar_toast_icon = '✅'  # Icono de éxito
-                st.rerun()
-            else:
-                st.session_state.sidebar_toast_message = "No se encontraron facturas que cumplan las condiciones de Impuesto Tasa 0"
-                st.session_state.sidebar_toast_icon = '⚠️'  # Icono de advertencia
-                st.rerun()
-        except Exception as e:
-            st.session_state.sidebar_toast_message = f"Error al filtrar: {e}"
-            st.session_state.sidebar_toast_icon = '🚨'  # Icono de error
-            st.rerun()
-    
-    # Botón para filtrar y guardar facturas en moneda USD
+        guardar_por_reglas(["tasa_0"])
     if col4.button("💲 Facturas con moneda en USD", key="filter_usd"):
-        try:
-            # Variables para contar facturas encontradas
-            num_facturas_concentrado = 0
-            num_facturas_desglosado = 0
-            
-            # Filtrar en Concentrado
-            if 'Moneda' in filtered_concentrado.columns:
-                # Filtrar facturas en USD
-                df_usd = filtered_concentrado[filtered_concentrado['Moneda'] == 'USD'].copy()
-                num_facturas_concentrado = len(df_usd)
-                
-                if num_facturas_concentrado > 0:
-                    # Guardar en el dataframe temporal
-                    if not st.session_state.saved_selections.empty:
-                        # Concatenar con selecciones existentes
-                        combined = pd.concat([st.session_state.saved_selections, df_usd])
-                        # Eliminar duplicados
-                        if 'xml_uuid' in combined.columns:
-                            st.session_state.saved_selections = combined.drop_duplicates(subset=['xml_uuid'])
-                        else:
-                            st.session_state.saved_selections = combined.drop_duplicates()
-                    else:
-                        # Guardar directamente si no hay selecciones previas
-                        st.session_state.saved_selections = df_usd
-            
-            # Filtrar en Desglosado
-            if 'Moneda' in filtered_df_renamed.columns:
-                # Filtrar facturas en USD
-                df_desglosado_usd = filtered_df_renamed[filtered_df_renamed['Moneda'] == 'USD'].copy()
-                num_facturas_desglosado = len(df_desglosado_usd)
-                
-                if num_facturas_desglosado > 0:
-                    # Guardar en el dataframe temporal
-                    if not st.session_state.saved_selections_desglosado.empty:
-                        # Concatenar con selecciones existentes
-                        combined = pd.concat([st.session_state.saved_selections_desglosado, df_desglosado_usd])
-                        # Eliminar duplicados
-                        if 'xml_uuid' in combined.columns:
-                            st.session_state.saved_selections_desglosado = combined.drop_duplicates(subset=['xml_uuid'])
-                        else:
-                            st.session_state.saved_selections_desglosado = combined.drop_duplicates()
-                    else:
-                        # Guardar directamente si no hay selecciones previas
-                        st.session_state.saved_selections_desglosado = df_desglosado_usd
-            
-            # Mostrar mensaje según resultados
-            if num_facturas_concentrado > 0 or num_facturas_desglosado > 0:
-                mensaje = []
-                if num_facturas_concentrado > 0:
-                    mensaje.append(f":blue[**{num_facturas_concentrado} facturas**]")
-                if num_facturas_desglosado > 0:
-                    mensaje.append(f":green[**{num_facturas_desglosado} conceptos**]")
-                st.session_state.sidebar_toast_message = f"Se guardaron: {' y '.join(mensaje)} *en USD*"
-                st.session_state.sidebar_toast_icon = '✅'  # Icono de éxito
-                st.rerun()
-            else:
-                st.session_state.sidebar_toast_message = "No se encontraron facturas en USD en ninguna vista"
-                st.session_state.sidebar_toast_icon = '⚠️'  # Icono de advertencia
-                st.rerun()
-        except Exception as e:
-            st.session_state.sidebar_toast_message = f"Error al filtrar: {e}"
-            st.session_state.sidebar_toast_icon = '🚨'  # Icono de error
-            st.rerun()
-    
+        guardar_por_reglas(["moneda_usd"])
+
+    # Combinación libre de reglas (incluye las que no tienen botón propio)
+    reglas_seleccionadas = st.sidebar.multiselect(
+        "Combinar reglas",
+        options=list(invoice_rules),
+        format_func=lambda name: invoice_rules[name]["label"],
+        placeholder="Selecciona reglas",
+        key="rules_combination"
+    )
+    modo_reglas = st.sidebar.radio(
+        "Las facturas deben cumplir", options=["all", "any"], horizontal=True,
+        format_func=lambda mode: "todas" if mode == "all" else "alguna", key="rules_mode"
+    )
+    if st.sidebar.button("🔍 Guardar facturas que cumplen las reglas", key="filter_rules", disabled=not reglas_seleccionadas):
+        guardar_por_reglas(reglas_seleccionadas, modo_reglas)
+
     # Separador para sección de descargas
     st.sidebar.markdown("---")
     st.sidebar.subheader("Descargas")
@@ -0,0 +1,126 @@
+-- Búsqueda de Base de Datos por rango de fechas sin tipo de fecha seleccionado.
+--
+-- El filtro original es un OR entre cuatro rangos (fecha_factura, fecha_recepcion,
+-- fecha_pagada, fecha_autorizacion), que Postgres no puede resolver con un solo índice.
+-- Estas funciones lo reescriben como UNION ALL de cuatro escaneos por rango de índice; cada
+-- rama excluye las filas que ya cubre una rama anterior, así que no hace falta deduplicar y
+-- el resultado es exactamente el del OR. Los filtros de obra (cuenta_gasto), proveedor y
+-- estatus se aplican dentro de cada rama.
+--
+-- Uso desde la aplicación: utils/chatbot_supabase.py (config DATE_OR_SEARCH_RPC).
+-- Benchmark: scripts/benchmark_busqueda_fechas.py
+
+-- Índices de apoyo ------------------------------------------------------------
+
+create index if not exists portal_desglosado_fecha_factura_idx on portal_desglosado (fecha_factura);
+create index if not exists portal_desglosado_fecha_recepcion_idx on portal_desglosado (fecha_recepcion);
+create index if not exists portal_desglosado_fecha_pagada_idx on portal_desglosado (fecha_pagada);
+create index if not exists portal_desglosado_fecha_autorizacion_idx on portal_desglosado (fecha_autorizacion);
+
+create index if not exists portal_contabilidad_fecha_factura_idx on portal_contabilidad (fecha_factura);
+create index if not exists portal_contabilidad_fecha_recepcion_idx on portal_contabilidad (fecha_recepcion);
+create index if not exists portal_contabilidad_fecha_pagada_idx on portal_contabilidad (fecha_pagada);
+create index if not exists portal_contabilidad_fecha_autorizacion_idx on portal_contabilidad (fecha_autorizacion);
+
+-- portal_desglosado -----------------------------------------------------------
+
+create or replace function buscar_portal_desglosado_por_fechas(
+    p_inicio timestamptz,
+    p_fin timestamptz,
+    p_cuentas_gasto text[] default null,
+    p_proveedores text[] default null,
+    p_estatus text[] default null
+)
+returns setof portal_desglosado
+language sql
+stable
+as $$
+    select d.* from portal_desglosado d
+    where d.fecha_factura between p_inicio and p_fin
+      and (p_cuentas_gasto is null or d.cuenta_gasto::text = any(p_cuentas_gasto))
+      and (p_proveedores is null or d.proveedor = any(p_proveedores))
+      and (p_estatus is null or d.estatus = any(p_estatus))
+
+    union all
+
+    select d.* from portal_desglosado d
+    where d.fecha_recepcion between p_inicio and p_fin
+      and (d.fecha_factura between p_inicio and p_fin) is not true
+      and (p_cuentas_gasto is null or d.cuenta_gasto::text = any(p_cuentas_gasto))
+      and (p_proveedores is null or d.proveedor = any(p_proveedores))
+      and (p_estatus is null or d.estatus = any(p_estatus))
+
+    union all
+
+    select d.* from portal_desglosado d
+    where d.fecha_pagada between p_inicio and p_fin
+      and (d.fecha_factura between p_inicio and p_fin) is not true
+      and (d.fecha_recepcion between p_inicio and p_fin) is not true
+      and (p_cuentas_gasto is null or d.cuenta_gasto::text = any(p_cuentas_gasto))
+      and (p_proveedores is null or d.proveedor = any(p_proveedores))
+      and (p_estatus is null or d.estatus = any(p_estatus))
+
+    union all
+
+    select d.* from portal_desglosado d
+    where d.fecha_autorizacion between p_inicio and p_fin
+      and (d.fecha_factura between p_inicio and p_fin) is not true
+      and (d.fecha_recepcion between p_inicio and p_fin) is not true
+      and (d.fecha_pagada between p_inicio and p_fin) is not true
+      and (p_cuentas_gasto is null or d.cuenta_gasto::text = any(p_cuentas_gasto))
+      and (p_proveedores is null or d.proveedor = any(p_proveedores))
+      and (p_estatus is null or d.estatus = any(p_estatus))
+$$;
+
+-- portal_contabilidad ---------------------------------------------------------
+
+create or replace function buscar_portal_contabilidad_por_fechas(
+    p_inicio timestamptz,
+    p_fin timestamptz,
+    p_cuentas_gasto text[] default null,
+    p_proveedores text[] default null,
+    p_estatus text[] default null
+)
+returns setof portal_contabilidad
+language sql
+stable
+as $$
+    select c.* from portal_contabilidad c
+    where c.fecha_factura between p_inicio and p_fin
+      and (p_cuentas_gasto is null or c.cuenta_gasto::text = any(p_cuentas_gasto))
+      and (p_proveedores is null or c.proveedor = any(p_proveedores))
+      and (p_estatus is null or c.estatus = any(p_estatus))
+
+    union all
+
+    select c.* from portal_contabilidad c
+    where c.fecha_recepcion between p_inicio and p_fin
+      and (c.fecha_factura between p_inicio and p_fin) is not true
+      and (p_cuentas_gasto is null or c.cuenta_gasto::text = any(p_cuentas_gasto))
+      and (p_proveedores is null or c.proveedor = any(p_proveedores))
+      and (p_estatus is null or c.estatus = any(p_estatus))
+
+    union all
+
+    select c.* from portal_contabilidad c
+    where c.fecha_pagada between p_inicio and p_fin
+      and (c.fecha_factura between p_inicio and p_fin) is not true
+      and (c.fecha_recepcion between p_inicio and p_fin) is not true
+      and (p_cuentas_gasto is null or c.cuenta_gasto::text = any(p_cuentas_gasto))
+      and (p_proveedores is null or c.proveedor = any(p_proveedores))
+      and (p_estatus is null or c.estatus = any(p_estatus))
+
+    union all
+
+    select c.* from portal_contabilidad c
+    where c.fecha_autorizacion between p_inicio and p_fin
+      and (c.fecha_factura between p_inicio and p_fin) is not true
+      and (c.fecha_recepcion between p_inicio and p_fin) is not true
+      and (c.fecha_pagada between p_inicio and p_fin) is not true
+      and (p_cuentas_gasto is null or c.cuenta_gasto::text = any(p_cuentas_gasto))
+      and (p_proveedores is null or c.proveedor = any(p_proveedores))
+      and (p_estatus is null or c.estatus = any(p_estatus))
+$$;
+
+grant execute on function buscar_portal_desglosado_por_fechas(timestamptz, timestamptz, text[], text[], text[]) to anon, authenticated;
+grant execute on function buscar_portal_contabilidad_por_fechas(timestamptz, timestamptz, text[], text[], text[]) to anon, authenticated;
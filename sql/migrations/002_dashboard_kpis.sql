@@ -0,0 +1,39 @@
+-- KPIs del dashboard (pages/0_Dashboard.py) calculados en el servidor.
+--
+-- Sustituye las descargas completas de las columnas obra, subtotal y subcategoria (limitadas
+-- además por max-rows de PostgREST) por un solo recorrido agregado de portal_desglosado.
+-- Devuelve un único objeto JSON pequeño con las seis métricas de las tarjetas.
+
+create or replace function get_dashboard_kpis()
+returns json
+language sql
+stable
+as $$
+    with desglosado as (
+        select
+            count(distinct obra) as obras_count,
+            coalesce(sum(subtotal), 0) as total_facturado,
+            count(*) as total_conceptos,
+            max(fecha_factura) as ultima_factura
+        from portal_desglosado
+    ),
+    top_subcategorias as (
+        select subcategoria
+        from portal_desglosado
+        where subcategoria is not null and subcategoria <> ''
+        group by subcategoria
+        order by count(*) desc, subcategoria
+        limit 2
+    )
+    select json_build_object(
+        'obras_count', d.obras_count,
+        'total_facturado', d.total_facturado,
+        'total_conceptos', d.total_conceptos,
+        'ultima_factura', d.ultima_factura,
+        'ultimo_registro', (select max(fecha_consulta) from portal_concentrado),
+        'top_subcategorias', coalesce((select json_agg(subcategoria) from top_subcategorias), '[]'::json)
+    )
+    from desglosado d
+$$;
+
+grant execute on function get_dashboard_kpis() to anon, authenticated;
@@ -0,0 +1,92 @@
+-- Snapshot diario de los KPIs del dashboard.
+--
+-- refresh_dashboard_kpis_snapshot() calcula la fila del día en el servidor (los mismos
+-- agregados que get_dashboard_kpis más los contadores por subcategoría) y hace upsert.
+-- ImprovedDataLoader la llama al terminar de cargar portal_desglosado/portal_concentrado.
+-- El dashboard lee la fila más reciente (lectura O(1)) y la tabla conserva el histórico día
+-- a día sin volver a recorrer portal_desglosado.
+--
+-- Los clientes (anon, authenticated) solo pueden leer la tabla; la escritura pasa
+-- exclusivamente por la función security definer, así que nadie puede publicar valores
+-- arbitrarios con la llave anónima.
+
+create table if not exists dashboard_kpis (
+    snapshot_date date primary key,
+    obras_count integer not null,
+    total_facturado numeric not null,
+    total_conceptos bigint not null,
+    ultima_factura timestamptz,
+    ultimo_registro timestamptz,
+    top_subcategorias jsonb not null default '[]'::jsonb,
+    subcategoria_counts jsonb not null default '{}'::jsonb,
+    updated_at timestamptz not null default now()
+);
+
+create index if not exists dashboard_kpis_updated_at_idx on dashboard_kpis (updated_at desc);
+
+alter table dashboard_kpis enable row level security;
+
+create policy "dashboard_kpis lectura" on dashboard_kpis
+    for select to anon, authenticated using (true);
+
+create or replace function refresh_dashboard_kpis_snapshot()
+returns void
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    -- Evita recorrer portal_desglosado más de una vez cada 5 minutos
+    if exists (
+        select 1 from dashboard_kpis
+        where snapshot_date = current_date and updated_at > now() - interval '5 minutes'
+    ) then
+        return;
+    end if;
+
+    with desglosado as (
+        select
+            count(distinct obra) as obras_count,
+            coalesce(sum(subtotal), 0) as total_facturado,
+            count(*) as total_conceptos,
+            max(fecha_factura) as ultima_factura
+        from portal_desglosado
+    ),
+    subcategorias as (
+        select subcategoria, count(*) as n
+        from portal_desglosado
+        where subcategoria is not null and subcategoria <> ''
+        group by subcategoria
+    )
+    insert into dashboard_kpis (
+        snapshot_date, obras_count, total_facturado, total_conceptos, ultima_factura,
+        ultimo_registro, top_subcategorias, subcategoria_counts, updated_at
+    )
+    select
+        current_date,
+        d.obras_count,
+        d.total_facturado,
+        d.total_conceptos,
+        d.ultima_factura,
+        (select max(fecha_consulta) from portal_concentrado),
+        coalesce((
+            select jsonb_agg(top.subcategoria order by top.n desc, top.subcategoria)
+            from (select subcategoria, n from subcategorias order by n desc, subcategoria limit 2) top
+        ), '[]'::jsonb),
+        coalesce((select jsonb_object_agg(subcategoria, n) from subcategorias), '{}'::jsonb),
+        now()
+    from desglosado d
+    on conflict (snapshot_date) do update set
+        obras_count = excluded.obras_count,
+        total_facturado = excluded.total_facturado,
+        total_conceptos = excluded.total_conceptos,
+        ultima_factura = excluded.ultima_factura,
+        ultimo_registro = excluded.ultimo_registro,
+        top_subcategorias = excluded.top_subcategorias,
+        subcategoria_counts = excluded.subcategoria_counts,
+        updated_at = excluded.updated_at;
+end;
+$$;
+
+revoke all on function refresh_dashboard_kpis_snapshot() from public;
+grant execute on function refresh_dashboard_kpis_snapshot() to anon, authenticated;
@@ -0,0 +1,208 @@
+-- Contadores incrementales de los KPIs del dashboard.
+--
+-- Sustituye el recorrido completo de portal_desglosado de refresh_dashboard_kpis_snapshot()
+-- (003) por contadores que se actualizan con los deltas de cada sentencia sobre la tabla:
+--   * dashboard_kpi_obras: líneas por obra (el número de obras es el número de filas)
+--   * dashboard_kpi_subcategorias: líneas por subcategoría (top y contadores del histórico)
+--   * dashboard_kpi_totales: subtotal acumulado, número de conceptos y última fecha de factura
+-- Los disparadores son por sentencia y leen las tablas de transición, así que una carga por
+-- lotes actualiza los contadores una vez por lote y no una vez por fila. Al final de cada
+-- sentencia se actualiza la fila del día de dashboard_kpis leyendo solo los contadores.
+
+-- Evita que se inserten filas entre la siembra de los contadores y la creación de los disparadores
+lock table portal_desglosado in share row exclusive mode;
+
+create table if not exists dashboard_kpi_obras (
+    obra text primary key,
+    lineas bigint not null
+);
+
+create table if not exists dashboard_kpi_subcategorias (
+    subcategoria text primary key,
+    lineas bigint not null
+);
+
+create table if not exists dashboard_kpi_totales (
+    id smallint primary key default 1 check (id = 1),
+    total_facturado numeric not null default 0,
+    total_conceptos bigint not null default 0,
+    ultima_factura timestamptz
+);
+
+-- Solo las funciones security definer escriben en los contadores
+alter table dashboard_kpi_obras enable row level security;
+alter table dashboard_kpi_subcategorias enable row level security;
+alter table dashboard_kpi_totales enable row level security;
+
+create index if not exists portal_concentrado_fecha_consulta_idx on portal_concentrado (fecha_consulta);
+
+-- Siembra: el único recorrido completo de portal_desglosado
+truncate dashboard_kpi_obras, dashboard_kpi_subcategorias, dashboard_kpi_totales;
+
+insert into dashboard_kpi_obras (obra, lineas)
+select obra, count(*) from portal_desglosado where obra is not null group by obra;
+
+insert into dashboard_kpi_subcategorias (subcategoria, lineas)
+select subcategoria, count(*)
+from portal_desglosado
+where subcategoria is not null and subcategoria <> ''
+group by subcategoria;
+
+insert into dashboard_kpi_totales (id, total_facturado, total_conceptos, ultima_factura)
+select 1, coalesce(sum(subtotal), 0), count(*), max(fecha_factura) from portal_desglosado;
+
+
+create or replace function refresh_dashboard_kpis_snapshot()
+returns void
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    -- Solo lee los contadores (tamaño proporcional a obras y subcategorías, no a líneas)
+    insert into dashboard_kpis (
+        snapshot_date, obras_count, total_facturado, total_conceptos, ultima_factura,
+        ultimo_registro, top_subcategorias, subcategoria_counts, updated_at
+    )
+    select
+        current_date,
+        (select count(*) from dashboard_kpi_obras),
+        t.total_facturado,
+        t.total_conceptos,
+        t.ultima_factura,
+        (select max(fecha_consulta) from portal_concentrado),
+        coalesce((
+            select jsonb_agg(top.subcategoria order by top.lineas desc, top.subcategoria)
+            from (
+                select subcategoria, lineas from dashboard_kpi_subcategorias
+                order by lineas desc, subcategoria limit 2
+            ) top
+        ), '[]'::jsonb),
+        coalesce((select jsonb_object_agg(subcategoria, lineas) from dashboard_kpi_subcategorias), '{}'::jsonb),
+        now()
+    from dashboard_kpi_totales t
+    where t.id = 1
+    on conflict (snapshot_date) do update set
+        obras_count = excluded.obras_count,
+        total_facturado = excluded.total_facturado,
+        total_conceptos = excluded.total_conceptos,
+        ultima_factura = excluded.ultima_factura,
+        ultimo_registro = excluded.ultimo_registro,
+        top_subcategorias = excluded.top_subcategorias,
+        subcategoria_counts = excluded.subcategoria_counts,
+        updated_at = excluded.updated_at;
+end;
+$$;
+
+revoke all on function refresh_dashboard_kpis_snapshot() from public;
+grant execute on function refresh_dashboard_kpis_snapshot() to anon, authenticated;
+
+
+create or replace function dashboard_kpis_aplicar_delta()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    delta text;
+begin
+    -- Filas agregadas cuentan +1 y filas eliminadas -1; un update es ambas cosas
+    if TG_OP = 'INSERT' then
+        delta := 'select obra, subcategoria, subtotal, fecha_factura, 1 as signo from nuevas';
+    elsif TG_OP = 'DELETE' then
+        delta := 'select obra, subcategoria, subtotal, fecha_factura, -1 as signo from viejas';
+    else
+        delta := 'select obra, subcategoria, subtotal, fecha_factura, 1 as signo from nuevas
+                  union all
+                  select obra, subcategoria, subtotal, fecha_factura, -1 as signo from viejas';
+    end if;
+
+    execute format($q$
+        with delta as (%s)
+        insert into dashboard_kpi_obras as o (obra, lineas)
+        select obra, sum(signo) from delta where obra is not null group by obra having sum(signo) <> 0
+        on conflict (obra) do update set lineas = o.lineas + excluded.lineas
+    $q$, delta);
+    delete from dashboard_kpi_obras where lineas <= 0;
+
+    execute format($q$
+        with delta as (%s)
+        insert into dashboard_kpi_subcategorias as s (subcategoria, lineas)
+        select subcategoria, sum(signo)
+        from delta
+        where subcategoria is not null and subcategoria <> ''
+        group by subcategoria
+        having sum(signo) <> 0
+        on conflict (subcategoria) do update set lineas = s.lineas + excluded.lineas
+    $q$, delta);
+    delete from dashboard_kpi_subcategorias where lineas <= 0;
+
+    execute format($q$
+        with delta as (%s)
+        update dashboard_kpi_totales t set
+            total_facturado = t.total_facturado + d.subtotal,
+            total_conceptos = t.total_conceptos + d.conceptos,
+            ultima_factura = case
+                -- Se eliminó (o cambió) la factura más reciente: se vuelve a leer el máximo por índice
+                when d.max_eliminada is not null and d.max_eliminada >= t.ultima_factura
+                    then (select max(fecha_factura) from portal_desglosado)
+                else greatest(t.ultima_factura, d.max_agregada)
+            end
+        from (
+            select
+                coalesce(sum(signo * coalesce(subtotal, 0)), 0) as subtotal,
+                coalesce(sum(signo), 0) as conceptos,
+                max(fecha_factura) filter (where signo > 0) as max_agregada,
+                max(fecha_factura) filter (where signo < 0) as max_eliminada
+            from delta
+        ) d
+        where t.id = 1
+    $q$, delta);
+
+    perform refresh_dashboard_kpis_snapshot();
+    return null;
+end;
+$$;
+
+create or replace function dashboard_kpis_reiniciar()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    -- TRUNCATE no pasa por los disparadores de delete
+    delete from dashboard_kpi_obras;
+    delete from dashboard_kpi_subcategorias;
+    update dashboard_kpi_totales set total_facturado = 0, total_conceptos = 0, ultima_factura = null where id = 1;
+    perform refresh_dashboard_kpis_snapshot();
+    return null;
+end;
+$$;
+
+-- Una tabla de transición solo puede declararse en disparadores de un solo evento
+drop trigger if exists dashboard_kpis_insert on portal_desglosado;
+create trigger dashboard_kpis_insert
+    after insert on portal_desglosado
+    referencing new table as nuevas
+    for each statement execute function dashboard_kpis_aplicar_delta();
+
+drop trigger if exists dashboard_kpis_update on portal_desglosado;
+create trigger dashboard_kpis_update
+    after update on portal_desglosado
+    referencing old table as viejas new table as nuevas
+    for each statement execute function dashboard_kpis_aplicar_delta();
+
+drop trigger if exists dashboard_kpis_delete on portal_desglosado;
+create trigger dashboard_kpis_delete
+    after delete on portal_desglosado
+    referencing old table as viejas
+    for each statement execute function dashboard_kpis_aplicar_delta();
+
+drop trigger if exists dashboard_kpis_truncate on portal_desglosado;
+create trigger dashboard_kpis_truncate
+    after truncate on portal_desglosado
+    for each statement execute function dashboard_kpis_reiniciar();
+
+select refresh_dashboard_kpis_snapshot();
@@ -0,0 +1,167 @@
+import re
+
+import pandas as pd
+
+from utils.config import get_config
+
+AGGREGATE_FUNCTIONS = {"sum", "count", "avg", "min", "max"}
+
+# Dimensiones calculadas: alias -> expresión SQL (el mes coincide con spend_cube.month_start)
+DERIVED_DIMENSIONS = {
+    "mes": "date_trunc('month', fecha_factura at time zone 'UTC')",
+}
+
+_IDENTIFIER = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+
+def _identifier(name):
+    """Valida un nombre de tabla/columna; los nombres nunca se interpolan sin validar."""
+    if not isinstance(name, str) or not _IDENTIFIER.match(name):
+        raise ValueError(f"Identificador no válido: {name!r}")
+    return name
+
+
+def _literal(value):
+    """Literal SQL para un valor de filtro."""
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def build_aggregate_sql(table, group_by, measures, filters=None, not_null=None, order_by=None, limit=None):
+    """Genera la consulta GROUP BY de una agregación.
+
+    Args:
+        table: Tabla a consultar
+        group_by: Lista de dimensiones (columnas o alias de DERIVED_DIMENSIONS)
+        measures: Diccionario {alias: (función, columna)}; columna "*" solo con count
+        filters: Diccionario {columna: lista de valores} combinados con AND (listas vacías se ignoran)
+        not_null: Dimensiones que deben excluir los valores nulos
+        order_by: Lista de (alias, "asc"|"desc")
+        limit: Máximo de filas agregadas a devolver
+
+    Returns:
+        Cadena SQL
+    """
+    select_parts, group_parts = [], []
+    for i, dimension in enumerate(group_by, start=1):
+        expression = DERIVED_DIMENSIONS.get(dimension) or _identifier(dimension)
+        select_parts.append(f"{expression} as {_identifier(dimension)}")
+        group_parts.append(str(i))
+
+    for alias, (function, column) in measures.items():
+        if function not in AGGREGATE_FUNCTIONS:
+            raise ValueError(f"Función de agregación no soportada: {function}")
+        if column == "*":
+            if function != "count":
+                raise ValueError("Solo count admite '*'")
+            argument = "*"
+        elif function in ("sum", "avg"):
+            argument = f"{_identifier(column)}::numeric"
+        else:
+            argument = _identifier(column)
+        select_parts.append(f"{function}({argument}) as {_identifier(alias)}")
+
+    conditions = []
+    for column, values in (filters or {}).items():
+        if values:
+            conditions.append(f"{_identifier(column)} in ({', '.join(_literal(v) for v in values)})")
+    for dimension in not_null or []:
+        conditions.append(f"{DERIVED_DIMENSIONS.get(dimension) or _identifier(dimension)} is not null")
+
+    sql = f"select {', '.join(select_parts)} from {_identifier(table)}"
+    if conditions:
+        sql += " where " + " and ".join(conditions)
+    if group_parts:
+        sql += " group by " + ", ".join(group_parts)
+    if order_by:
+        sql += " order by " + ", ".join(
+            f"{_identifier(alias)} {'desc' if direction == 'desc' else 'asc'}" for alias, direction in order_by
+        )
+    if limit:
+        sql += f" limit {int(limit)}"
+    return sql
+
+
+def aggregate(client, table, group_by, measures, filters=None, not_null=None, order_by=None, limit=None):
+    """Ejecuta una agregación en la base de datos y devuelve solo las filas agregadas.
+
+    La consulta se genera con build_aggregate_sql y se ejecuta con la RPC configurada en
+    AGGREGATE_RPC (execute_sql, la misma que usa el chatbot).
+
+    Args:
+        client: Cliente Supabase
+        table, group_by, measures, filters, not_null, order_by, limit: Ver build_aggregate_sql
+
+    Returns:
+        DataFrame con una columna por dimensión y medida (fechas y medidas ya convertidas),
+        o None si la consulta falla
+    """
+    sql = build_aggregate_sql(table, group_by, measures, filters, not_null, order_by, limit)
+    try:
+        response = client.rpc(get_config("AGGREGATE_RPC"), {"query": sql}).execute()
+        rows = response.data
+    except Exception as e:
+        # execute_sql informa una consulta sin filas como excepción con este mensaje
+        if "Query executed successfully" in str(e):
+            rows = []
+        else:
+            print(f"DEBUG - Error en la agregación ({sql}): {e}")
+            return None
+
+    if isinstance(rows, dict) and "error" in rows:
+        print(f"DEBUG - Error en la agregación ({sql}): {rows.get('error')}")
+        return None
+
+    df = pd.DataFrame(rows or [], columns=list(group_by) + list(measures))
+    for dimension in group_by:
+        if dimension in DERIVED_DIMENSIONS:
+            df[dimension] = pd.to_datetime(df[dimension], errors="coerce")
+    for alias in measures:
+        df[alias] = pd.to_numeric(df[alias], errors="coerce")
+    return df
+
+
+class DatabaseRollup:
+    """Consultas de las gráficas de visualización resueltas con GROUP BY en la base de datos.
+
+    Ofrece la misma interfaz que spend_cube.CubeRollup: cada gráfica transfiere solo sus filas
+    agregadas en lugar de todas las líneas de factura que cumplen los filtros.
+    """
+
+    MEASURES = {"total": ("sum", "total"), "count": ("count", "total")}
+
+    def __init__(self, client, categorias=None, subcategorias=None, cuentas_gasto=None):
+        self.client = client
+        self.table = get_config("DESGLOSADO")
+        self.filters = {"categoria_id": categorias, "subcategoria": subcategorias, "cuenta_gasto": cuentas_gasto}
+
+    def line_count(self):
+        """Número de líneas que cumplen los filtros, o None si la base de datos no responde."""
+        df = aggregate(self.client, self.table, [], {"line_count": ("count", "*")}, self.filters)
+        if df is None or df.empty:
+            return None
+        return int(df["line_count"].iloc[0])
+
+    def rollup(self, dimensions, where=None):
+        """Total, número de importes y promedio de `total` por las dimensiones indicadas.
+
+        Args:
+            dimensions: Lista de dimensiones (columnas o "mes")
+            where: Filtros adicionales {columna: valores}
+
+        Returns:
+            DataFrame con las dimensiones y las columnas total, count y mean
+        """
+        filters = dict(self.filters)
+        for column, values in (where or {}).items():
+            filters[column] = values
+        df = aggregate(self.client, self.table, list(dimensions), self.MEASURES, filters, not_null=list(dimensions))
+        if df is None:
+            df = pd.DataFrame(columns=list(dimensions) + list(self.MEASURES))
+        df["mean"] = df["total"] / df["count"].where(df["count"] > 0)
+        return df
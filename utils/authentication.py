@@ -166,6 +166,10 @@ class Authentication:
         
         # Usamos un único botón con emoji en lugar de SVG
         if st.sidebar.button("⇠ Cerrar Sesión", key="logout_button", use_container_width=True):
+            # Stop any data load still running for this session
+            cancel_event = st.session_state.get('load_cancel_event')
+            if cancel_event is not None:
+                cancel_event.set()
             self.supabase_auth.sign_out()
             # Clear session state
             st.session_state['authenticated'] = False
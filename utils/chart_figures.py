@@ -0,0 +1,177 @@
+import plotly.express as px
+
+from utils.config import get_config
+from utils.downsampling import downsample_trend
+
+OTROS = "Otros"
+MIN_CATEGORIES = 5
+
+
+def trim_categories(df, column, max_categories, sum_columns, keys=()):
+    """Conserva las max_categories categorías con mayor total y agrupa el resto en "Otros".
+
+    Args:
+        df: DataFrame agregado
+        column: Columna categórica a recortar (por ejemplo 'obra')
+        max_categories: Número de categorías que se conservan por nombre
+        sum_columns: Columnas aditivas que se suman al agrupar (la primera ordena las categorías)
+        keys: Otras columnas que identifican una fila (por ejemplo 'categoria_id')
+
+    Returns:
+        DataFrame con a lo más max_categories + 1 valores distintos en column
+    """
+    if df.empty or df[column].nunique() <= max_categories:
+        return df
+    ranking = df.groupby(column, observed=True)[sum_columns[0]].sum().abs().sort_values(ascending=False)
+    keep = set(ranking.index[:max_categories])
+    df = df.assign(**{column: df[column].where(df[column].isin(keep), OTROS)})
+    return df.groupby(list(keys) + [column], sort=False, observed=True)[list(sum_columns)].sum().reset_index()
+
+
+def round_numeric(df, decimals=None):
+    """Redondea las columnas numéricas para no enviar decimales que la gráfica no muestra."""
+    if decimals is None:
+        decimals = get_config("CHART_DECIMALS")
+    return df.round(decimals)
+
+
+def payload_size(fig):
+    """Tamaño en bytes del JSON de la figura que se envía al navegador."""
+    return len(fig.to_json())
+
+
+def build_within_budget(name, build, max_categories=None):
+    """Construye una figura respetando CHART_PAYLOAD_BUDGET.
+
+    build(max_categories) debe devolver la figura con a lo más ese número de categorías; si el
+    JSON excede el presupuesto se reconstruye con la mitad de categorías (mínimo MIN_CATEGORIES).
+    El tamaño final se registra por gráfica.
+    """
+    budget = get_config("CHART_PAYLOAD_BUDGET")
+    if max_categories is None:
+        max_categories = get_config("CHART_MAX_CATEGORIES")
+    while True:
+        fig = build(max_categories)
+        size = payload_size(fig)
+        if size <= budget or max_categories <= MIN_CATEGORIES:
+            break
+        max_categories = max(MIN_CATEGORIES, max_categories // 2)
+    print(f"DEBUG - Payload gráfica {name}: {size / 1024:.1f} KB ({max_categories} categorías máx.)")
+    return fig
+
+
+def build_bar_figure(bar_chart_data, title):
+    """Barras agrupadas de total por categoría, coloreadas por obra (obras menores en "Otros")."""
+    def build(max_categories):
+        data = trim_categories(bar_chart_data, 'obra', max_categories, ['total'], keys=['categoria_id'])
+        fig_bar = px.bar(
+            round_numeric(data),
+            x='categoria_id',  # Usar categoría como eje X
+            y='total',
+            color='obra',  # Colorear por obra
+            barmode='group',  # Barras agrupadas (no apiladas)
+            title=title,
+            labels={'categoria_id': 'Categoría', 'total': 'Total', 'obra': 'Obra'},
+        )
+        # Ajustar el diseño para mejorar la visualización
+        fig_bar.update_layout(
+            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+            margin=dict(t=100),  # Mayor margen superior para la leyenda
+            xaxis_title="Categoría"
+        )
+        return fig_bar
+
+    return build_within_budget("barras", build)
+
+
+def build_line_figure(line_data, title, max_points=None):
+    """Tendencia del total promedio por mes, una línea por obra.
+
+    Antes de graficar, cada traza se re-muestrea y se reduce con LTTB a como máximo
+    max_points puntos (por defecto LINE_MAX_POINTS_PER_TRACE). Las trazas usan WebGL.
+    """
+    if max_points is None:
+        max_points = get_config("LINE_MAX_POINTS_PER_TRACE")
+
+    def build(max_categories):
+        # Las obras menores se suman en "Otros" antes de re-muestrear, así su promedio es exacto
+        data = trim_categories(line_data, 'obra', max_categories, ['total', 'count'], keys=['mes'])
+        puntos = len(data)
+        data = downsample_trend(data, x='mes', group='obra', max_points=max_points)
+        if len(data) < puntos:
+            print(f"DEBUG - Tendencia reducida de {puntos} a {len(data)} puntos")
+
+        fig_line = px.line(
+            round_numeric(data[['mes', 'obra', 'mean']]),
+            x='mes',
+            y='mean',
+            color='obra',
+            title=title,
+            labels={'mes': 'Mes', 'mean': 'Total Promedio', 'obra': 'Obra'},
+            render_mode='webgl'
+        )
+        # Ajustar diseño si hay múltiples líneas (por obra)
+        fig_line.update_layout(
+            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+            margin=dict(t=100)  # Mayor margen superior para la leyenda
+        )
+        return fig_line
+
+    return build_within_budget("tendencia", build)
+
+
+def build_top_subcategorias_figure(top_subcats_chart):
+    """Barras horizontales de las subcategorías con mayor total."""
+    def build(max_categories):
+        data = top_subcats_chart.nlargest(max_categories, 'total')
+        fig_bar_h = px.bar(
+            round_numeric(data[['subcategoria', 'total']]),
+            y='subcategoria',
+            x='total',
+            orientation='h',
+            title=f'Top {len(data)} Subcategorías por Total',
+            labels={'subcategoria': 'Subcategoría', 'total': 'Total Acumulado'},
+            height=500,
+            color='total',
+            color_continuous_scale=px.colors.sequential.Blues,
+            text='total'  # Display total value on bars
+        )
+        fig_bar_h.update_traces(texttemplate='%{text:,.2f}', textposition='outside')
+        fig_bar_h.update_layout(
+            yaxis={'categoryorder': 'total ascending'},
+            uniformtext_minsize=8, uniformtext_mode='hide'
+        )
+        return fig_bar_h
+
+    return build_within_budget("top subcategorías", build)
+
+
+def build_heatmap_figure(heatmap_data):
+    """Matriz subcategoría × obra con la suma de total (obras menores en la columna "Otros")."""
+    def build(max_categories):
+        data = heatmap_data
+        if data.shape[1] > max_categories:
+            ranking = data.sum(axis=0).abs().sort_values(ascending=False)
+            keep = ranking.index[:max_categories]
+            otros = data.drop(columns=keep).sum(axis=1)
+            data = data[keep].assign(**{OTROS: otros})
+        data = round_numeric(data)
+
+        fig_heatmap = px.imshow(
+            data.values,
+            labels=dict(x="Obra", y="Subcategoría", color="Total"),
+            x=data.columns.tolist(),
+            y=data.index.tolist(),
+            color_continuous_scale="Blues",
+            title="Relación Subcategoría-Obra (Montos)"
+        )
+        # Text annotations with the values (texttemplate reads z, no duplicate text array)
+        fig_heatmap.update_traces(texttemplate="%{z:,.0f}")
+        # Adjust layout for better visualization
+        fig_heatmap.update_layout(
+            height=500,
+            margin=dict(l=50, r=50, t=80, b=50)
+        )
+        return fig_heatmap
+
+    return build_within_budget("matriz", build)
@@ -2,6 +2,7 @@ import streamlit as st
 import pandas as pd
 from supabase import create_client, Client
 import json
+from utils.config import get_config
 
 # --- Funciones de caché global para Supabase Chatbot ---
 
@@ -114,6 +115,71 @@ def get_chatbot_filter_options(_client: Client):
 
 
 
+def normalize_search_frame(df):
+    """Convierte las columnas de fecha a datetime y los importes a numérico.
+
+    Args:
+        df: DataFrame con columnas tal como llegan de Supabase
+
+    Returns:
+        El mismo DataFrame con los tipos normalizados
+    """
+    # Asegurar que las columnas de fecha sean de tipo datetime
+    for col in ['fecha_factura', 'fecha_recepcion', 'fecha_pagada', 'fecha_autorizacion']:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+    
+    # Asegurar que las columnas numéricas sean de tipo numérico
+    for col in ['cantidad', 'precio_unitario', 'subtotal', 'descuento', 'venta_tasa_0', 
+                'venta_tasa_16', 'total_iva', 'total_ish', 'retencion_iva', 'retencion_isr', 
+                'total']:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    
+    return df
+
+
+def _buscar_por_fechas_rpc(_client: Client, table_name: str, select_columns: str, cuentas_gasto, proveedores, estatus, fecha_inicio_str: str, fecha_fin_str: str):
+    """Ejecuta la búsqueda OR sobre las cuatro fechas con la RPC indexada del servidor.
+
+    Ver sql/migrations/001_busqueda_fechas_or.sql.
+
+    Returns:
+        DataFrame con el resultado, o None si la tabla no tiene RPC configurada o la llamada falla
+        (por ejemplo, si la migración aún no se aplicó), para usar el filtro or_() de PostgREST.
+    """
+    rpc_name = (get_config("DATE_OR_SEARCH_RPC") or {}).get(table_name)
+    if not rpc_name:
+        return None
+
+    params = {
+        "p_inicio": fecha_inicio_str,
+        "p_fin": fecha_fin_str,
+        "p_cuentas_gasto": list(cuentas_gasto) or None,
+        "p_proveedores": list(proveedores or []) or None,
+        "p_estatus": list(estatus or []) or None,
+    }
+    try:
+        print(f"DEBUG - Búsqueda por fechas vía RPC {rpc_name}")
+        builder = _client.rpc(rpc_name, params)
+        # Las versiones recientes de postgrest-py permiten elegir columnas sobre el resultado de la RPC
+        if select_columns and select_columns.strip() != "*" and hasattr(builder, "select"):
+            builder = builder.select(select_columns.replace(" ", ""))
+        response = builder.execute()
+    except Exception as e:
+        print(f"DEBUG - RPC {rpc_name} no disponible, se usa el filtro or_(): {e}")
+        return None
+
+    if not response.data:
+        return pd.DataFrame()
+    df = pd.DataFrame(response.data)
+    if select_columns and select_columns.strip() != "*":
+        columnas = [col.strip() for col in select_columns.split(",") if col.strip()]
+        df = df[[col for col in columnas if col in df.columns]]
+    print(f"DEBUG - Cantidad de registros encontrados (RPC): {len(df)}")
+    return normalize_search_frame(df)
+
+
 @st.cache_data(ttl=600, show_spinner=False)  # Cache for 10 minutes
 def get_filtered_data_multiselect(_client: Client, table_name: str, select_columns: str = "*", obras_seleccionadas=None, proveedores_seleccionados=None, fecha_inicio=None, fecha_fin=None, fecha_rango=None, estatus_seleccionados=None, fecha_seleccionada=None):
     """Obtiene datos filtrados del portal desglosado basado en selecciones del usuario.
@@ -221,7 +287,14 @@ def get_filtered_data_multiselect(_client: Client, table_name: str, select_colum
                 date_conditions.append(f"and({columna}.gte.{fecha_inicio_str},{columna}.lte.{fecha_fin_str})")
                 print(f"DEBUG - Filtrando por la columna de fecha: {columna}")
             else:
-                # Si no se seleccionó ningún tipo específico, filtrar por todas las columnas de fecha (comportamiento actual)
+                # Si no se seleccionó ningún tipo específico, filtrar por todas las columnas de fecha.
+                # Primero se intenta la RPC que resuelve el OR como UNION ALL de escaneos por índice
+                rpc_df = _buscar_por_fechas_rpc(
+                    _client, table_name, select_columns, cuentas_gasto, proveedores_seleccionados,
+                    estatus_seleccionados, fecha_inicio_str, fecha_fin_str
+                )
+                if rpc_df is not None:
+                    return rpc_df
                 date_conditions.append(f"and(fecha_factura.gte.{fecha_inicio_str},fecha_factura.lte.{fecha_fin_str})")
                 date_conditions.append(f"and(fecha_recepcion.gte.{fecha_inicio_str},fecha_recepcion.lte.{fecha_fin_str})")
                 date_conditions.append(f"and(fecha_pagada.gte.{fecha_inicio_str},fecha_pagada.lte.{fecha_fin_str})")
@@ -249,23 +322,63 @@ def get_filtered_data_multiselect(_client: Client, table_name: str, select_colum
         print(f"DEBUG - Cantidad de registros encontrados: {len(response.data) if response.data else 0}")
         if response.data:
             # Convertir a DataFrame
-            df = pd.DataFrame(response.data)
-            
-            # Asegurar que las columnas de fecha sean de tipo datetime
-            for col in ['fecha_factura', 'fecha_recepcion', 'fecha_pagada', 'fecha_autorizacion']:
-                if col in df.columns:
-                    df[col] = pd.to_datetime(df[col], errors='coerce')
-            
-            # Asegurar que las columnas numéricas sean de tipo numérico
-            for col in ['cantidad', 'precio_unitario', 'subtotal', 'descuento', 'venta_tasa_0', 
-                        'venta_tasa_16', 'total_iva', 'total_ish', 'retencion_iva', 'retencion_isr', 
-                        'total']:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
-            
-            return df
+            return normalize_search_frame(pd.DataFrame(response.data))
         else:
             return pd.DataFrame()
     except Exception as e:
         st.error(f"Error al obtener datos filtrados: {e}")
         return pd.DataFrame()
+
+
+def get_filtered_data_reusing_cache(_client: Client, table_name: str, select_columns: str = "*", obras_seleccionadas=None, proveedores_seleccionados=None, fecha_inicio=None, fecha_fin=None, estatus_seleccionados=None, fecha_seleccionada=None):
+    """Igual que get_filtered_data_multiselect, pero evita ir al servidor cuando es posible.
+
+    Primero consulta al planificador: si el cargador de datos tiene un snapshot reciente de la
+    tabla con las columnas necesarias, los filtros se evalúan en memoria. Si no, y una búsqueda anterior (de cualquier sesión) devolvió un superconjunto de las filas
+    solicitadas, por ejemplo antes de quitar un proveedor o de acortar el rango de fechas,
+    el resultado se calcula filtrando ese DataFrame en memoria sin ir al servidor.
+
+    Args:
+        Los mismos que get_filtered_data_multiselect.
+
+    Returns:
+        DataFrame de pandas con los datos filtrados
+    """
+    from utils.search_cache import build_search_filters, parse_select_columns, get_search_result_cache
+    from utils.query_planner import get_query_planner
+
+    obra_to_cuenta = get_chatbot_filter_options(_client).get('obra_to_cuenta_gasto', {}) if (_client and obras_seleccionadas) else {}
+    filters = build_search_filters(
+        obras_seleccionadas=obras_seleccionadas,
+        proveedores_seleccionados=proveedores_seleccionados,
+        fecha_inicio=fecha_inicio,
+        fecha_fin=fecha_fin,
+        estatus_seleccionados=estatus_seleccionados,
+        fecha_seleccionada=fecha_seleccionada,
+        obra_to_cuenta=obra_to_cuenta
+    )
+    columns = parse_select_columns(select_columns)
+
+    df = get_query_planner().execute_local(table_name, columns, filters)
+    if df is not None:
+        return df
+
+    cache = get_search_result_cache()
+
+    df = cache.lookup(table_name, filters, columns)
+    if df is not None:
+        return df
+
+    df = get_filtered_data_multiselect(
+        _client=_client,
+        table_name=table_name,
+        select_columns=select_columns,
+        obras_seleccionadas=obras_seleccionadas,
+        proveedores_seleccionados=proveedores_seleccionados,
+        fecha_inicio=fecha_inicio,
+        fecha_fin=fecha_fin,
+        estatus_seleccionados=estatus_seleccionados,
+        fecha_seleccionada=fecha_seleccionada
+    )
+    cache.store(table_name, filters, columns, df)
+    return df
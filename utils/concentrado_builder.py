@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+
+from utils.config import get_config
+
+
+def can_derive_concentrado(desglosado_columns, concentrado_columns):
+    """Indica si todas las columnas del concentrado se pueden obtener de las líneas del desglosado."""
+    return "xml_uuid" in desglosado_columns and set(concentrado_columns) <= set(desglosado_columns)
+
+
+def build_concentrado(df_desglosado, concentrado_columns):
+    """Construye la vista Concentrado (una fila por factura) a partir de las líneas del Desglosado.
+
+    Agrupa por `xml_uuid` usando códigos categóricos (pd.factorize) en lugar de claves de texto:
+    los importes configurados en CONCENTRADO_AGGREGATION["sum"] se suman y el resto de
+    columnas toma el primer valor no nulo de la factura.
+
+    Args:
+        df_desglosado: DataFrame con las líneas de factura (columnas de BD)
+        concentrado_columns: Lista de columnas que debe tener el concentrado, en orden
+
+    Returns:
+        Tupla (df_concentrado, codes) donde codes asigna a cada línea del desglosado la posición
+        de su factura en df_concentrado (-1 si la línea no tiene UUID), o (None, None) si las
+        columnas necesarias no están disponibles.
+    """
+    if df_desglosado is None:
+        return None, None
+
+    # Sin líneas no hay facturas (el DataFrame vacío puede venir sin columnas)
+    if df_desglosado.empty:
+        return pd.DataFrame(columns=list(concentrado_columns)), np.empty(0, dtype=np.intp)
+
+    if not can_derive_concentrado(df_desglosado.columns, concentrado_columns):
+        return None, None
+
+    # Códigos en orden de aparición: la factura i del concentrado es el código i
+    codes, uniques = pd.factorize(df_desglosado["xml_uuid"], sort=False)
+    valid = codes >= 0
+    lineas = df_desglosado.loc[valid]
+    grouped = lineas.groupby(codes[valid], sort=True)
+
+    sum_columns = [col for col in get_config("CONCENTRADO_AGGREGATION")["sum"] if col in concentrado_columns]
+    first_columns = [col for col in concentrado_columns if col not in sum_columns and col != "xml_uuid"]
+
+    partes = []
+    if first_columns:
+        partes.append(grouped[first_columns].first())
+    if sum_columns:
+        partes.append(grouped[sum_columns].sum(min_count=1))
+    concentrado = pd.concat(partes, axis=1) if partes else pd.DataFrame(index=np.arange(len(uniques)))
+
+    concentrado["xml_uuid"] = np.asarray(uniques, dtype=object)
+    concentrado = concentrado[list(concentrado_columns)].reset_index(drop=True)
+    return concentrado, codes
+
+
+class UuidCrossIndex:
+    """Relación entre las líneas del Desglosado y las facturas del Concentrado de una búsqueda.
+
+    Ambas vistas se codifican una sola vez sobre el mismo diccionario de UUIDs (line_codes para
+    las líneas, invoice_codes para las facturas). Con eso, las facturas que tienen al menos una
+    línea en una máscara del desglosado se obtienen marcando códigos, sin comparar textos.
+    """
+
+    def __init__(self, desglosado_uuids, concentrado_uuids, concentrado_codes=None):
+        """
+        Args:
+            desglosado_uuids: UUID de cada línea del desglosado
+            concentrado_uuids: UUID de cada fila del concentrado
+            concentrado_codes: Códigos de build_concentrado (línea -> fila del concentrado), si
+                el concentrado se derivó localmente; evita volver a codificar los UUIDs
+        """
+        if concentrado_codes is not None and len(concentrado_codes) == len(desglosado_uuids):
+            self.line_codes = np.asarray(concentrado_codes)
+            self.invoice_codes = np.arange(len(concentrado_uuids))
+            self.n_codes = len(concentrado_uuids)
+        else:
+            # Concentrado del servidor: se codifica por UUID una vez por búsqueda
+            self.invoice_codes, uniques = pd.factorize(pd.Series(concentrado_uuids), sort=False)
+            self.line_codes = pd.Categorical(desglosado_uuids, categories=uniques).codes
+            self.n_codes = len(uniques)
+
+    def concentrado_mask(self, desglosado_mask):
+        """Facturas del concentrado con al menos una línea seleccionada en desglosado_mask."""
+        codes = self.line_codes[np.asarray(desglosado_mask, dtype=bool)]
+        present = np.zeros(self.n_codes + 1, dtype=bool)
+        present[codes[codes >= 0]] = True
+        # El código -1 (factura sin UUID) apunta a la última posición, que siempre es False
+        return present[self.invoice_codes]
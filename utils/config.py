@@ -8,7 +8,9 @@ SUPABASE_CONFIG = {
     "CONTABILIDAD": "portal_contabilidad",
     "CONCENTRADO": "portal_concentrado",
     
-    # Default columns to retrieve from the table
+    # Default columns to retrieve from the table. The loader's portal_desglosado snapshot must
+    # cover every column the Base de Datos search requests ("sat", "uuid_concepto" included), or
+    # the query planner sends that search to Supabase (QueryPlanner.plan column check)
     "DEFAULT_COLUMNS": [
         "obra", "folio", "fecha_factura", "cantidad", "subtotal", "total", 
         "descripcion", "categoria_id", "subcategoria", "cuenta_gasto", "tipo_gasto", 
@@ -16,7 +18,7 @@ SUPABASE_CONFIG = {
         "fecha_autorizacion", "clave_producto", "clave_unidad", 
         "unidad", "precio_unitario", "descuento", "venta_tasa_0", "venta_tasa_16", 
         "moneda", "total_iva", "total_ish", "retencion_iva", "retencion_isr", 
-        "serie", "url_pdf", "url_oc", "url_rem", "xml_uuid"
+        "serie", "url_pdf", "url_oc", "url_rem", "xml_uuid", "sat", "uuid_concepto"
     ],
     "KIOSKO_VISTA_COLUMNS": [
         "uuid_concepto", "cuenta_gasto", "obra", "tipo_gasto", "proveedor", 
@@ -39,6 +41,79 @@ SUPABASE_CONFIG = {
         "residente", "estatus", "moneda", "unidad"
     ],
     
+    # Indexed RPCs for the four-date OR search (sql/migrations/001_busqueda_fechas_or.sql)
+    "DATE_OR_SEARCH_RPC": {
+        "portal_desglosado": "buscar_portal_desglosado_por_fechas",
+        "portal_contabilidad": "buscar_portal_contabilidad_por_fechas",
+    },
+    
+    # RPC that runs the GROUP BY queries generated by utils/aggregation.py
+    "AGGREGATE_RPC": "execute_sql",
+    # Seconds visualization aggregates and figures stay cached per filter signature
+    # (in-memory cube results are also keyed by snapshot version)
+    "VIZ_CACHE_TTL": 600,
+    # Seconds the database data version (updated_at of the KPI snapshot row) is reused before re-reading it
+    "VIZ_DATA_VERSION_TTL": 60,
+    "LINE_MAX_POINTS_PER_TRACE": 400,  # Trend chart points per obra after resampling/LTTB
+    # Figure payload budget (utils/chart_figures.py)
+    "CHART_PAYLOAD_BUDGET": 500_000,  # Bytes of figure JSON per chart before categories are halved
+    "CHART_MAX_CATEGORIES": 20,  # Obras shown by name; the rest are grouped into "Otros"
+    "CHART_DECIMALS": 2,
+    
+    # Concentrado (one row per xml_uuid) derived from desglosado lines:
+    # these amounts are summed per invoice, every other column takes the invoice's first value
+    "CONCENTRADO_AGGREGATION": {
+        "sum": [
+            "subtotal", "descuento", "venta_tasa_0", "venta_tasa_16", "total_iva",
+            "total_ish", "retencion_isr", "retencion_iva", "total"
+        ]
+    },
+    
+    # In-memory loader snapshots
+    "LOADER_ROW_LIMIT": 250000,  # Max rows per table; a snapshot this size may be incomplete
+    "SNAPSHOT_MAX_AGE": 1800,  # Seconds a loaded table may serve searches before going remote
+    
+    # Daily dashboard KPI snapshots (sql/migrations/003, 004); the row is built server-side from
+    # counters kept up to date by triggers on portal_desglosado, and the loader refreshes it after loads
+    "KPI_SNAPSHOT_TABLE": "dashboard_kpis",
+    "KPI_SNAPSHOT_REFRESH_RPC": "refresh_dashboard_kpis_snapshot",
+    "KPI_SNAPSHOT_MAX_AGE": 3600,  # Older snapshots fall back to the get_dashboard_kpis RPC
+    
+    # Seconds between redraws of the loading dialog's progress fragment
+    "LOADING_DIALOG_REFRESH": 0.5,
+    
+    # Result cache for Base de Datos searches (filter-superset reuse)
+    "SEARCH_CACHE_TTL": 600,  # Seconds, same as get_filtered_data_multiselect
+    "SEARCH_CACHE_MAX_ENTRIES": 32,
+    # PostgREST max-rows of the Supabase project; results this size may be truncated
+    "POSTGREST_MAX_ROWS": 40000,
+    
+    # Base de Datos result grids: rows sent to the browser per page
+    "GRID_PAGE_SIZE": 1000,
+    
+    # Automatic invoice filters (utils/invoice_rules.py). Each rule flags a row when any/all of
+    # its conditions hold; a condition is [display column, operator, value] or a nested
+    # {"any": [...]} / {"all": [...]}. Operators: ==, !=, >, >=, <, <=, in, isnull, notnull.
+    # Conditions on columns missing from a view are false.
+    "INVOICE_RULES": {
+        "has_descuento": {"label": "con descuento", "any": [["Descuento", ">", 0]]},
+        "has_retenciones": {
+            "label": "con retenciones",
+            "any": [["ISH", "!=", 0], ["Retención IVA", "!=", 0], ["Retención ISR", "!=", 0]]
+        },
+        "tasa_0": {
+            "label": "con Tasa 0",
+            "any": [
+                ["Venta Tasa 0%", ">", 0],
+                {"all": [["Venta Tasa 0%", "==", 0], ["Venta Tasa 16%", "==", 0]]}
+            ]
+        },
+        "moneda_usd": {"label": "en USD", "any": [["Moneda", "==", "USD"]]},
+        "moneda_extranjera": {"label": "en moneda distinta a MXN", "all": [["Moneda", "notnull", None], ["Moneda", "!=", "MXN"]]},
+        "sin_orden_compra": {"label": "sin Orden de Compra", "any": [["Orden de Compra", "isnull", None], ["Orden de Compra", "==", ""]]},
+        "sin_remision": {"label": "sin Remisión", "any": [["Remisión", "isnull", None], ["Remisión", "==", ""]]},
+    },
+    
     # Column mapping for display (database column name -> display name)
     "COLUMN_MAPPING": {
         "obra": "Obra",
@@ -75,6 +150,7 @@ SUPABASE_CONFIG = {
         "retencion_isr": "Retención ISR",
         "serie": "Serie",
         "xml_uuid": "UUID",
+        "uuid_concepto": "ID Concepto",
     }
 }
 
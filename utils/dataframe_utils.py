@@ -1,15 +1,11 @@
 import streamlit as st
 import pandas as pd
-from pandas.api.types import (
-    is_categorical_dtype,
-    is_datetime64_any_dtype,
-    is_numeric_dtype,
-    is_object_dtype,
-    is_string_dtype, # Import added
-)
+import numpy as np
 from typing import List, Optional, Dict, Any
 
-def custom_dataframe_explorer(df: pd.DataFrame, explorer_id: str, case: bool = True, multiselect_columns: Optional[List[str]] = None, fecha_columns: Optional[List[str]] = None, numeric_columns: Optional[List[str]] = None, text_columns: Optional[List[str]] = None, excluded_filter_columns: Optional[List[str]] = None, container=None) -> pd.DataFrame:
+from utils.explorer_engine import COST_SCAN, COST_VECTOR, ExplorerFilter, get_explorer_engine, validate_text_filter
+
+def custom_dataframe_explorer(df: pd.DataFrame, explorer_id: str, case: bool = True, multiselect_columns: Optional[List[str]] = None, fecha_columns: Optional[List[str]] = None, numeric_columns: Optional[List[str]] = None, text_columns: Optional[List[str]] = None, excluded_filter_columns: Optional[List[str]] = None, container=None, dataset_version: Any = None) -> pd.DataFrame:
     """
     Adds a UI on top of a dataframe to let viewers filter columns, with customized
     filtering options for specific text columns. Uses st.session_state to persist filters.
@@ -24,6 +20,9 @@ def custom_dataframe_explorer(df: pd.DataFrame, explorer_id: str, case: bool = T
         text_columns (List[str], optional): Columns that should be processed as text with pattern search. Defaults to None.
         excluded_filter_columns (List[str], optional): Columns to exclude from the filter options. Defaults to None.
         container (optional): Custom container to place the explorer in. Defaults to None.
+        dataset_version (optional): Identifier that changes whenever `df` changes (e.g. a search counter).
+            Column metadata (date parsing, unique values, ranges) is cached per version; with None it
+            is recomputed on every rerun. Defaults to None.
         
     Returns:
         pd.DataFrame: The filtered dataframe
@@ -37,9 +36,6 @@ def custom_dataframe_explorer(df: pd.DataFrame, explorer_id: str, case: bool = T
         
         For columns not specified in any of these lists, the function will infer the type based on the data.
     """
-    # Import warnings to suppress specific pandas warnings related to datetime parsing
-    import warnings
-    
     if multiselect_columns is None:
         multiselect_columns = []
         
@@ -61,44 +57,13 @@ def custom_dataframe_explorer(df: pd.DataFrame, explorer_id: str, case: bool = T
     def set_session_state_value(key_suffix: str, widget_key: str):
         st.session_state[explorer_id][key_suffix] = st.session_state[widget_key]
 
-    df_filtered = df.copy()
-        
-    # Suppress the specific warning about datetime format inference
-    with warnings.catch_warnings():
-        warnings.filterwarnings("ignore", category=UserWarning, message="Could not infer format")
-        
-        # Process datetime columns
-        for col in df_filtered.columns:
-            # Handle existing datetime columns - just remove timezone if present
-            if is_datetime64_any_dtype(df_filtered[col]):
-                try:
-                    if df_filtered[col].dt.tz is not None:
-                        df_filtered[col] = df_filtered[col].dt.tz_localize(None)
-                except (AttributeError, TypeError):
-                    pass
-            
-            # Only attempt conversion on object/string columns that might contain dates
-            elif is_object_dtype(df_filtered[col]):
-                # Skip conversion attempt for columns unlikely to be dates based on column name
-                if not any(date_hint in col.lower() for date_hint in ['fecha', 'date', 'time']):
-                    continue
-                    
-                # Try specific formats first for more consistent parsing
-                date_formats = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y']
-                
-                for date_format in date_formats:
-                    try:
-                        df_filtered[col] = pd.to_datetime(df_filtered[col], format=date_format, errors='coerce')
-                        # If we successfully parsed at least 50% of non-null values, keep the conversion
-                        non_null_before = df[col].notna().sum()
-                        non_null_after = df_filtered[col].notna().sum()
-                        if non_null_before > 0 and non_null_after >= 0.5 * non_null_before:
-                            break
-                        else:
-                            # Revert conversion if too many NaN values were introduced
-                            df_filtered[col] = df[col].copy()
-                    except Exception:
-                        continue
+    # Conversión de fechas y metadatos por columna, calculados una vez por versión de los datos
+    engine = get_explorer_engine(explorer_id, dataset_version)
+    df_prepared = engine.prepare(df)
+
+    # Filtros activos; el motor decide el orden de evaluación y reutiliza las máscaras que no cambiaron
+    active_filters: List[ExplorerFilter] = []
+    deferred_multiselects = []
 
     # Use provided container or default to st
     ui = container if container is not None else st
@@ -111,10 +76,10 @@ def custom_dataframe_explorer(df: pd.DataFrame, explorer_id: str, case: bool = T
         
         # Ensure stored columns are valid for the current df
         stored_columns = get_session_state_value(cols_to_filter_state_key, [])
-        valid_stored_columns = [col for col in stored_columns if col in df_filtered.columns]
+        valid_stored_columns = [col for col in stored_columns if col in df_prepared.columns]
 
         # Filtrar las opciones disponibles excluyendo las columnas especificadas
-        available_filter_columns = [col for col in df_filtered.columns if col not in excluded_filter_columns]
+        available_filter_columns = [col for col in df_prepared.columns if col not in excluded_filter_columns]
         
         to_filter_columns = st.multiselect(
             "Filtrar tabla de datos por columnas:",
@@ -154,64 +119,19 @@ def custom_dataframe_explorer(df: pd.DataFrame, explorer_id: str, case: bool = T
             # Define a unique key for the widget itself
             widget_key = f"{explorer_id}_{column}_widget"
             
-            # Determinar el tipo de columna basado en las listas proporcionadas
-            is_date_column = column in (fecha_columns or [])
-            is_numeric_column = column in (numeric_columns or [])
-            is_text_column = column in (text_columns or [])
-            force_multiselect = column in (multiselect_columns or [])
-            
-            # Solo inferir tipo si no fue explicitamente definido
-            if not any([is_date_column, is_numeric_column, is_text_column, force_multiselect]):
-                is_low_cardinality = is_categorical_dtype(df_filtered[column]) or df_filtered[column].nunique() < 10
-                # Inferir tipo basado en datos si no fue especificado
-                if is_datetime64_any_dtype(df_filtered[column]):
-                    is_date_column = True
-                elif is_numeric_dtype(df_filtered[column]):
-                    is_numeric_column = True
-                elif is_string_dtype(df_filtered[column]) or is_object_dtype(df_filtered[column]):
-                    is_text_column = True
-            else:
-                # Para multiselect necesitamos saber si tiene baja cardinalidad aunque su tipo sea explícito
-                is_low_cardinality = is_categorical_dtype(df_filtered[column]) or df_filtered[column].nunique() < 10
+            # Tipo de filtro y valores precalculados (fechas convertidas, únicos, rangos)
+            meta = engine.column_metadata(
+                df_prepared, column, fecha_columns or [], numeric_columns or [], text_columns or [], multiselect_columns or []
+            )
 
             # Procesamiento basado en tipo de columna asignado explícitamente
             # Prioridad: fecha -> multiselect -> numérico -> texto
-            if is_date_column:
-                # Para todas las columnas de fecha, intentamos la conversión si no son ya datetime
+            if meta['kind'] == 'date':
                 try:
-                    # Primero, aseguremos que la columna sea de tipo string para la conversión
-                    if not is_string_dtype(df_filtered[column]) and not is_datetime64_any_dtype(df_filtered[column]):
-                        df_filtered[column] = df_filtered[column].astype(str)
-                    
-                    # Si ya es datetime, no necesitamos convertirlo
-                    if not is_datetime64_any_dtype(df_filtered[column]):
-                        with warnings.catch_warnings():
-                            warnings.filterwarnings("ignore", category=UserWarning)
-                            # Probar múltiples formatos explícitos antes de caer en inferencia automática
-                            date_formats = ['%Y-%m-%d %H:%M:%S%z', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d', 
-                                          '%d/%m/%Y %H:%M:%S', '%d/%m/%Y']
-                            
-                            converted = False
-                            for fmt in date_formats:
-                                try:
-                                    df_filtered[column] = pd.to_datetime(df_filtered[column], format=fmt, errors='coerce')
-                                    if not df_filtered[column].isna().all():  # Si al menos algunos valores se convirtieron
-                                        converted = True
-                                        break
-                                except:
-                                    continue
-                            
-                            # Si ningún formato específico funcionó, intentar inferencia automática
-                            if not converted:
-                                df_filtered[column] = pd.to_datetime(df_filtered[column], errors='coerce')
-                    
-                    col_series_datetime = df_filtered[column].dropna()
-                    if col_series_datetime.empty:
+                    min_date, max_date = meta['min'], meta['max']
+                    if min_date is None:
                         right.warning(f"Columna '{column}' no contiene fechas válidas.")
                         continue
-                        
-                    # Asegurar que tenemos fechas válidas
-                    min_date, max_date = col_series_datetime.min(), col_series_datetime.max()
                     
                     if pd.isna(min_date) or pd.isna(max_date) or min_date > max_date:
                         right.warning(f"Columna '{column}' tiene un rango de fechas inválido.")
@@ -237,37 +157,35 @@ def custom_dataframe_explorer(df: pd.DataFrame, explorer_id: str, case: bool = T
                     if len(current_filter_values) == 2:
                         start_date_ts, end_date_ts = pd.to_datetime(current_filter_values[0]), pd.to_datetime(current_filter_values[1])
                         end_date_inclusive = end_date_ts + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
-                        df_filtered = df_filtered.loc[df_filtered[column].between(start_date_ts, end_date_inclusive)]
+                        low, high = start_date_ts.to_datetime64(), end_date_inclusive.to_datetime64()
+                        active_filters.append(ExplorerFilter(
+                            column, (start_date_ts, end_date_ts),
+                            lambda rows, fechas=meta['values'], low=low, high=high: (fechas >= low) & (fechas <= high),
+                            cost=COST_VECTOR, selectivity=engine.range_selectivity(meta, low, high)
+                        ))
                 except Exception as e:
                     right.warning(f"Error al procesar la columna de fecha '{column}': {str(e)}")
                     
-            elif force_multiselect or (is_low_cardinality and not (is_numeric_column or is_date_column)):
-                unique_values = sorted(list(pd.Series(df_filtered[column].unique()).dropna()))
+            elif meta['kind'] == 'multiselect':
+                unique_values = meta['options']
                 default_selection = get_session_state_value(filter_state_key, [])
                 valid_selection = [val for val in default_selection if val in unique_values]
-                
-                current_filter_values = right.multiselect(
-                    f"Valores para {column}",
-                    options=unique_values,
-                    placeholder=f"Selecciona {column} para filtrar",
-                    default=valid_selection,
-                    key=widget_key,
-                    on_change=set_session_state_value, args=(filter_state_key, widget_key)
-                )
-                st.session_state[explorer_id][filter_state_key] = current_filter_values # Persist current value
-                if current_filter_values: # Apply filter if there's a selection
-                    df_filtered = df_filtered[df_filtered[column].isin(current_filter_values)]
 
-            elif is_numeric_column or is_numeric_dtype(df_filtered[column]):
-                # Convertir a numérico si es posible
+                # El widget se dibuja al final, cuando ya se conocen los conteos bajo los demás filtros
+                deferred_multiselects.append((column, right.empty(), meta, valid_selection, filter_state_key, widget_key))
+                if valid_selection: # Apply filter if there's a selection
+                    active_filters.append(ExplorerFilter(
+                        column, tuple(valid_selection),
+                        lambda rows, serie=df_prepared[column], selected=valid_selection: serie.isin(selected).to_numpy(),
+                        cost=COST_VECTOR, selectivity=engine.isin_selectivity(df_prepared, column, meta, valid_selection)
+                    ))
+
+            elif meta['kind'] == 'numeric':
                 try:
-                    col_series_numeric = pd.to_numeric(df_filtered[column], errors='coerce').dropna()
-                    if col_series_numeric.empty:
+                    if meta['min'] is None:
                         right.warning(f"Columna '{column}' no contiene valores numéricos válidos después de la conversión.")
                         continue
-                    _min, _max = float(col_series_numeric.min()), float(col_series_numeric.max())
-                    step = (_max - _min) / 100 if _max > _min and _max - _min > 0 else 1.0
-                    if _min == _max: step = 0.1 # Avoid step being 0 if min=max
+                    _min, _max, step = meta['min'], meta['max'], meta['step']
     
                     default_range = get_session_state_value(filter_state_key, (_min, _max))
                     clamped_default_range = (max(_min, default_range[0]), min(_max, default_range[1]))
@@ -280,12 +198,17 @@ def custom_dataframe_explorer(df: pd.DataFrame, explorer_id: str, case: bool = T
                         on_change=set_session_state_value, args=(filter_state_key, widget_key)
                     )
                     st.session_state[explorer_id][filter_state_key] = current_filter_values # Persist
-                    df_filtered = df_filtered[df_filtered[column].between(*current_filter_values)]
+                    low, high = current_filter_values
+                    active_filters.append(ExplorerFilter(
+                        column, (low, high),
+                        lambda rows, numeros=meta['values'], low=low, high=high: (numeros >= low) & (numeros <= high),
+                        cost=COST_VECTOR, selectivity=engine.range_selectivity(meta, low, high)
+                    ))
                 except Exception as e:
                     right.warning(f"Error al procesar la columna numérica '{column}': {str(e)}")
                     continue
                 
-            elif is_text_column or is_string_dtype(df_filtered[column]) or is_object_dtype(df_filtered[column]):
+            elif meta['kind'] == 'text':
                 # Campo de texto para filtrar por contenido
                 default_text = get_session_state_value(filter_state_key, "")
                 current_filter_text = right.text_input(
@@ -297,13 +220,41 @@ def custom_dataframe_explorer(df: pd.DataFrame, explorer_id: str, case: bool = T
                 if current_filter_text:
                     patterns = [p.strip() for p in current_filter_text.split('|') if p.strip()]
                     if patterns:
-                        regex_pattern = '|'.join(patterns)
                         try:
-                            df_filtered = df_filtered[df_filtered[column].astype(str).str.contains(regex_pattern, case=case, na=False, regex=True)]
+                            validate_text_filter(patterns, case)
+                            active_filters.append(ExplorerFilter(
+                                column, (tuple(patterns), case),
+                                lambda rows, column=column, patterns=patterns: engine.text_match(df_prepared, column, patterns, case, rows),
+                                cost=COST_SCAN
+                            ))
                         except Exception as e:
                             right.warning(f"Error aplicando filtro regex en {column}: {e}")
             else:
-                right.warning(f"Tipo de columna '{column}' no reconocido: {df_filtered[column].dtype}") 
+                right.warning(f"Tipo de columna '{column}' no reconocido: {meta['dtype']}") 
+
+
+        # Evaluación ordenada por costo y selectividad
+        final_mask = engine.apply(active_filters, len(df_prepared))
+
+        # Multiselects con el número de filas de cada opción bajo los demás filtros activos
+        for column, slot, meta, valid_selection, filter_state_key, widget_key in deferred_multiselects:
+            other_filters = [f for f in active_filters if f.column != column]
+            if len(other_filters) == len(active_filters):
+                facet_mask = final_mask
+            else:
+                facet_mask = engine.apply(other_filters, len(df_prepared), prune=False)
+            counts = engine.facet_counts(df_prepared, column, meta, facet_mask)
 
+            current_filter_values = slot.multiselect(
+                f"Valores para {column}",
+                options=meta['options'],
+                format_func=lambda val, counts=counts: f"{val} ({counts.get(val, 0):,})",
+                placeholder=f"Selecciona {column} para filtrar",
+                default=valid_selection,
+                key=widget_key,
+                on_change=set_session_state_value, args=(filter_state_key, widget_key)
+            )
+            st.session_state[explorer_id][filter_state_key] = current_filter_values # Persist current value
 
-    return df_filtered
+    # Una sola materialización del resultado
+    return df_prepared.loc[final_mask]
@@ -0,0 +1,132 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+# Frecuencias de re-muestreo de la más fina a la más gruesa, con su duración aproximada en días
+RESAMPLE_FREQUENCIES = [("D", 1.0), ("W-MON", 7.0), ("MS", 30.44)]
+
+
+def native_spacing_days(fechas):
+    """Separación típica (mediana, en días) entre fechas distintas consecutivas; 0 si hay menos de dos."""
+    distintas = pd.Series(fechas.dropna().unique()).sort_values()
+    if len(distintas) < 2:
+        return 0.0
+    return distintas.diff().dropna().median().total_seconds() / 86400
+
+
+def choose_frequency(fechas, max_points):
+    """Frecuencia más fina (día, semana o mes) con la que una serie cabe en max_points puntos.
+
+    Nunca propone una frecuencia más fina que la granularidad propia de la serie: una serie
+    mensual re-muestreada por semana movería cada mes al lunes siguiente. Devuelve None si
+    ninguna frecuencia es al menos tan gruesa como la serie (no hay que re-muestrear).
+    """
+    fechas = fechas.dropna()
+    if fechas.empty:
+        return None
+    # Tolerancia para meses de 28–31 días y semanas con huecos
+    spacing = native_spacing_days(fechas) * 0.9
+    candidates = [(freq, days) for freq, days in RESAMPLE_FREQUENCIES if days >= spacing]
+    if not candidates:
+        return None
+    span_days = (fechas.max() - fechas.min()).total_seconds() / 86400 + 1
+    for freq, days in candidates:
+        if span_days / days <= max_points:
+            return freq
+    return candidates[-1][0]
+
+
+def resample_sum_count(df, x, group, sum_col, count_col, freq):
+    """Re-agrega una serie por grupo a la frecuencia indicada sumando suma y conteo.
+
+    El promedio (mean) se recalcula como suma / conteo, así que sigue siendo exacto.
+    """
+    grouped = (
+        df.groupby([group, pd.Grouper(key=x, freq=freq)], observed=True)[[sum_col, count_col]]
+        .sum()
+        .reset_index()
+    )
+    grouped = grouped[grouped[count_col] > 0]
+    grouped["mean"] = grouped[sum_col] / grouped[count_col]
+    return grouped
+
+
+def lttb_indices(x, y, threshold):
+    """Índices de los puntos que conserva Largest-Triangle-Three-Buckets.
+
+    Args:
+        x: Array numérico ordenado de forma ascendente
+        y: Array numérico con los valores
+        threshold: Número de puntos a conservar
+
+    Returns:
+        numpy.ndarray con los índices seleccionados (incluye siempre el primero y el último)
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0] = 0
+    a = 0
+    for i in range(threshold - 2):
+        # Promedio del siguiente bucket (para el último bucket, el último punto)
+        avg_start = int(math.floor((i + 1) * every)) + 1
+        avg_end = min(int(math.floor((i + 2) * every)) + 1, n)
+        if avg_start >= avg_end:
+            avg_start, avg_end = n - 1, n
+        avg_x = x[avg_start:avg_end].mean()
+        avg_y = y[avg_start:avg_end].mean()
+
+        # Punto del bucket actual que forma el triángulo de mayor área
+        range_start = int(math.floor(i * every)) + 1
+        range_end = int(math.floor((i + 1) * every)) + 1
+        areas = np.abs(
+            (x[a] - avg_x) * (y[range_start:range_end] - y[a])
+            - (x[a] - x[range_start:range_end]) * (avg_y - y[a])
+        )
+        a = range_start + int(np.argmax(areas))
+        indices[i + 1] = a
+    indices[-1] = n - 1
+    return indices
+
+
+def downsample_trend(df, x, group, max_points, sum_col="total", count_col="count", y="mean"):
+    """Reduce una serie temporal por grupo a como máximo max_points puntos por traza.
+
+    Primero re-muestrea a la frecuencia más fina que quepa en el presupuesto (día, semana o mes),
+    sin bajar de la granularidad propia de x (una serie mensual nunca se pasa a semanas), y, si
+    una traza sigue excediéndolo, la reduce con LTTB sobre la columna y.
+
+    Args:
+        df: DataFrame con las columnas x (fechas), group, sum_col y count_col
+        x: Columna de fechas
+        group: Columna que separa las trazas (por ejemplo 'obra')
+        max_points: Máximo de puntos por traza
+        sum_col, count_col: Medidas aditivas con las que se recalcula el promedio
+        y: Columna graficada
+
+    Returns:
+        DataFrame con las mismas columnas, ordenado por grupo y fecha
+    """
+    if df.empty or not max_points:
+        return df
+
+    freq = choose_frequency(df[x], max_points)
+    if freq is None:
+        # Ya está en su granularidad más gruesa: solo se recalcula el promedio
+        resampled = df[df[count_col] > 0].assign(**{y: lambda d: d[sum_col] / d[count_col]})
+    else:
+        resampled = resample_sum_count(df, x, group, sum_col, count_col, freq)
+
+    partes = []
+    for _, serie in resampled.groupby(group, sort=False, observed=True):
+        serie = serie.sort_values(x)
+        if len(serie) > max_points:
+            x_num = serie[x].to_numpy(dtype="datetime64[ns]").astype(np.int64) / 1e9
+            keep = lttb_indices(x_num, serie[y].to_numpy(dtype=float), max_points)
+            serie = serie.iloc[keep]
+        partes.append(serie)
+    return pd.concat(partes, ignore_index=True) if partes else resampled
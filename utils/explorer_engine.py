@@ -0,0 +1,359 @@
+import re
+import warnings
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from pandas.api.types import (
+    is_categorical_dtype,
+    is_datetime64_any_dtype,
+    is_numeric_dtype,
+    is_object_dtype,
+    is_string_dtype,
+)
+
+from utils.trigram_index import TrigramIndex, is_literal
+
+# Formatos que se prueban al preparar la tabla (columnas con 'fecha'/'date'/'time' en el nombre)
+PREPARE_DATE_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y']
+# Formatos que se prueban para las columnas de fecha filtradas con calendario
+FILTER_DATE_FORMATS = ['%Y-%m-%d %H:%M:%S%z', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y']
+DATE_HINTS = ['fecha', 'date', 'time']
+# Costo relativo de evaluar un filtro: comparaciones vectorizadas y búsquedas de texto
+COST_VECTOR = 0
+COST_SCAN = 1
+
+
+def _strip_timezone(series: pd.Series) -> pd.Series:
+    try:
+        if series.dt.tz is not None:
+            return series.dt.tz_localize(None)
+    except (AttributeError, TypeError):
+        pass
+    return series
+
+
+def _prepare_column(series: pd.Series, column: str) -> Optional[pd.Series]:
+    """Conversión de una columna al preparar la tabla, o None si se deja igual."""
+    if is_datetime64_any_dtype(series):
+        stripped = _strip_timezone(series)
+        return stripped if stripped is not series else None
+    if not is_object_dtype(series) or not any(hint in column.lower() for hint in DATE_HINTS):
+        return None
+    # Se conserva el primer formato que convierte al menos el 50% de los valores no nulos
+    non_null_before = series.notna().sum()
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", category=UserWarning, message="Could not infer format")
+        for date_format in PREPARE_DATE_FORMATS:
+            try:
+                converted = pd.to_datetime(series, format=date_format, errors='coerce')
+            except Exception:
+                continue
+            if non_null_before > 0 and converted.notna().sum() >= 0.5 * non_null_before:
+                return converted
+    return None
+
+
+@lru_cache(maxsize=256)
+def _compile_pattern(pattern: str, case: bool) -> "re.Pattern":
+    """Regex compilada del filtro de texto; se conserva entre reruns."""
+    return re.compile(pattern, 0 if case else re.IGNORECASE)
+
+
+def validate_text_filter(patterns: List[str], case: bool) -> None:
+    """Compila la regex de un filtro de texto para reportar errores de sintaxis al capturarlo."""
+    if not all(is_literal(pattern) for pattern in patterns):
+        _compile_pattern('|'.join(patterns), case)
+
+
+def _parse_filter_dates(series: pd.Series) -> pd.Series:
+    """Convierte una columna de fecha para el filtro de calendario (formatos explícitos y luego inferencia)."""
+    if is_datetime64_any_dtype(series):
+        return series
+    if not is_string_dtype(series):
+        series = series.astype(str)
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", category=UserWarning)
+        for fmt in FILTER_DATE_FORMATS:
+            try:
+                converted = pd.to_datetime(series, format=fmt, errors='coerce')
+            except Exception:
+                continue
+            if not converted.isna().all():
+                return converted
+        return pd.to_datetime(series, errors='coerce')
+
+
+class ExplorerEngine:
+    """Estado precalculado de custom_dataframe_explorer para una versión del conjunto de datos.
+
+    Guarda, por columna, la conversión de fechas de la tabla, el tipo de filtro inferido, las
+    fechas ya convertidas con su rango, los valores únicos ordenados y el mínimo/máximo/paso
+    numérico. Mientras la versión no cambie, agregar o ajustar un filtro no vuelve a calcular
+    nada de esto.
+    """
+
+    def __init__(self, dataset_version: Any):
+        self.dataset_version = dataset_version
+        self._prepared: Optional[Dict[str, pd.Series]] = None
+        # Tabla preparada de esta versión; se reutiliza en cada rerun en lugar de copiar df
+        self._frame: Optional[pd.DataFrame] = None
+        self._metadata: Dict[str, Dict[str, Any]] = {}
+        # Última máscara completa por columna: columna -> (clave del valor del filtro, máscara)
+        self._masks: Dict[str, Tuple[Any, np.ndarray]] = {}
+        # Máscara del último resultado del explorer (filas de la tabla que pasan todos los filtros)
+        self.last_mask: Optional[np.ndarray] = None
+
+    def prepare(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Copia de df con las columnas de fecha convertidas y sin zona horaria.
+
+        La copia se hace una sola vez por versión y se devuelve la misma tabla en cada rerun;
+        quien la recibe no debe modificarla en el lugar.
+        """
+        if self._frame is not None:
+            return self._frame
+        if self._prepared is None:
+            self._prepared = {}
+            for col in df.columns:
+                converted = _prepare_column(df[col], col)
+                if converted is not None:
+                    self._prepared[col] = converted.to_numpy()
+        prepared = df.copy()
+        for col, values in self._prepared.items():
+            if col in prepared.columns:
+                prepared[col] = values
+        self._frame = prepared
+        return prepared
+
+    def column_metadata(self, df: pd.DataFrame, column: str, fecha_columns: List[str], numeric_columns: List[str],
+                        text_columns: List[str], multiselect_columns: List[str]) -> Dict[str, Any]:
+        """Metadatos del filtro de una columna de la tabla preparada.
+
+        Returns:
+            Diccionario con 'kind' ('date', 'multiselect', 'numeric', 'text' o 'unknown') y, según el tipo,
+            'values' (fechas o números convertidos, como array), 'min', 'max', 'step' o 'options'
+        """
+        cached = self._metadata.get(column)
+        if cached is not None:
+            return cached
+
+        series = df[column]
+        is_date_column = column in fecha_columns
+        is_numeric_column = column in numeric_columns
+        is_text_column = column in text_columns
+        force_multiselect = column in multiselect_columns
+
+        # Solo inferir tipo si no fue explicitamente definido
+        if not any([is_date_column, is_numeric_column, is_text_column, force_multiselect]):
+            if is_datetime64_any_dtype(series):
+                is_date_column = True
+            elif is_numeric_dtype(series):
+                is_numeric_column = True
+            elif is_string_dtype(series) or is_object_dtype(series):
+                is_text_column = True
+        is_low_cardinality = is_categorical_dtype(series) or series.nunique() < 10
+
+        # Prioridad: fecha -> multiselect -> numérico -> texto
+        meta: Dict[str, Any]
+        if is_date_column:
+            fechas = _strip_timezone(_parse_filter_dates(series))
+            validas = fechas.dropna()
+            meta = {'kind': 'date', 'values': fechas.to_numpy(),
+                    'min': validas.min() if not validas.empty else None,
+                    'max': validas.max() if not validas.empty else None}
+            if df is self._frame:
+                # La columna se muestra ya convertida a fecha; se asigna una sola vez por versión
+                self._frame[column] = meta['values']
+        elif force_multiselect or (is_low_cardinality and not is_numeric_column):
+            meta = {'kind': 'multiselect', 'options': sorted(list(pd.Series(series.unique()).dropna()))}
+        elif is_numeric_column or is_numeric_dtype(series):
+            numeros = pd.to_numeric(series, errors='coerce')
+            validos = numeros.dropna()
+            meta = {'kind': 'numeric', 'values': numeros.to_numpy(dtype=float), 'min': None, 'max': None, 'step': None}
+            if not validos.empty:
+                _min, _max = float(validos.min()), float(validos.max())
+                step = (_max - _min) / 100 if _max > _min else 1.0
+                if _min == _max:
+                    step = 0.1  # Avoid step being 0 if min=max
+                meta.update({'min': _min, 'max': _max, 'step': step})
+        elif is_text_column or is_string_dtype(series) or is_object_dtype(series):
+            meta = {'kind': 'text'}
+        else:
+            meta = {'kind': 'unknown', 'dtype': series.dtype}
+
+        self._metadata[column] = meta
+        return meta
+
+    def text_dictionary(self, df: pd.DataFrame, column: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Códigos por fila y valores distintos (como texto) de una columna, calculados una vez por versión."""
+        meta = self._metadata.setdefault(column, {'kind': 'text'})
+        if 'codes' not in meta:
+            codes, uniques = pd.factorize(df[column].astype(str))
+            meta['codes'], meta['uniques'] = codes, np.asarray(uniques, dtype=object)
+        return meta['codes'], meta['uniques']
+
+    def trigram_index(self, df: pd.DataFrame, column: str) -> TrigramIndex:
+        """Índice de trigramas de los valores distintos de una columna, construido una vez por versión."""
+        meta = self._metadata.setdefault(column, {'kind': 'text'})
+        if 'trigrams' not in meta:
+            meta['trigrams'] = TrigramIndex(self.text_dictionary(df, column)[1])
+        return meta['trigrams']
+
+    def text_match(self, df: pd.DataFrame, column: str, patterns: List[str], case: bool,
+                   rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Filas cuyo texto contiene alguno de los patrones (combinados con OR, como en la regex 'a|b').
+
+        Se evalúa una vez por valor distinto y el resultado se propaga a las filas a través de los
+        códigos. Si todos los patrones son subcadenas literales (UUID, folio, parte de una descripción)
+        se resuelven con el índice de trigramas; si alguno usa sintaxis de regex, la regex solo se
+        evalúa sobre los valores distintos presentes en rows que aún no se habían evaluado.
+
+        Args:
+            rows: Posiciones de las filas a evaluar; None para toda la tabla
+
+        Returns:
+            Máscara booleana del largo de rows (o de la tabla)
+        """
+        codes, uniques = self.text_dictionary(df, column)
+        row_codes = codes if rows is None else codes[rows]
+        if all(is_literal(pattern) for pattern in patterns):
+            index = self.trigram_index(df, column)
+            matches = np.zeros(len(uniques), dtype=bool)
+            for pattern in patterns:
+                matches |= index.search(pattern, case=case)
+            return matches[row_codes]
+
+        # Resultados por valor distinto de la última regex de la columna, completados bajo demanda
+        meta = self._metadata[column]
+        memo_key = (tuple(patterns), case)
+        memo = meta.get('regex_memo')
+        if memo is None or memo[0] != memo_key:
+            memo = (memo_key, np.zeros(len(uniques), dtype=bool), np.zeros(len(uniques), dtype=bool))
+            meta['regex_memo'] = memo
+        _, evaluated, matches = memo
+        pending = np.unique(row_codes)
+        pending = pending[~evaluated[pending]]
+        if pending.size:
+            regex = _compile_pattern('|'.join(patterns), case)
+            matches[pending] = [regex.search(value) is not None for value in uniques[pending]]
+            evaluated[pending] = True
+        return matches[row_codes]
+
+    def range_selectivity(self, meta: Dict[str, Any], low: Any, high: Any) -> float:
+        """Fracción de filas entre low y high, con los valores ordenados de la columna (fechas o números)."""
+        values = meta['values']
+        if 'sorted' not in meta:
+            # NaN/NaT quedan al final del orden y no caen en ningún rango
+            meta['sorted'] = np.sort(values)
+        ordered = meta['sorted']
+        if len(ordered) == 0:
+            return 0.0
+        count = np.searchsorted(ordered, high, side='right') - np.searchsorted(ordered, low, side='left')
+        return max(0, int(count)) / len(ordered)
+
+    def isin_selectivity(self, df: pd.DataFrame, column: str, meta: Dict[str, Any], selected: List[Any]) -> float:
+        """Fracción de filas con alguno de los valores seleccionados, según el conteo por valor."""
+        if 'counts' not in meta:
+            meta['counts'] = df[column].value_counts().to_dict()
+        if len(df) == 0:
+            return 0.0
+        return sum(meta['counts'].get(value, 0) for value in selected) / len(df)
+
+    def facet_counts(self, df: pd.DataFrame, column: str, meta: Dict[str, Any], mask: np.ndarray) -> Dict[Any, int]:
+        """Número de filas por opción de una columna multiselect entre las filas de mask.
+
+        Los códigos de categoría se calculan una vez por versión; cada conteo es un bincount.
+        """
+        if 'facet_codes' not in meta:
+            meta['facet_codes'] = pd.Categorical(df[column], categories=meta['options']).codes
+        codes = meta['facet_codes'][mask]
+        counts = np.bincount(codes[codes >= 0], minlength=len(meta['options']))
+        return dict(zip(meta['options'], counts.tolist()))
+
+    def apply(self, filters: List["ExplorerFilter"], n_rows: int, prune: bool = True) -> np.ndarray:
+        """Evalúa los filtros activos y devuelve la máscara combinada (AND).
+
+        Las máscaras cuyo valor no cambió se reutilizan. Las demás se evalúan de la más barata y
+        selectiva a la más costosa: los filtros vectorizados (rango, isin) se calculan sobre toda
+        la tabla y se guardan; los de texto solo sobre las filas que sobreviven a los anteriores.
+        Si ya no queda ninguna fila, el resto de filtros no se evalúa.
+
+        Con prune=False (conteos con un subconjunto de filtros) no se descartan las máscaras
+        de los filtros que no se pasaron.
+        """
+        if prune:
+            active = {f.column for f in filters}
+            for column in list(self._masks):
+                if column not in active:
+                    del self._masks[column]
+
+        surviving = np.ones(n_rows, dtype=bool)
+        pending = []
+        for f in filters:
+            cached = self._masks.get(f.column)
+            if cached is not None and cached[0] == f.value_key:
+                surviving &= cached[1]
+            else:
+                pending.append(f)
+
+        pending.sort(key=lambda f: (f.cost, f.selectivity))
+        for f in pending:
+            if not surviving.any():
+                break
+            rows = None if f.cost < COST_SCAN or surviving.all() else np.flatnonzero(surviving)
+            mask = np.asarray(f.evaluate(rows), dtype=bool)
+            if rows is None:
+                self._masks[f.column] = (f.value_key, mask)
+                surviving &= mask
+            else:
+                surviving[rows] = mask
+        if prune:
+            self.last_mask = surviving
+        if pending:
+            orden = ", ".join(f"{f.column} ({f.selectivity:.1%})" for f in pending)
+            print(f"DEBUG - Explorer: filtros evaluados en orden {orden}; {int(surviving.sum())} filas")
+        return surviving
+
+
+class ExplorerFilter:
+    """Filtro activo del explorer, con lo necesario para ordenarlo y evaluarlo.
+
+    Args:
+        column: Columna filtrada
+        value_key: Valor del filtro en forma hashable; si no cambia se reutiliza la máscara
+        evaluate: Función evaluate(rows) que devuelve la máscara de las filas en rows (None = todas)
+        cost: COST_VECTOR para comparaciones vectorizadas, COST_SCAN para búsquedas de texto
+        selectivity: Fracción estimada de filas que conserva el filtro (1.0 si se desconoce)
+    """
+
+    def __init__(self, column: str, value_key: Any, evaluate: Callable[[Optional[np.ndarray]], np.ndarray],
+                 cost: int = 0, selectivity: float = 1.0):
+        self.column = column
+        self.value_key = value_key
+        self.evaluate = evaluate
+        self.cost = cost
+        self.selectivity = selectivity
+
+def get_explorer_engine(explorer_id: str, dataset_version: Any) -> ExplorerEngine:
+    """Motor del explorador para esta versión de los datos (uno nuevo si la versión cambió).
+
+    Con dataset_version None no se reutiliza nada entre reruns.
+    """
+    state_key = f"{explorer_id}__engine"
+    engine = st.session_state.get(state_key)
+    if dataset_version is None:
+        return ExplorerEngine(None)
+    if engine is None or engine.dataset_version != dataset_version:
+        engine = ExplorerEngine(dataset_version)
+        st.session_state[state_key] = engine
+    return engine
+
+
+def get_filter_mask(explorer_id: str, dataset_version: Any) -> Optional[np.ndarray]:
+    """Máscara del último resultado del explorer para esta versión de los datos, o None si no hay."""
+    engine = st.session_state.get(f"{explorer_id}__engine")
+    if engine is None or dataset_version is None or engine.dataset_version != dataset_version:
+        return None
+    return engine.last_mask
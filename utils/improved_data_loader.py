@@ -2,8 +2,24 @@ import streamlit as st
 import pandas as pd
 import concurrent.futures
 import threading
-from utils.supabase_client import SupabaseClient # Ensure this is the non-singleton version
+import time
+from utils.supabase_client import SupabaseClient, LoadCancelled # Ensure this is the non-singleton version
 from utils.config import get_config
+from utils.kpi_snapshot import compute_kpis, refresh_kpi_snapshot
+
+class _LoadFlight:
+    """A table load shared by every concurrent requester (single-flight).
+
+    The load only stops when all of its requesters have withdrawn; until then a requester
+    that cancels just stops waiting for it.
+    """
+
+    def __init__(self):
+        self.cancel_event = threading.Event() # Set once the last requester withdraws
+        self.done = threading.Event()
+        self.requesters = 0
+        self.result = None # (table_name, success, df, message) of _load_single_table
+
 
 class ImprovedDataLoader:
     _instance = None
@@ -35,6 +51,13 @@ class ImprovedDataLoader:
             self._tables_loaded_status = {} # Stores True/False based on load success
             self._data_access_lock = threading.RLock() # For _data_frames and _tables_loaded_status
             self._unique_values = {} # For caching unique column values
+            self._snapshot_versions = {} # Incremented every time a table's dataframe is replaced
+            self._snapshot_loaded_at = {} # time.time() of the last successful load per table
+            self._snapshot_columns = {} # Columns each table was loaded with, to refresh it when it goes stale
+            self._snapshot_kpis = None # (snapshot versions, KPIs computed from those snapshots)
+            self._load_checkpoints = {} # table_name -> {"columns", "offset", "frames"} of an interrupted load
+            self._load_flights = {} # (table_name, columns) -> _LoadFlight shared by every session requesting it
+            self._load_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="carga")
             
             self.default_table_name = get_config("KIOSKO_VISTA")
             self.sql_agent = None # Placeholder if needed later
@@ -47,10 +70,124 @@ class ImprovedDataLoader:
             self._data_frames.clear()
             self._tables_loaded_status.clear()
             self._unique_values.clear() # Also clear cached unique values if any
+            self._snapshot_loaded_at.clear() # Versions keep counting so old snapshots never look current
+            self._load_checkpoints.clear()
         # Optionally, log this action or provide feedback if run in a context where that's useful
         # For now, just clearing silently as it's typically part of a reload process.
 
-    def _load_single_table(self, table_name, columns, shared_progress, total_tables, progress_queue, progress_lock):
+    def _store_table(self, table_name, df, columns=None):
+        """Stores a freshly loaded dataframe and bumps its snapshot version."""
+        with self._data_access_lock:
+            self._data_frames[table_name] = df
+            self._snapshot_columns[table_name] = columns
+            self._tables_loaded_status[table_name] = True
+            self._snapshot_versions[table_name] = self._snapshot_versions.get(table_name, 0) + 1
+            self._snapshot_loaded_at[table_name] = time.time()
+
+    def _publish_kpi_snapshot(self, client):
+        """Asks the server to refresh today's KPI snapshot; failures only cost the dashboard its fast path."""
+        # Same guard as get_snapshot_kpis: only after a complete (untruncated) load of portal_desglosado
+        desglosado = self.get_table_snapshot(get_config("DESGLOSADO"))
+        if desglosado is None or len(desglosado[0]) >= get_config("LOADER_ROW_LIMIT"):
+            return
+        try:
+            refresh_kpi_snapshot(client)
+        except Exception as e:
+            print(f"DEBUG - No se pudo actualizar el snapshot de KPIs: {e}")
+
+    def get_snapshot_kpis(self):
+        """
+        Computes the dashboard KPIs from the in-memory desglosado/concentrado snapshots.
+
+        The snapshots are filled by the Dashboard's loading dialog (load_all_required_tables).
+        The result is cached per snapshot version, so once that load has finished, dashboard
+        renders make no network calls and no recomputation until a table is reloaded or its
+        snapshot goes stale (SNAPSHOT_MAX_AGE).
+
+        Returns:
+            Optional[dict]: KPIs with the keys of get_dashboard_kpis, or None if portal_desglosado
+                is not loaded, is stale or may be truncated (LOADER_ROW_LIMIT); the dashboard
+                then reads the KPIs from Supabase.
+        """
+        desglosado = self.get_table_snapshot(get_config("DESGLOSADO"))
+        if desglosado is None or len(desglosado[0]) >= get_config("LOADER_ROW_LIMIT"):
+            return None
+        if time.time() - desglosado[2] > get_config("SNAPSHOT_MAX_AGE"):
+            return None
+        concentrado = self.get_table_snapshot(get_config("CONCENTRADO"))
+        versions = (desglosado[1], concentrado[1] if concentrado else None)
+
+        with self._data_access_lock:
+            if self._snapshot_kpis is not None and self._snapshot_kpis[0] == versions:
+                return dict(self._snapshot_kpis[1])
+
+        kpis = compute_kpis(desglosado[0], concentrado[0] if concentrado else None)
+        with self._data_access_lock:
+            self._snapshot_kpis = (versions, kpis)
+        return dict(kpis)
+
+    def _is_fresh(self, table_name):
+        """True if the table is loaded and its snapshot is younger than SNAPSHOT_MAX_AGE."""
+        with self._data_access_lock:
+            df = self._data_frames.get(table_name)
+            if not self._tables_loaded_status.get(table_name) or df is None or df.empty:
+                return False
+            return time.time() - self._snapshot_loaded_at.get(table_name, 0.0) <= get_config("SNAPSHOT_MAX_AGE")
+
+    def _refresh_if_stale(self, table_name):
+        """Starts a background reload of a stale snapshot, unless one is already in flight."""
+        with self._data_access_lock:
+            if table_name not in self._snapshot_columns or self._is_fresh(table_name):
+                return
+            columns = self._snapshot_columns[table_name]
+            if (table_name, tuple(columns) if columns else None) in self._load_flights:
+                return
+            # The refresh joins as a requester that never withdraws, so sessions that cancel
+            # their own wait do not stop it. A failed reload marks the table as not loaded
+            # (_load_single_table), so a failing refresh is not retried on every call.
+            self._join_load(table_name, columns, reload=True)
+        print(f"DEBUG - Snapshot de {table_name} vencido; recargando en segundo plano")
+
+    def get_table_snapshot(self, table_name):
+        """
+        Returns the in-memory snapshot of a loaded table.
+
+        If the snapshot is older than SNAPSHOT_MAX_AGE it is still returned (callers check
+        loaded_at), and a background reload with the same columns is started so the next
+        call gets a fresh one.
+
+        Args:
+            table_name (str): Database table name (e.g. 'portal_desglosado').
+
+        Returns:
+            Optional[Tuple[pd.DataFrame, int, float]]: (dataframe, version, loaded_at timestamp),
+                or None if the table is not loaded.
+        """
+        with self._data_access_lock:
+            df = self._data_frames.get(table_name)
+            if not self._tables_loaded_status.get(table_name) or df is None or df.empty:
+                return None
+            snapshot = df, self._snapshot_versions.get(table_name, 0), self._snapshot_loaded_at.get(table_name, 0.0)
+        self._refresh_if_stale(table_name)
+        return snapshot
+
+    def _get_checkpoint(self, table_name, columns):
+        """Returns the checkpoint of an interrupted load of this table with these columns, creating it if needed."""
+        with self._data_access_lock:
+            checkpoint = self._load_checkpoints.get(table_name)
+            if checkpoint is None or checkpoint["columns"] != columns:
+                checkpoint = {"columns": columns, "offset": 0, "frames": []}
+                self._load_checkpoints[table_name] = checkpoint
+            return checkpoint
+
+    def _checkpoint_batch(self, table_name, checkpoint, offset, batch_df):
+        """Records a completed batch; only contiguous batches are kept so concurrent loads cannot interleave."""
+        with self._data_access_lock:
+            if self._load_checkpoints.get(table_name) is checkpoint and checkpoint["offset"] == offset:
+                checkpoint["frames"].append(batch_df)
+                checkpoint["offset"] = offset + len(batch_df)
+
+    def _load_single_table(self, table_name, columns, shared_progress, total_tables, progress_queue, progress_lock, cancel_event=None, reload=False):
         message_for_ui = ""
         local_supabase_client = None
         try:
@@ -58,7 +195,7 @@ class ImprovedDataLoader:
             local_supabase_client = SupabaseClient(self.supabase_url, self.supabase_key)
 
             with self._data_access_lock:
-                if self._tables_loaded_status.get(table_name) and self._data_frames.get(table_name) is not None and not self._data_frames.get(table_name).empty:
+                if not reload and self._is_fresh(table_name):
                     with progress_lock:
                         shared_progress["loaded_tables"] += 1
                     progress = shared_progress["loaded_tables"] / total_tables # Read can be outside lock
@@ -66,13 +203,36 @@ class ImprovedDataLoader:
                         progress_queue.put({"progress": progress, "message": f"Tabla {table_name} ya estaba cargada.", "status_type": "info", "table_name": table_name, "source": "_load_single_table_already_loaded"})
                     return table_name, True, self._data_frames.get(table_name), f"Tabla {table_name} ya estaba cargada."
 
-            df = local_supabase_client.get_table_data(table_name=table_name, columns=columns)
+            # Resume from the last completed batch of an interrupted load of this table
+            checkpoint = self._get_checkpoint(table_name, columns)
+            start_offset = checkpoint["offset"]
+            if start_offset and progress_queue:
+                progress_queue.put({"progress": shared_progress["loaded_tables"] / total_tables, "message": f"Reanudando {table_name} desde la fila {start_offset:,}...", "status_type": "info", "table_name": table_name, "source": "_load_single_table_resuming"})
+
+            df = local_supabase_client.get_table_data(
+                table_name=table_name, columns=columns, limit=get_config("LOADER_ROW_LIMIT"),
+                start_offset=start_offset, cancel_event=cancel_event,
+                on_batch=lambda offset, batch_df: self._checkpoint_batch(table_name, checkpoint, offset, batch_df)
+            )
+            complete = df is not None and df.attrs.get("complete", False)
+            if not complete and (start_offset or (df is not None and not df.empty)):
+                # A partial result (error mid-load) is never stored as the snapshot: the checkpoint
+                # keeps the fetched batches and the next load resumes from there
+                raise RuntimeError(f"La carga de {table_name} no terminó; se reanudará desde la fila {checkpoint['offset']:,}.")
+            if start_offset:
+                with self._data_access_lock:
+                    frames = list(checkpoint["frames"])
+                df = pd.concat(frames, ignore_index=True) if frames else df
+            if complete:
+                with self._data_access_lock:
+                    if self._load_checkpoints.get(table_name) is checkpoint:
+                        del self._load_checkpoints[table_name]
             
             success = False
             if df is not None and not df.empty:
-                with self._data_access_lock:
-                    self._data_frames[table_name] = df
-                    self._tables_loaded_status[table_name] = True
+                self._store_table(table_name, df, columns)
+                if table_name in (get_config("DESGLOSADO"), get_config("CONCENTRADO")):
+                    self._publish_kpi_snapshot(local_supabase_client.get_client())
                 with progress_lock:
                     shared_progress["loaded_tables"] += 1
                 progress = shared_progress["loaded_tables"] / total_tables
@@ -91,6 +251,14 @@ class ImprovedDataLoader:
                     progress_queue.put({"progress": progress, "message": f"No se encontraron datos para {table_name} o la tabla está vacía.", "status_type": "warning", "table_name": table_name, "source": "_load_single_table_no_data"})
                 message_for_ui = f"No se encontraron datos para la tabla {table_name} o la tabla está vacía."
                 return table_name, False, None, message_for_ui
+        except LoadCancelled as e:
+            # The checkpoint is kept so the next load resumes from e.offset
+            with progress_lock:
+                shared_progress["loaded_tables"] += 1
+            progress = shared_progress["loaded_tables"] / total_tables
+            if progress_queue:
+                progress_queue.put({"progress": progress, "message": f"Carga de {table_name} cancelada.", "status_type": "warning", "table_name": table_name, "source": "_load_single_table_cancelled"})
+            return table_name, False, None, str(e)
         except Exception as e:
             exception_type = type(e).__name__
             details_parts = [f"str(e): {str(e) if str(e) else 'N/A'}"]
@@ -117,60 +285,104 @@ class ImprovedDataLoader:
                 progress_queue.put({"progress": progress, "message": f"Error al cargar {table_name}.", "status_type": "error", "table_name": table_name, "source": "_load_single_table_error"})
             return table_name, False, None, error_msg
             
-    def load_specific_tables(self, tables_config, progress_queue=None):
+    def _join_load(self, table_name, columns, reload=False):
+        """Registers a requester on the in-flight load of this table, starting it if needed."""
+        key = (table_name, tuple(columns) if columns else None)
+        with self._data_access_lock:
+            flight = self._load_flights.get(key)
+            # A flight whose requesters all withdrew is winding down; start a fresh one
+            if flight is None or flight.cancel_event.is_set():
+                flight = _LoadFlight()
+                self._load_flights[key] = flight
+                self._load_executor.submit(self._run_load_flight, key, flight, table_name, columns, reload)
+            flight.requesters += 1
+            return flight
+
+    def _leave_load(self, flight):
+        """Withdraws a requester; the load is cancelled only when no requester is left."""
+        with self._data_access_lock:
+            flight.requesters -= 1
+            if flight.requesters <= 0 and not flight.done.is_set():
+                flight.cancel_event.set()
+
+    def _run_load_flight(self, key, flight, table_name, columns, reload):
+        try:
+            flight.result = self._load_single_table(
+                table_name, columns, {"loaded_tables": 0, "errors": []}, 1, None, threading.Lock(),
+                cancel_event=flight.cancel_event, reload=reload
+            )
+        except Exception as e:
+            flight.result = (table_name, False, None, f"Origen: _run_load_flight, Tabla: '{table_name}', Tipo: [{type(e).__name__}], Atributos: [str(e): {e}]")
+        finally:
+            with self._data_access_lock:
+                if self._load_flights.get(key) is flight:
+                    del self._load_flights[key]
+            flight.done.set()
+
+    def load_specific_tables(self, tables_config, progress_queue=None, cancel_event=None, reload=False):
+        """
+        Loads the given tables concurrently.
+
+        Loads are shared between sessions: a table already being loaded for another session is
+        awaited instead of fetched twice. Cancelling only affects this caller; a shared load stops
+        (keeping its checkpoint) once every session waiting for it has cancelled.
+
+        Args:
+            tables_config (dict): {table_name: columns} to load.
+            progress_queue (queue.Queue, optional): Receives progress messages for the UI.
+            cancel_event (threading.Event, optional): When set, this caller stops waiting; tables no
+                other session is waiting for keep a checkpoint so the next load resumes where this one stopped.
+            reload (bool): Fetch the tables again even if they are already loaded; the current
+                snapshots keep serving until the new ones are stored.
+
+        Returns:
+            Tuple[bool, list]: (overall_success, [(status_type, table_name, message), ...])
+        """
         detailed_messages_for_ui = []
         if not tables_config:
             if progress_queue: progress_queue.put({"progress": 1.0, "message": "No hay tablas especificadas para cargar.", "status_type": "info", "table_name": "N/A", "source": "load_specific_tables_no_tables"})
             return True, [("info", "N/A", "No hay tablas especificadas para cargar.")]
 
         total_tables = len(tables_config)
-        shared_progress = {"loaded_tables": 0, "errors": []}
-        progress_lock = threading.Lock() # Lock for shared_progress updates
+        loaded_tables = 0
 
         if progress_queue: progress_queue.put({"progress": 0.0, "message": "Inicializando carga de datos...", "status_type": "info", "table_name": "System", "source": "load_specific_tables_initializing"})
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=min(total_tables, 4)) as executor:
-            futures = {}
-            for table_name, columns in tables_config.items():
-                with self._data_access_lock:
-                    if self._tables_loaded_status.get(table_name) and self._data_frames.get(table_name) is not None and not self._data_frames.get(table_name).empty:
-                        with progress_lock:
-                            shared_progress["loaded_tables"] += 1
-                        progress = shared_progress["loaded_tables"] / total_tables
-                        msg_content = f"Tabla {table_name} ya estaba cargada."
-                        detailed_messages_for_ui.append(("info", table_name, msg_content))
-                        if progress_queue: progress_queue.put({"progress": progress, "message": msg_content, "status_type": "info", "table_name": table_name, "source": "load_specific_tables_already_loaded"})
-                        continue
-                
-                future = executor.submit(
-                    self._load_single_table,
-                    table_name, columns, shared_progress, total_tables, progress_queue, progress_lock
-                )
-                futures[future] = table_name
-
-            for future in concurrent.futures.as_completed(futures):
-                table_name_from_future = futures[future]
-                try:
-                    returned_table_name, success_status, _df, message_content = future.result()
-                    status_type = "success" if success_status else ("warning" if "No se encontraron datos" in message_content else "error")
-                    detailed_messages_for_ui.append((status_type, returned_table_name, message_content))
-                except Exception as e:
-                    exception_type = type(e).__name__
-                    details_parts = [f"str(e): {str(e) if str(e) else 'N/A'}"]
-                    for attr in ['message', 'details', 'hint', 'code']:
-                        if hasattr(e, attr):
-                            val = getattr(e, attr)
-                            details_parts.append(f"e.{attr}: {val if val is not None else 'N/A'}")
-                    exception_attributes_str = ", ".join(details_parts)
-                    error_origin = "load_specific_tables.future_error"
-                    err_msg_content = (
-                        f"Origen: {error_origin}, Tarea para: '{table_name_from_future}', "
-                        f"Tipo: [{exception_type}], Atributos: [{exception_attributes_str}]"
-                    )
-                    detailed_messages_for_ui.append(("error", table_name_from_future, err_msg_content))
-                    with progress_lock:
-                        if err_msg_content not in shared_progress["errors"]:
-                           shared_progress["errors"].append(err_msg_content)
+        pending = {}
+        for table_name, columns in tables_config.items():
+            with self._data_access_lock:
+                if not reload and self._is_fresh(table_name):
+                    loaded_tables += 1
+                    msg_content = f"Tabla {table_name} ya estaba cargada."
+                    detailed_messages_for_ui.append(("info", table_name, msg_content))
+                    if progress_queue: progress_queue.put({"progress": loaded_tables / total_tables, "message": msg_content, "status_type": "info", "table_name": table_name, "source": "load_specific_tables_already_loaded"})
+                    continue
+
+            if cancel_event is not None and cancel_event.is_set():
+                loaded_tables += 1
+                detailed_messages_for_ui.append(("warning", table_name, f"Carga de {table_name} cancelada."))
+                continue
+
+            pending[table_name] = self._join_load(table_name, columns, reload)
+            if progress_queue: progress_queue.put({"progress": loaded_tables / total_tables, "message": f"Cargando tabla {table_name}...", "status_type": "info", "table_name": table_name, "source": "load_specific_tables_loading"})
+
+        while pending:
+            for table_name, flight in list(pending.items()):
+                if flight.done.is_set():
+                    del pending[table_name]
+                    _, success_status, _df, message_content = flight.result
+                    status_type = "success" if success_status else ("warning" if "No se encontraron datos" in message_content or "cancelada" in message_content else "error")
+                elif cancel_event is not None and cancel_event.is_set():
+                    del pending[table_name]
+                    self._leave_load(flight)
+                    status_type, message_content = "warning", f"Carga de {table_name} cancelada."
+                else:
+                    continue
+                loaded_tables += 1
+                detailed_messages_for_ui.append((status_type, table_name, message_content))
+                if progress_queue: progress_queue.put({"progress": loaded_tables / total_tables, "message": message_content, "status_type": status_type, "table_name": table_name, "source": "load_specific_tables_table_done"})
+            if pending:
+                next(iter(pending.values())).done.wait(0.2)
             
         overall_success = not any(status == "error" for status, _, _ in detailed_messages_for_ui)
         if progress_queue: # Changed from progress_callback
@@ -189,7 +401,7 @@ class ImprovedDataLoader:
             progress_queue.put({"progress": 1.0, "message": final_msg, "status_type": overall_status_type, "table_name": "Overall", "source": "load_specific_tables_completed"})
         return overall_success, detailed_messages_for_ui
 
-    def load_all_required_tables(self, progress_queue=None):
+    def load_all_required_tables(self, progress_queue=None, cancel_event=None, reload=False):
         kiosko_name = get_config("KIOSKO_VISTA")
         contabilidad_name = get_config("CONTABILIDAD")
         desglosado_name = get_config("DESGLOSADO")
@@ -201,7 +413,7 @@ class ImprovedDataLoader:
             desglosado_name: get_config("DEFAULT_COLUMNS"),
             concentrado_name: get_config("CONSULTA")
         }
-        return self.load_specific_tables(tables_to_load_config, progress_queue)
+        return self.load_specific_tables(tables_to_load_config, progress_queue, cancel_event, reload)
 
     def get_dataframe(self, table_key=None):
         """
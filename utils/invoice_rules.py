@@ -0,0 +1,110 @@
+import operator
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils.config import get_config
+
+COMPARISONS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+}
+
+
+def evaluate_condition(df: pd.DataFrame, condition: Any) -> np.ndarray:
+    """Máscara booleana de una condición de INVOICE_RULES sobre df.
+
+    Args:
+        df: DataFrame con columnas ya renombradas
+        condition: [columna, operador, valor] o {"any": [...]} / {"all": [...]}
+    """
+    if isinstance(condition, dict):
+        if "any" in condition:
+            masks = [evaluate_condition(df, c) for c in condition["any"]]
+            return np.logical_or.reduce(masks) if masks else np.zeros(len(df), dtype=bool)
+        if "all" in condition:
+            masks = [evaluate_condition(df, c) for c in condition["all"]]
+            return np.logical_and.reduce(masks) if masks else np.ones(len(df), dtype=bool)
+        raise ValueError(f"Condición no válida: {condition}")
+
+    column, op, value = condition
+    if column not in df.columns:
+        return np.zeros(len(df), dtype=bool)
+    serie = df[column]
+    if op == "isnull":
+        result = serie.isna()
+    elif op == "notnull":
+        result = serie.notna()
+    elif op == "in":
+        result = serie.isin(value)
+    elif op in COMPARISONS:
+        result = COMPARISONS[op](serie, value)
+    else:
+        raise ValueError(f"Operador no soportado: {op}")
+    return np.asarray(result.fillna(False), dtype=bool)
+
+
+class RuleFlags:
+    """Bits de INVOICE_RULES por fila de un snapshot, calculados una sola vez.
+
+    Cada regla ocupa un bit de un entero de 64 bits por fila; consultar una regla o una
+    combinación de reglas es una operación de bits sobre ese arreglo.
+    """
+
+    def __init__(self, df: pd.DataFrame, rules: Dict[str, Dict[str, Any]]):
+        if len(rules) > 64:
+            raise ValueError("INVOICE_RULES admite como máximo 64 reglas")
+        self.index = df.index
+        self.rules = rules
+        self.bits = {name: np.uint64(1) << np.uint64(i) for i, name in enumerate(rules)}
+        self.flags = np.zeros(len(df), dtype=np.uint64)
+        for name, spec in rules.items():
+            condition = {key: spec[key] for key in ("any", "all") if key in spec}
+            self.flags[evaluate_condition(df, condition)] |= self.bits[name]
+
+    def mask(self, names: List[str], mode: str = "all", index: Optional[pd.Index] = None) -> np.ndarray:
+        """Filas que cumplen las reglas indicadas (todas con mode='all', alguna con mode='any').
+
+        Args:
+            names: Nombres de reglas de INVOICE_RULES
+            mode: 'all' o 'any'
+            index: Etiquetas de un subconjunto del snapshot (por ejemplo la vista filtrada);
+                None para todo el snapshot
+
+        Returns:
+            Máscara booleana alineada con index (o con el snapshot)
+        """
+        flags = self.flags
+        if index is not None:
+            posiciones = self.index.get_indexer(index)
+            # Las etiquetas que no están en el snapshot (-1) no cumplen ninguna regla
+            encontrados = posiciones >= 0
+            flags = np.zeros(len(posiciones), dtype=np.uint64)
+            flags[encontrados] = self.flags[posiciones[encontrados]]
+        wanted = np.uint64(0)
+        for name in names:
+            wanted |= self.bits[name]
+        if mode == "any":
+            return (flags & wanted) != 0
+        return (flags & wanted) == wanted
+
+    def counts(self) -> Dict[str, int]:
+        """Número de filas que cumple cada regla."""
+        return {name: int(((self.flags & bit) != 0).sum()) for name, bit in self.bits.items()}
+
+
+def get_rule_flags(kind: str, df: pd.DataFrame, dataset_version: Any) -> RuleFlags:
+    """Bits de reglas del snapshot `kind` ('concentrado' o 'desglosado') para esta versión de los datos."""
+    state_key = f"rule_flags_{kind}"
+    cached = st.session_state.get(state_key)
+    if cached is not None and cached[0] == dataset_version:
+        return cached[1]
+    flags = RuleFlags(df, get_config("INVOICE_RULES"))
+    st.session_state[state_key] = (dataset_version, flags)
+    return flags
@@ -0,0 +1,101 @@
+import pandas as pd
+
+from utils.config import get_config
+
+
+def compute_kpis(df_desglosado, df_concentrado=None, top_n=2):
+    """Calcula los KPIs del dashboard a partir de tablas completas ya cargadas en memoria.
+
+    Args:
+        df_desglosado: Líneas de portal_desglosado
+        df_concentrado: Filas de portal_concentrado (opcional, para el último registro)
+        top_n: Número de subcategorías más frecuentes a devolver
+
+    Returns:
+        Diccionario con las claves de get_dashboard_kpis
+    """
+    kpis = {
+        'obras_count': int(df_desglosado['obra'].nunique()) if 'obra' in df_desglosado.columns else 0,
+        'total_facturado': float(pd.to_numeric(df_desglosado['subtotal'], errors='coerce').sum())
+        if 'subtotal' in df_desglosado.columns else 0.0,
+        'total_conceptos': len(df_desglosado),
+        'ultima_factura': None,
+        'ultimo_registro': None,
+        'top_subcategorias': [],
+    }
+
+    if 'subcategoria' in df_desglosado.columns:
+        # value_counts sobre códigos categóricos en lugar de hashear cada texto
+        subcategorias = df_desglosado['subcategoria'].replace('', pd.NA).astype('category')
+        kpis['top_subcategorias'] = subcategorias.value_counts(sort=True).head(top_n).index.astype(str).tolist()
+
+    for key, df, column in (('ultima_factura', df_desglosado, 'fecha_factura'),
+                            ('ultimo_registro', df_concentrado, 'fecha_consulta')):
+        if df is not None and column in df.columns:
+            fecha = pd.to_datetime(df[column], errors='coerce', utc=True).max()
+            if not pd.isna(fecha):
+                kpis[key] = fecha.isoformat()
+
+    return kpis
+
+
+def refresh_kpi_snapshot(client):
+    """Pide al servidor que actualice la fila del día de la tabla de snapshots de KPIs.
+
+    La fila se arma en Postgres (refresh_dashboard_kpis_snapshot, security definer) a partir de
+    los contadores que los disparadores de portal_desglosado mantienen con cada cambio
+    (sql/migrations/004_dashboard_kpis_incremental.sql), sin recorrer la tabla. Los disparadores
+    ya la actualizan al cambiar las líneas; esta llamada refresca además el último registro de
+    portal_concentrado. Los clientes no tienen permiso de escritura sobre la tabla.
+
+    Args:
+        client: Cliente Supabase
+    """
+    client.rpc(get_config("KPI_SNAPSHOT_REFRESH_RPC")).execute()
+
+
+def get_latest_kpi_snapshot(client, max_age=None):
+    """Lee el snapshot de KPIs más reciente.
+
+    Args:
+        client: Cliente Supabase
+        max_age: Antigüedad máxima en segundos (None para no limitarla)
+
+    Returns:
+        Diccionario con las claves de get_dashboard_kpis, o None si no hay un snapshot vigente
+    """
+    response = (
+        client.table(get_config("KPI_SNAPSHOT_TABLE"))
+        .select("obras_count, total_facturado, total_conceptos, ultima_factura, ultimo_registro, top_subcategorias, updated_at")
+        .order("snapshot_date", desc=True)
+        .limit(1)
+        .execute()
+    )
+    if not response.data:
+        return None
+    row = response.data[0]
+    if max_age is not None:
+        updated_at = pd.to_datetime(row.get('updated_at'), errors='coerce', utc=True)
+        if pd.isna(updated_at) or (pd.Timestamp.now(tz='UTC') - updated_at).total_seconds() > max_age:
+            return None
+    return row
+
+
+def get_kpi_snapshot_marker(client):
+    """Marca de la última modificación de portal_desglosado, o None si no hay snapshot.
+
+    Los disparadores de portal_desglosado (sql/migrations/004_dashboard_kpis_incremental.sql)
+    reescriben la fila del día con cada cambio, así que su updated_at cambia cuando cambian los
+    datos; sirve como versión de los resultados que se consultan al servidor.
+    """
+    response = (
+        client.table(get_config("KPI_SNAPSHOT_TABLE"))
+        .select("snapshot_date, updated_at")
+        .order("snapshot_date", desc=True)
+        .limit(1)
+        .execute()
+    )
+    if not response.data:
+        return None
+    row = response.data[0]
+    return f"{row.get('snapshot_date')}-{row.get('updated_at')}"
@@ -1,16 +1,22 @@
+import queue
+
 import streamlit as st
 from streamlit_lottie import st_lottie
 
+from utils.config import get_config
+
 @st.dialog("Estado de Carga de Datos", width="large")
 def loading_data_dialog():
     """
     Diálogo modal para mostrar el progreso de carga de datos.
-    Este diálogo es puramente para visualización y se controla mediante st.session_state.
+    La animación se dibuja una vez; el progreso lo actualiza un fragmento con temporizador
+    que consume st.session_state.progress_queue, sin reruns de la página completa.
     
     Requiere las siguientes claves en st.session_state:
     - dialog_progress_value (float): 0.0 a 1.0, para la barra de progreso.
     - dialog_progress_message (str): Mensaje general de estado.
     - dialog_loading_finished (bool): True si la carga ha terminado.
+    - progress_queue (queue.Queue, opcional): Mensajes de progreso del hilo de carga.
     """
     # Lottie animation
     st_lottie(
@@ -22,12 +28,57 @@ def loading_data_dialog():
         quality="high",
     )
     
-    # Progress bar
+    _loading_progress()
+
+
+def _drain_progress_queue():
+    """Vuelca en session_state los mensajes que el hilo de carga dejó en progress_queue."""
+    progress_queue = st.session_state.get('progress_queue')
+    if progress_queue is None:
+        return
+    if not isinstance(st.session_state.get('dialog_detailed_messages'), list):
+        st.session_state.dialog_detailed_messages = []
+    try:
+        while True:
+            item = progress_queue.get_nowait()
+            st.session_state.dialog_progress_value = item.get("progress", st.session_state.get('dialog_progress_value', 0.0))
+            st.session_state.dialog_progress_message = item.get("message", st.session_state.get('dialog_progress_message', ""))
+            st.session_state.dialog_detailed_messages.append({
+                "type": item.get("status_type", "info"),
+                "table": item.get("table_name", "N/A"),
+                "message": item.get("message", "")
+            })
+    except queue.Empty:
+        pass
+
+
+@st.fragment(run_every=get_config("LOADING_DIALOG_REFRESH"))
+def _loading_progress():
+    """
+    Barra de progreso del diálogo. Se redibuja sola cada LOADING_DIALOG_REFRESH segundos
+    sin volver a ejecutar la página completa; solo al terminar la carga pide un rerun de la app
+    para que la página cierre el diálogo.
+    """
+    _drain_progress_queue()
+
     progress_value = st.session_state.get('dialog_progress_value', 0.0)
     progress_message = st.session_state.get('dialog_progress_message', "Iniciando...")
     loading_finished = st.session_state.get('dialog_loading_finished', False)
     
     st.progress(float(progress_value), text=str(progress_message))
+
+    if loading_finished and not st.session_state.get('dialog_loader_thread_active', False) \
+            and st.session_state.get('dialog_is_open', False) and not st.session_state.get('dialog_close_requested', False):
+        # La carga terminó: un único rerun completo para que la página cierre el diálogo
+        st.session_state.dialog_close_requested = True
+        st.rerun()
+    
+    # While loading, the user may cancel; the loader keeps a checkpoint to resume later
+    cancel_event = st.session_state.get('load_cancel_event')
+    if not loading_finished and cancel_event is not None:
+        if st.button("Cancelar", disabled=cancel_event.is_set()):
+            cancel_event.set()
+            st.session_state.dialog_progress_message = "Cancelando..."
     
     # Check if loading is finished to show close button
     if loading_finished:
@@ -37,7 +88,8 @@ def loading_data_dialog():
             keys_to_delete = [
                 'dialog_progress_value', 'dialog_progress_message',
                 'dialog_detailed_messages', 'dialog_loading_finished',
-                'dialog_overall_success', 'dialog_loader_thread_active'
+                'dialog_overall_success', 'dialog_loader_thread_active',
+                'dialog_close_requested'
             ]
             for key in keys_to_delete:
                 if key in st.session_state:
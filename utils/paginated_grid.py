@@ -0,0 +1,154 @@
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils.config import get_config
+
+SIN_ORDEN = "(sin orden)"
+SELECCION_COLUMN = "✓"
+
+
+def _page_keys(page_df: pd.DataFrame, key_column: Optional[str]) -> pd.Index:
+    """Claves de las filas de una página: la columna key_column o, si no hay, las etiquetas del índice."""
+    if key_column and key_column in page_df.columns:
+        return pd.Index(page_df[key_column])
+    return page_df.index
+
+
+def _sort_positions(df: pd.DataFrame, column: str, descending: bool) -> np.ndarray:
+    """Posiciones de df ordenadas por column (nulos al final)."""
+    if column == SIN_ORDEN or column not in df.columns:
+        return np.arange(len(df))
+    ordered = df[column].reset_index(drop=True).sort_values(
+        ascending=not descending, kind="stable", na_position="last"
+    )
+    return ordered.index.to_numpy()
+
+
+def _get_selection_state(grid_id: str, dataset_version: Any) -> Dict[str, Any]:
+    """Selección persistente de la grilla; se reinicia cuando cambia la versión de los datos."""
+    state_key = f"{grid_id}__selection"
+    state = st.session_state.get(state_key)
+    if state is None or state["version"] != dataset_version:
+        state = {"version": dataset_version, "keys": set(), "widget": None, "rows": [], "reset": 0}
+        st.session_state[state_key] = state
+    return state
+
+
+def _sync_selection(state: Dict[str, Any], widget_key: str, page_keys: pd.Index, replace: bool = False) -> None:
+    """Aplica al conjunto de claves los cambios de selección hechos en la página visible.
+
+    Solo se suman/restan las filas que cambiaron desde el último rerun del mismo widget, así
+    que las claves seleccionadas en otras páginas se conservan. Con replace=True (tabla sin
+    paginar, todas las filas visibles) la selección es exactamente la que muestra el widget.
+    """
+    widget_state = st.session_state.get(widget_key)
+    rows = []
+    if widget_state is not None:
+        try:
+            rows = list(widget_state["selection"]["rows"])
+        except (KeyError, TypeError):
+            rows = []
+    if replace:
+        state["keys"] = {page_keys[position] for position in rows if position < len(page_keys)}
+        state["widget"], state["rows"] = widget_key, rows
+        return
+    previous = state["rows"] if state["widget"] == widget_key else []
+    added, removed = set(rows) - set(previous), set(previous) - set(rows)
+    for position in added:
+        if position < len(page_keys):
+            state["keys"].add(page_keys[position])
+    for position in removed:
+        if position < len(page_keys):
+            state["keys"].discard(page_keys[position])
+    state["widget"], state["rows"] = widget_key, rows
+
+
+def paginated_dataframe(df: pd.DataFrame, grid_id: str, key_column: Optional[str] = None,
+                        dataset_version: Any = None, page_size: Optional[int] = None,
+                        column_config: Optional[Dict[str, Any]] = None, height: int = 525) -> List[Any]:
+    """Muestra df por páginas con selección múltiple de filas que se conserva entre páginas.
+
+    Solo la página visible se serializa y se envía al navegador. Si df tiene más filas que
+    page_size se muestran controles de orden y página (el orden se aplica a toda la tabla, no
+    solo a la página), una columna ✓ con las filas ya seleccionadas y un botón para quitar de la
+    selección las filas de la página visible.
+
+    Args:
+        df: DataFrame a mostrar
+        grid_id: Identificador único de la grilla para session_state
+        key_column: Columna que identifica cada fila (por ejemplo 'UUID'); None usa el índice
+        dataset_version: Versión de los datos; al cambiar se descarta la selección
+        page_size: Filas por página (por defecto GRID_PAGE_SIZE)
+        column_config: Configuración de columnas de st.dataframe
+        height: Altura de la grilla
+
+    Returns:
+        Lista con las claves de todas las filas seleccionadas
+    """
+    if page_size is None:
+        page_size = get_config("GRID_PAGE_SIZE")
+    state = _get_selection_state(grid_id, dataset_version)
+    paginated = len(df) > page_size
+
+    sort_column, descending, page = SIN_ORDEN, False, 1
+    if paginated:
+        n_pages = (len(df) + page_size - 1) // page_size
+        # Si los filtros redujeron la tabla, la página guardada puede quedar fuera de rango
+        if st.session_state.get(f"{grid_id}_page", 1) > n_pages:
+            st.session_state[f"{grid_id}_page"] = n_pages
+        col_sort, col_desc, col_page = st.columns([3, 1, 1])
+        sort_column = col_sort.selectbox("Ordenar por", [SIN_ORDEN] + list(df.columns), key=f"{grid_id}_sort")
+        descending = col_desc.toggle("Descendente", key=f"{grid_id}_desc")
+        page = int(col_page.number_input(
+            f"Página (de {n_pages:,})", min_value=1, max_value=n_pages, value=1, step=1, key=f"{grid_id}_page"
+        ))
+
+    positions = _sort_positions(df, sort_column, descending) if paginated else np.arange(len(df))
+    start = (page - 1) * page_size
+    page_df = df.iloc[positions[start:start + page_size]]
+    page_keys = _page_keys(page_df, key_column)
+
+    # Un widget distinto por contenido de página: las posiciones seleccionadas nunca se
+    # interpretan sobre filas diferentes a las que el usuario vio
+    signature = int(pd.util.hash_pandas_object(pd.Series(page_keys), index=False).sum()) if len(page_keys) else 0
+    widget_key = f"{grid_id}_grid_{page}_{sort_column}_{descending}_{signature}_{state['reset']}"
+    # Sin paginar, un cambio de filtros crea un widget nuevo sin filas marcadas: la selección
+    # guardada se reemplaza por la del widget para no conservar filas que el usuario ya no ve marcadas
+    _sync_selection(state, widget_key, page_keys, replace=not paginated)
+
+    config = dict(column_config or {})
+    if paginated:
+        page_df = page_df.copy()
+        page_df.insert(0, SELECCION_COLUMN, page_keys.isin(state["keys"]))
+        config[SELECCION_COLUMN] = st.column_config.CheckboxColumn(
+            SELECCION_COLUMN, help="Fila seleccionada (en cualquier página)", width="small"
+        )
+
+    st.dataframe(
+        page_df,
+        use_container_width=True,
+        column_config=config,
+        height=height,
+        on_select="rerun",
+        selection_mode="multi-row",
+        key=widget_key
+    )
+    if paginated:
+        col_caption, col_clear = st.columns([4, 1])
+        col_caption.caption(
+            f"Filas {start + 1:,}–{start + len(page_df):,} de {len(df):,} · "
+            f"{len(state['keys']):,} seleccionadas en total"
+        )
+        # Al volver a una página, la grilla no marca las filas guardadas (solo la columna ✓), así
+        # que no pueden deseleccionarse con el clic: este botón las quita de la selección
+        en_pagina = page_keys[page_keys.isin(state["keys"])]
+        if len(en_pagina) and col_clear.button("Quitar selección de esta página", key=f"{grid_id}_clear_page"):
+            state["keys"].difference_update(en_pagina)
+            # Un widget nuevo para la página, sin las filas que tenía marcadas
+            state["reset"] += 1
+            state["widget"], state["rows"] = None, []
+            st.rerun()
+    return list(state["keys"])
@@ -0,0 +1,94 @@
+import threading
+import time
+
+import streamlit as st
+
+from utils.config import get_config
+from utils.search_cache import apply_search_filters, filter_columns
+
+
+class QueryPlanner:
+    """Decide si una búsqueda se resuelve con las tablas ya cargadas en memoria o en Supabase.
+
+    Los snapshots los llena el diálogo de carga del Dashboard (load_all_required_tables); antes
+    de esa carga todas las búsquedas van al servidor. Una búsqueda se evalúa localmente cuando
+    el ImprovedDataLoader tiene un snapshot de la tabla que es reciente (SNAPSHOT_MAX_AGE), completo (menos de LOADER_ROW_LIMIT filas) y que
+    contiene las columnas pedidas y las de los filtros activos. En cualquier otro caso la
+    búsqueda va al servidor.
+    """
+
+    def __init__(self, loader, max_age, row_limit):
+        self.loader = loader
+        self.max_age = max_age
+        self.row_limit = row_limit
+        self._normalized = {}  # table_name -> (version, DataFrame con tipos normalizados)
+        self._lock = threading.Lock()
+
+    def _normalized_snapshot(self, table_name, df, version):
+        from utils.chatbot_supabase import normalize_search_frame
+
+        with self._lock:
+            cached = self._normalized.get(table_name)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+        # La normalización se hace una sola vez por versión del snapshot
+        normalized = normalize_search_frame(df.copy())
+        with self._lock:
+            self._normalized[table_name] = (version, normalized)
+        return normalized
+
+    def plan(self, table_name, columns, filters):
+        """Elige la fuente de datos para una búsqueda.
+
+        Args:
+            table_name: Tabla a consultar
+            columns: Lista de columnas solicitadas (None para "*")
+            filters: Filtros normalizados por build_search_filters
+
+        Returns:
+            Tupla (fuente, detalle): ("local", (df, version)) o ("remote", motivo)
+        """
+        if columns is None:
+            return "remote", "se pidieron todas las columnas (*)"
+
+        snapshot = self.loader.get_table_snapshot(table_name) if self.loader else None
+        if snapshot is None:
+            return "remote", "la tabla no está cargada en memoria"
+
+        df, version, loaded_at = snapshot
+        if time.time() - loaded_at > self.max_age:
+            return "remote", "el snapshot en memoria está vencido"
+        if len(df) >= self.row_limit:
+            return "remote", "el snapshot en memoria puede estar truncado"
+
+        missing = (set(columns) | filter_columns(filters)) - set(df.columns)
+        if missing:
+            return "remote", f"faltan columnas en memoria: {', '.join(sorted(missing))}"
+
+        return "local", (df, version)
+
+    def execute_local(self, table_name, columns, filters):
+        """Resuelve la búsqueda con el snapshot en memoria si el plan lo permite.
+
+        Returns:
+            DataFrame filtrado o None si la búsqueda debe ir al servidor
+        """
+        source, detail = self.plan(table_name, columns, filters)
+        if source != "local":
+            return None
+
+        df, version = detail
+        return apply_search_filters(self._normalized_snapshot(table_name, df, version), filters, columns)
+
+
+@st.cache_resource
+def get_query_planner():
+    """Instancia global del planificador, asociada al cargador de datos compartido."""
+    from utils.improved_data_loader import get_improved_data_loader
+
+    try:
+        loader = get_improved_data_loader()
+    except Exception as e:
+        print(f"DEBUG - Planificador sin cargador de datos: {e}")
+        loader = None
+    return QueryPlanner(loader, max_age=get_config("SNAPSHOT_MAX_AGE"), row_limit=get_config("LOADER_ROW_LIMIT"))
@@ -0,0 +1,241 @@
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils.config import get_config
+
+# Mapa de la selección de tipo de fecha del formulario a la columna en BD
+FECHA_COLUMNA_MAP = {
+    'Fecha Factura': 'fecha_factura',
+    'Fecha Recepción': 'fecha_recepcion',
+    'Fecha Pagado': 'fecha_pagada',
+    'Fecha Autorización': 'fecha_autorizacion'
+}
+
+FECHA_COLUMNAS = list(FECHA_COLUMNA_MAP.values())
+
+# Dimensiones tipo lista del filtro y la columna de BD que evalúa cada una
+_SET_FILTERS = {
+    'cuentas_gasto': 'cuenta_gasto',
+    'proveedores': 'proveedor',
+    'estatus': 'estatus',
+}
+
+
+def build_search_filters(obras_seleccionadas=None, proveedores_seleccionados=None, fecha_inicio=None,
+                         fecha_fin=None, estatus_seleccionados=None, fecha_seleccionada=None, obra_to_cuenta=None):
+    """Normaliza los filtros del formulario de búsqueda a la misma semántica que aplica el servidor.
+
+    Las listas vacías equivalen a "sin filtro" (None), las obras se traducen a sus cuentas_gasto
+    y el rango de fechas solo existe si ambas fechas están presentes.
+
+    Args:
+        obras_seleccionadas: Lista de obras seleccionadas (opcional)
+        proveedores_seleccionados: Lista de proveedores seleccionados (opcional)
+        fecha_inicio: Fecha de inicio (opcional)
+        fecha_fin: Fecha de fin (opcional)
+        estatus_seleccionados: Lista de estatus seleccionados (opcional)
+        fecha_seleccionada: Tipo de fecha seleccionada (opcional)
+        obra_to_cuenta: Mapeo obra -> cuenta_gasto
+
+    Returns:
+        Diccionario con los filtros normalizados
+    """
+    obra_to_cuenta = obra_to_cuenta or {}
+    cuentas_gasto = [str(obra_to_cuenta[obra]) for obra in (obras_seleccionadas or [])
+                     if obra_to_cuenta.get(obra) is not None]
+
+    tiene_rango = fecha_inicio is not None and fecha_fin is not None
+    return {
+        'cuentas_gasto': frozenset(cuentas_gasto) or None,
+        'proveedores': frozenset(proveedores_seleccionados or []) or None,
+        'estatus': frozenset(estatus_seleccionados or []) or None,
+        'fecha_inicio': fecha_inicio if tiene_rango else None,
+        'fecha_fin': fecha_fin if tiene_rango else None,
+        # None significa OR sobre las cuatro columnas de fecha
+        'fecha_columna': FECHA_COLUMNA_MAP.get(fecha_seleccionada) if tiene_rango else None,
+    }
+
+
+def filters_contain(cached, new):
+    """Indica si el conjunto de filas de `new` está contenido en el de `cached`."""
+    for key in _SET_FILTERS:
+        if cached[key] is None:
+            continue
+        if new[key] is None or not new[key] <= cached[key]:
+            return False
+
+    if cached['fecha_inicio'] is None:
+        return True
+    if new['fecha_inicio'] is None:
+        return False
+    if new['fecha_inicio'] < cached['fecha_inicio'] or new['fecha_fin'] > cached['fecha_fin']:
+        return False
+    # Un rango OR sobre las cuatro fechas contiene cualquier rango más estrecho (OR o columna única);
+    # un rango sobre una columna concreta solo contiene rangos sobre esa misma columna
+    return cached['fecha_columna'] is None or cached['fecha_columna'] == new['fecha_columna']
+
+
+def filter_columns(filters):
+    """Columnas necesarias para evaluar localmente los filtros activos."""
+    columns = {column for key, column in _SET_FILTERS.items() if filters[key] is not None}
+    if filters['fecha_inicio'] is not None:
+        columns.update([filters['fecha_columna']] if filters['fecha_columna'] else FECHA_COLUMNAS)
+    return columns
+
+
+def parse_select_columns(select_columns):
+    """Convierte "col1, col2" en una lista de columnas; None para "*"."""
+    if not select_columns or select_columns.strip() == "*":
+        return None
+    return [col.strip() for col in select_columns.split(",") if col.strip()]
+
+
+def _date_range_mask(series, fecha_inicio, fecha_fin):
+    # Mismos límites que la consulta remota: [inicio 00:00:00, fin 23:59:59] en UTC
+    inicio = pd.Timestamp(f"{fecha_inicio.isoformat()}T00:00:00+00:00")
+    fin = pd.Timestamp(f"{fecha_fin.isoformat()}T23:59:59+00:00")
+    if getattr(series.dt, 'tz', None) is None:
+        inicio, fin = inicio.tz_localize(None), fin.tz_localize(None)
+    return ((series >= inicio) & (series <= fin)).to_numpy()
+
+
+def search_filters_mask(df, filters):
+    """Evalúa los filtros de búsqueda sobre un DataFrame con máscaras vectorizadas.
+
+    Args:
+        df: DataFrame con las columnas de filtro ya normalizadas (fechas como datetime)
+        filters: Filtros normalizados por build_search_filters
+
+    Returns:
+        Array booleano de numpy con una posición por fila
+    """
+    mask = np.ones(len(df), dtype=bool)
+
+    for key, column in _SET_FILTERS.items():
+        if filters[key] is not None:
+            values = df[column].astype(str) if key == 'cuentas_gasto' else df[column]
+            mask &= values.isin(list(filters[key])).to_numpy()
+
+    if filters['fecha_inicio'] is not None:
+        columnas = [filters['fecha_columna']] if filters['fecha_columna'] else FECHA_COLUMNAS
+        date_mask = None
+        for columna in columnas:
+            col_mask = _date_range_mask(df[columna], filters['fecha_inicio'], filters['fecha_fin'])
+            date_mask = col_mask if date_mask is None else (date_mask | col_mask)
+        mask &= date_mask
+
+    return mask
+
+
+def apply_search_filters(df, filters, columns=None):
+    """Filtra localmente un resultado en memoria con la misma semántica que la consulta remota.
+
+    Args:
+        df: DataFrame de origen
+        filters: Filtros normalizados por build_search_filters
+        columns: Lista de columnas a devolver (None para todas)
+
+    Returns:
+        DataFrame filtrado con índice reiniciado, como si viniera del servidor
+    """
+    result = df.loc[search_filters_mask(df, filters)]
+    if columns is not None:
+        result = result[[col for col in columns if col in result.columns]]
+    return result.reset_index(drop=True)
+
+
+class SearchResultCache:
+    """Caché de resultados de búsqueda que conoce la contención entre filtros.
+
+    Si los filtros de una búsqueda nueva describen un subconjunto de un resultado ya
+    cacheado (mismas columnas o menos), la respuesta se obtiene filtrando localmente
+    el DataFrame cacheado en lugar de volver a consultar Supabase.
+    """
+
+    def __init__(self, max_entries=32, ttl=600, max_rows=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # Un resultado con max_rows filas pudo ser truncado por el servidor: no sirve como superconjunto
+        self.max_rows = max_rows
+        self._entries = []
+        self._lock = threading.Lock()
+
+    def _purge_expired(self, now):
+        self._entries = [entry for entry in self._entries if now - entry['created_at'] < self.ttl]
+
+    def lookup(self, table_name, filters, columns):
+        """Busca un resultado cacheado cuyo filtro contenga al solicitado.
+
+        Returns:
+            DataFrame filtrado localmente o None si no hay un superconjunto disponible
+        """
+        now = time.time()
+        with self._lock:
+            self._purge_expired(now)
+            candidates = []
+            for entry in self._entries:
+                if entry['table_name'] != table_name or not filters_contain(entry['filters'], filters):
+                    continue
+                if columns is None:
+                    if entry['columns'] is not None:
+                        continue
+                elif entry['columns'] is not None and not set(columns) <= set(entry['columns']):
+                    continue
+                df = entry['df']
+                if not df.empty and not filter_columns(filters) <= set(df.columns):
+                    continue
+                candidates.append(entry)
+
+            if not candidates:
+                return None
+            # Preferir el coincidente exacto y, si no, el superconjunto más pequeño
+            best = min(candidates, key=lambda e: (e['filters'] != filters, len(e['df'])))
+            best['last_used'] = now
+
+        if best['filters'] == filters and best['columns'] == columns:
+            return best['df'].copy()
+        return apply_search_filters(best['df'], filters, columns)
+
+    def store(self, table_name, filters, columns, df):
+        """Guarda un resultado remoto para reutilizarlo en búsquedas más estrechas."""
+        # Los resultados vacíos no aportan nada y podrían provenir de un error silenciado
+        if df is None or df.empty:
+            return
+        if self.max_rows is not None and len(df) >= self.max_rows:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._purge_expired(now)
+            self._entries = [e for e in self._entries
+                             if not (e['table_name'] == table_name and e['filters'] == filters and e['columns'] == columns)]
+            self._entries.append({
+                'table_name': table_name,
+                'filters': filters,
+                'columns': columns,
+                # Copia propia: la página renombra in-place los DataFrames que recibe
+                'df': df.copy(),
+                'created_at': now,
+                'last_used': now,
+            })
+            if len(self._entries) > self.max_entries:
+                self._entries.sort(key=lambda e: e['last_used'], reverse=True)
+                del self._entries[self.max_entries:]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+@st.cache_resource
+def get_search_result_cache():
+    """Instancia global (compartida entre sesiones) de la caché de resultados de búsqueda."""
+    return SearchResultCache(
+        max_entries=get_config("SEARCH_CACHE_MAX_ENTRIES"),
+        ttl=get_config("SEARCH_CACHE_TTL"),
+        max_rows=get_config("POSTGREST_MAX_ROWS"),
+    )
@@ -0,0 +1,123 @@
+import concurrent.futures
+import threading
+import time
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from utils.config import get_config
+
+
+def _run_with_ctx(ctx, fn, kwargs):
+    # Asociar el contexto de la sesión que hace la petición y restaurar el anterior al terminar
+    thread = threading.current_thread()
+    previous = get_script_run_ctx(suppress_warning=True)
+    add_script_run_ctx(thread, ctx)
+    try:
+        start = time.perf_counter()
+        result = fn(**kwargs)
+        return result, time.perf_counter() - start
+    finally:
+        add_script_run_ctx(thread, previous)
+
+
+def run_concurrent_search(_client, tables_columns, **filters):
+    """Consulta varias tablas con los mismos filtros de forma concurrente.
+
+    La latencia total es la de la consulta más lenta y no la suma de todas. Cada búsqueda usa
+    su propio pool con un hilo por tabla, así que las búsquedas de distintas sesiones no
+    compiten por los mismos hilos.
+
+    Args:
+        _client: Cliente Supabase inicializado
+        tables_columns: Diccionario {nombre_tabla: columnas a seleccionar}
+        **filters: Filtros de búsqueda (obras_seleccionadas, proveedores_seleccionados, fecha_inicio,
+                   fecha_fin, estatus_seleccionados, fecha_seleccionada)
+
+    Returns:
+        Tupla (resultados, tiempos) con un DataFrame y los segundos empleados por tabla;
+        tiempos incluye la clave "total" con la duración de la búsqueda completa.
+    """
+    from utils.chatbot_supabase import get_filtered_data_reusing_cache
+
+    ctx = get_script_run_ctx()
+    start = time.perf_counter()
+
+    results, timings = {}, {}
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(len(tables_columns), 1), thread_name_prefix="busqueda"
+    ) as executor:
+        futures = {
+            executor.submit(
+                _run_with_ctx, ctx, get_filtered_data_reusing_cache,
+                dict(_client=_client, table_name=table_name, select_columns=columns, **filters)
+            ): table_name
+            for table_name, columns in tables_columns.items()
+        }
+        for future in concurrent.futures.as_completed(futures):
+            table_name = futures[future]
+            results[table_name], timings[table_name] = future.result()
+    timings["total"] = time.perf_counter() - start
+
+    detalle = ", ".join(f"{table}: {timings[table]:.2f} s" for table in tables_columns)
+    print(f"DEBUG - Búsqueda completada en {timings['total']:.2f} s ({detalle})")
+    return results, timings
+
+
+def run_invoice_search(_client, desglosado_columns, contabilidad_columns, **filters):
+    """Búsqueda de la página Base de Datos: líneas del Desglosado y facturas del Concentrado.
+
+    Cuando las columnas del concentrado pueden derivarse de las del desglosado, solo se consulta
+    `portal_desglosado` y el concentrado se agrega localmente por `xml_uuid`. En caso contrario
+    (si las líneas alcanzan POSTGREST_MAX_ROWS y pueden estar truncadas, o si la agregación
+    falla) se consulta `portal_contabilidad` en el servidor.
+
+    Args:
+        _client: Cliente Supabase inicializado
+        desglosado_columns: Columnas de portal_desglosado, separadas por comas
+        contabilidad_columns: Columnas de portal_contabilidad, separadas por comas
+        **filters: Filtros de búsqueda, como en run_concurrent_search
+
+    Returns:
+        Tupla (data, data_contabilidad, concentrado_codes, tiempos). concentrado_codes asigna a
+        cada línea del desglosado la fila de su factura en data_contabilidad, o es None si el
+        concentrado se obtuvo del servidor.
+    """
+    from utils.concentrado_builder import build_concentrado, can_derive_concentrado
+    from utils.search_cache import parse_select_columns
+
+    desglosado_list = parse_select_columns(desglosado_columns) or []
+    contabilidad_list = parse_select_columns(contabilidad_columns) or []
+    contabilidad_table = get_config("CONTABILIDAD")
+    desglosado_table = get_config("DESGLOSADO")
+
+    if not can_derive_concentrado(desglosado_list, contabilidad_list):
+        results, timings = run_concurrent_search(
+            _client, {desglosado_table: desglosado_columns, contabilidad_table: contabilidad_columns}, **filters
+        )
+        return results[desglosado_table], results[contabilidad_table], None, timings
+
+    results, timings = run_concurrent_search(_client, {desglosado_table: desglosado_columns}, **filters)
+    data = results[desglosado_table]
+
+    start = time.perf_counter()
+    if data is not None and len(data) >= get_config("POSTGREST_MAX_ROWS"):
+        # Las líneas pueden estar truncadas por PostgREST: las facturas agregadas quedarían incompletas
+        data_contabilidad, codes = None, None
+    else:
+        try:
+            data_contabilidad, codes = build_concentrado(data, contabilidad_list)
+        except Exception as e:
+            print(f"DEBUG - No se pudo derivar el concentrado localmente: {e}")
+            data_contabilidad, codes = None, None
+    timings["concentrado_local"] = time.perf_counter() - start
+
+    if data_contabilidad is None:
+        fallback, fallback_timings = run_concurrent_search(
+            _client, {contabilidad_table: contabilidad_columns}, **filters
+        )
+        data_contabilidad = fallback[contabilidad_table]
+        timings[contabilidad_table] = fallback_timings[contabilidad_table]
+        timings["total"] += fallback_timings["total"]
+
+    timings["total"] += timings["concentrado_local"]
+    return data, data_contabilidad, codes, timings
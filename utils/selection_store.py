@@ -0,0 +1,124 @@
+from typing import Any, Dict, Optional, Tuple
+
+import pandas as pd
+import streamlit as st
+
+CONCENTRADO = "concentrado"
+DESGLOSADO = "desglosado"
+
+# Columna que identifica una factura del concentrado (xml_uuid ya renombrado)
+INVOICE_KEY_COLUMN = "UUID"
+# Columna que identifica una línea del desglosado (uuid_concepto ya renombrado)
+LINE_ID_COLUMN = "ID Concepto"
+# Respaldo cuando falta el identificador: columnas (renombradas) que se combinan en un hash.
+# Dos conceptos idénticos de la misma factura comparten este hash.
+LINE_KEY_COLUMNS = ["UUID", "Clave Producto", "Descripción", "Cantidad", "Precio Unitario", "Total"]
+
+
+def _content_hash(df: pd.DataFrame) -> pd.Series:
+    columns = [col for col in LINE_KEY_COLUMNS if col in df.columns]
+    if not columns:
+        columns = list(df.columns)
+    return pd.util.hash_pandas_object(df[columns], index=False)
+
+
+def row_keys(kind: str, df: pd.DataFrame) -> pd.Series:
+    """Clave de cada fila: el UUID para facturas, el ID Concepto para líneas.
+
+    Las líneas sin ID Concepto (columna ausente o nula) usan un hash de LINE_KEY_COLUMNS.
+    """
+    if kind == CONCENTRADO and INVOICE_KEY_COLUMN in df.columns:
+        return df[INVOICE_KEY_COLUMN]
+    if LINE_ID_COLUMN not in df.columns:
+        return _content_hash(df)
+    keys = df[LINE_ID_COLUMN].astype(object)
+    missing = keys.isna().to_numpy()
+    if missing.any():
+        keys = keys.copy()
+        keys[missing] = _content_hash(df.loc[missing]).to_numpy()
+    return keys
+
+
+class SelectionStore:
+    """Filas guardadas en el "Registro Temporal", almacenadas como conjuntos de claves.
+
+    Agregar filas solo suma sus claves; la tabla del registro se materializa bajo demanda
+    filtrando el snapshot de la búsqueda actual y se conserva mientras no cambien ni la
+    búsqueda ni la selección. Al hacer una nueva búsqueda, las filas guardadas se separan del
+    snapshot anterior (rebase) para no perder las que ya no aparecen en los nuevos resultados.
+    """
+
+    def __init__(self):
+        self._keys: Dict[str, set] = {CONCENTRADO: set(), DESGLOSADO: set()}
+        # Filas guardadas que no pertenecen al snapshot actual (copiadas en el último rebase)
+        self._detached: Dict[str, Optional[pd.DataFrame]] = {CONCENTRADO: None, DESGLOSADO: None}
+        self._revision = 0
+        self._views: Dict[str, Tuple[Tuple[Any, int], pd.DataFrame]] = {}
+
+    def add(self, kind: str, rows: pd.DataFrame) -> int:
+        """Agrega las claves de rows a la selección y devuelve cuántas eran nuevas."""
+        if rows is None or rows.empty:
+            return 0
+        keys = self._keys[kind]
+        before = len(keys)
+        keys.update(row_keys(kind, rows).tolist())
+        added = len(keys) - before
+        if added:
+            self._revision += 1
+        return added
+
+    def count(self, kind: str) -> int:
+        return len(self._keys[kind])
+
+    def clear(self) -> None:
+        for kind in self._keys:
+            self._keys[kind] = set()
+            self._detached[kind] = None
+        self._revision += 1
+        self._views = {}
+
+    def view(self, kind: str, snapshot: pd.DataFrame, snapshot_version: Any) -> pd.DataFrame:
+        """Tabla del registro: filas del snapshot con claves seleccionadas más las filas separadas.
+
+        El resultado se guarda por (versión del snapshot, revisión de la selección); no debe
+        modificarse en el lugar.
+        """
+        cache_key = (snapshot_version, self._revision)
+        cached = self._views.get(kind)
+        if cached is not None and cached[0] == cache_key:
+            return cached[1]
+
+        keys = self._keys[kind]
+        partes = []
+        matched = set()
+        if keys and snapshot is not None and not snapshot.empty:
+            snapshot_keys = row_keys(kind, snapshot)
+            in_selection = snapshot_keys.isin(keys).to_numpy()
+            partes.append(snapshot.loc[in_selection])
+            matched = set(snapshot_keys[in_selection].tolist())
+        detached = self._detached[kind]
+        if detached is not None and not detached.empty:
+            pendientes = ~row_keys(kind, detached).isin(matched).to_numpy()
+            partes.append(detached.loc[pendientes])
+        partes = [parte for parte in partes if not parte.empty]
+        view = pd.concat(partes) if len(partes) > 1 else (partes[0] if partes else pd.DataFrame())
+        self._views[kind] = (cache_key, view)
+        return view
+
+    def rebase(self, kind: str, old_snapshot: pd.DataFrame, old_version: Any) -> None:
+        """Separa las filas guardadas del snapshot que está por reemplazarse.
+
+        Solo se copian las filas seleccionadas (no el snapshot); cuando aparecen en la nueva
+        búsqueda, view() usa las del snapshot nuevo en su lugar.
+        """
+        if not self._keys[kind]:
+            return
+        self._detached[kind] = self.view(kind, old_snapshot, old_version).copy()
+        self._revision += 1
+
+
+def get_selection_store() -> SelectionStore:
+    """Registro Temporal de la sesión actual."""
+    if "selection_store" not in st.session_state:
+        st.session_state.selection_store = SelectionStore()
+    return st.session_state.selection_store
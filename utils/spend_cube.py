@@ -0,0 +1,149 @@
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils.config import get_config
+
+CUBE_DIMENSIONS = ["categoria_id", "subcategoria", "cuenta_gasto", "obra", "mes"]
+CUBE_MEASURES = ["total_sum", "total_count", "line_count"]
+CUBE_SOURCE_COLUMNS = ["categoria_id", "subcategoria", "cuenta_gasto", "obra", "fecha_factura", "total"]
+
+
+def month_start(fechas):
+    """Primer día del mes (sin zona horaria) de cada fecha; NaT si la fecha no es válida."""
+    fechas = pd.to_datetime(fechas, errors="coerce", utc=True).dt.tz_localize(None)
+    return fechas.dt.to_period("M").dt.to_timestamp()
+
+
+def build_spend_cube(df):
+    """Agrega líneas de portal_desglosado en el cubo de gasto.
+
+    Una fila por combinación categoria_id × subcategoria × cuenta_gasto × obra × mes con la suma
+    (total_sum) y el número de importes (total_count) de `total`, más el número de líneas
+    (line_count). El promedio se obtiene al consultar el cubo como total_sum / total_count,
+    así que cualquier agregación posterior (rollup) sigue siendo exacta.
+
+    Args:
+        df: DataFrame con las columnas de CUBE_SOURCE_COLUMNS
+
+    Returns:
+        DataFrame con CUBE_DIMENSIONS, total_sum, total_count y line_count
+    """
+    if df is None or df.empty:
+        return pd.DataFrame(columns=CUBE_DIMENSIONS + CUBE_MEASURES)
+
+    lineas = pd.DataFrame({col: df[col] for col in CUBE_DIMENSIONS if col in df.columns})
+    for col in CUBE_DIMENSIONS:
+        if col not in lineas.columns and col != "mes":
+            lineas[col] = None
+    lineas["mes"] = month_start(df["fecha_factura"]) if "fecha_factura" in df.columns else pd.NaT
+    lineas["total"] = pd.to_numeric(df["total"], errors="coerce")
+
+    # dropna=False: las líneas sin fecha o sin subcategoría siguen contando en los totales
+    cube = (
+        lineas.groupby(CUBE_DIMENSIONS, dropna=False, sort=False, observed=True)["total"]
+        .agg(total_sum="sum", total_count="count", line_count="size")
+        .reset_index()
+    )
+    return cube
+
+
+def filter_cube(cube, categorias=None, subcategorias=None, cuentas_gasto=None):
+    """Aplica los filtros de la página de visualización sobre el cubo (listas vacías = sin filtro)."""
+    mask = np.ones(len(cube), dtype=bool)
+    for col, values in (("categoria_id", categorias), ("subcategoria", subcategorias), ("cuenta_gasto", cuentas_gasto)):
+        if values:
+            mask &= cube[col].isin(values).to_numpy()
+    return cube.loc[mask]
+
+
+def rollup(cube, dimensions, dropna=True):
+    """Agrega el cubo a las dimensiones indicadas.
+
+    Returns:
+        DataFrame con las dimensiones y las columnas total (suma), count y mean
+    """
+    grouped = (
+        cube.groupby(list(dimensions), dropna=dropna, sort=False, observed=True)[["total_sum", "total_count"]]
+        .sum()
+        .reset_index()
+        .rename(columns={"total_sum": "total", "total_count": "count"})
+    )
+    grouped["mean"] = grouped["total"] / grouped["count"].where(grouped["count"] > 0)
+    return grouped
+
+
+class CubeRollup:
+    """Consultas de las gráficas de visualización sobre un cubo ya filtrado en memoria."""
+
+    def __init__(self, cube):
+        self.cube = cube
+
+    def line_count(self):
+        """Número de líneas de factura representadas en el cubo."""
+        return int(self.cube["line_count"].sum()) if not self.cube.empty else 0
+
+    def rollup(self, dimensions, where=None):
+        """Igual que rollup() con filtros adicionales opcionales {columna: valores}."""
+        cube = self.cube
+        for column, values in (where or {}).items():
+            if values:
+                cube = cube[cube[column].isin(values)]
+        return rollup(cube, dimensions)
+
+
+class SpendCubeProvider:
+    """Mantiene el cubo de gasto construido a partir del snapshot de portal_desglosado del cargador.
+
+    El snapshot lo carga el diálogo de inicio del Dashboard (load_all_required_tables). El cubo se reconstruye una sola vez por versión del snapshot. Si la tabla no está cargada, está
+    vencida (SNAPSHOT_MAX_AGE) o puede estar truncada (LOADER_ROW_LIMIT), get_cube devuelve None y
+    la página construye el cubo a partir de los datos que consulte.
+    """
+
+    def __init__(self, loader, max_age, row_limit):
+        self.loader = loader
+        self.max_age = max_age
+        self.row_limit = row_limit
+        self._cube = None  # (version, cubo)
+        self._lock = threading.Lock()
+
+    def get_cube(self):
+        """
+        Returns:
+            Tupla (cubo, versión del snapshot) o None si no hay un snapshot utilizable
+        """
+        snapshot = self.loader.get_table_snapshot(get_config("DESGLOSADO")) if self.loader else None
+        if snapshot is None:
+            return None
+        df, version, loaded_at = snapshot
+        if time.time() - loaded_at > self.max_age or len(df) >= self.row_limit:
+            return None
+        if not set(CUBE_SOURCE_COLUMNS) <= set(df.columns):
+            return None
+
+        with self._lock:
+            if self._cube is not None and self._cube[0] == version:
+                return self._cube[1], version
+
+        start = time.perf_counter()
+        cube = build_spend_cube(df)
+        print(f"DEBUG - Cubo de gasto v{version}: {len(df)} líneas -> {len(cube)} celdas en {time.perf_counter() - start:.2f} s")
+        with self._lock:
+            self._cube = (version, cube)
+        return cube, version
+
+
+@st.cache_resource
+def get_spend_cube_provider():
+    """Instancia global del cubo de gasto, asociada al cargador de datos compartido."""
+    from utils.improved_data_loader import get_improved_data_loader
+
+    try:
+        loader = get_improved_data_loader()
+    except Exception as e:
+        print(f"DEBUG - Cubo de gasto sin cargador de datos: {e}")
+        loader = None
+    return SpendCubeProvider(loader, max_age=get_config("SNAPSHOT_MAX_AGE"), row_limit=get_config("LOADER_ROW_LIMIT"))
@@ -3,6 +3,15 @@ import streamlit as st
 from supabase import create_client, Client
 
 
+class LoadCancelled(Exception):
+    """Raised by get_table_data when its cancel_event is set between batches."""
+
+    def __init__(self, table_name: str, offset: int):
+        super().__init__(f"Carga de {table_name} cancelada en la fila {offset}")
+        self.table_name = table_name
+        self.offset = offset
+
+
 class SupabaseClient:
     """Class to manage Supabase client connection"""
 
@@ -105,7 +114,8 @@ class SupabaseClient:
             print(f"Error general ejecutando SQL: {str(e)}")
             return ResultContainer(data=[{"error": str(e), "query": sql_query}])
     
-    def get_table_data(self, table_name: str, columns: list = None, default_columns: list = None, filters: dict = None, limit: int = 250000, batch_size: int = 40000):
+    def get_table_data(self, table_name: str, columns: list = None, default_columns: list = None, filters: dict = None, limit: int = 250000, batch_size: int = 40000,
+                       start_offset: int = 0, cancel_event=None, on_batch=None):
             """Get data from a specific table with optional filters using pagination
             
             Args:
@@ -115,9 +125,12 @@ class SupabaseClient:
                 filters: Dict of column:value pairs to filter results
                 limit: Maximum number of rows to return (default 250,000)
                 batch_size: Number of records to fetch in each batch (default 40,000)
+                start_offset: Row offset to start from, to resume an interrupted load (default 0)
+                cancel_event: threading.Event checked before every batch; when set, LoadCancelled is raised
+                on_batch: Callable(offset, batch_df) invoked after every fetched batch (for checkpointing)
                 
             Returns:
-                pandas.DataFrame: The query results as a DataFrame
+                pandas.DataFrame: The query results as a DataFrame (only rows from start_offset on)
             """
             import pandas as pd
             import streamlit as st
@@ -164,18 +177,23 @@ class SupabaseClient:
                 # If we know there are no rows, return empty DataFrame immediately
                 if total_rows == 0:
                     print(f"Table {table_name} is empty or all rows filtered out")
+                    all_results.attrs["complete"] = True
                     return all_results
                 
                 # Calculate the number of batches needed based on actual limit
-                num_batches = (actual_limit + batch_size - 1) // batch_size  # Ceiling division
+                num_batches = (actual_limit - start_offset + batch_size - 1) // batch_size  # Ceiling division
                 
-                # Fetch data in batches
-                for batch in range(num_batches):
-                    offset = batch * batch_size
-                    current_batch_size = min(batch_size, actual_limit - offset)
+                # Fetch data in batches. The offset advances by the rows actually received, so a
+                # batch retried with a smaller size never leaves a gap.
+                offset = start_offset
+                batch = 0
+                reached_end = False
+                while offset < actual_limit and not reached_end:
+                    if cancel_event is not None and cancel_event.is_set():
+                        print(f"Load of {table_name} cancelled at offset {offset}")
+                        raise LoadCancelled(table_name, offset)
                     
-                    if current_batch_size <= 0:
-                        break  # We've reached the limit
+                    current_batch_size = min(batch_size, actual_limit - offset)
                     
                     # Progress message
                     print(f"Fetching batch {batch + 1}/{num_batches}: offset={offset}, limit={current_batch_size}")
@@ -202,18 +220,21 @@ class SupabaseClient:
                                 # Append this batch to our results
                                 batch_df = pd.DataFrame(result.data)
                                 all_results = pd.concat([all_results, batch_df], ignore_index=True)
+                                if on_batch is not None:
+                                    on_batch(offset, batch_df)
                                 
                                 # If we got fewer results than requested, we've reached the end
                                 if len(result.data) < current_batch_size:
-                                    print(f"Reached end of data at {len(all_results)} records")
-                                    break
+                                    print(f"Reached end of data at {offset + len(result.data)} records")
+                                    reached_end = True
+                                offset += len(result.data)
                             else:
                                 # No data in this batch
-                                if batch == 0:
+                                if batch == 0 and start_offset == 0:
                                     # If first batch is empty, table is empty
                                     return pd.DataFrame()
                                 # Otherwise, we've reached the end of data
-                                break
+                                reached_end = True
                                 
                             # Successful batch, break the retry loop
                             break
@@ -251,14 +272,19 @@ class SupabaseClient:
                                 # Otherwise, propagate the error
                                 raise
                     
+                    batch += 1
+                    
                     # Add a small delay between batches to avoid overwhelming the server
-                    if batch < num_batches - 1:
+                    if offset < actual_limit and not reached_end:
                         time.sleep(0.5)
                 
                 # Return the combined results
                 print(f"Successfully retrieved {len(all_results)} records from {table_name}")
+                all_results.attrs["complete"] = True  # Distinguishes a finished load from a partial one on error
                 return all_results
                 
+            except LoadCancelled:
+                raise
             except Exception as e:
                 # Catch any other unexpected errors during the process
                 error_msg = f"Unexpected error accessing Supabase: {e}"
@@ -0,0 +1,72 @@
+from collections import defaultdict
+from typing import Iterable, Optional
+
+import numpy as np
+
+NGRAM = 3
+# Caracteres con significado en una regex; un patrón sin ellos es una subcadena literal
+REGEX_METACHARACTERS = set(".^$*+?{}[]\\|()")
+
+
+def is_literal(pattern: str) -> bool:
+    """True si el patrón no usa sintaxis de regex y puede resolverse como subcadena."""
+    return not any(char in REGEX_METACHARACTERS for char in pattern)
+
+
+def ngrams(text: str, n: int = NGRAM) -> set:
+    """Conjunto de n-gramas (trigramas por defecto) de un texto."""
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class TrigramIndex:
+    """Índice invertido de trigramas sobre los valores distintos de una columna de texto.
+
+    Cada trigrama (en minúsculas) apunta a la lista ordenada de valores que lo contienen.
+    Una búsqueda de subcadena intersecta las listas de los trigramas de la consulta y solo
+    verifica con `in` los candidatos resultantes, en lugar de recorrer todos los valores.
+    """
+
+    def __init__(self, values: Iterable[str]):
+        self.values = np.asarray(list(values), dtype=object)
+        self.lowered = np.asarray([value.lower() for value in self.values], dtype=object)
+        postings = defaultdict(list)
+        for position, value in enumerate(self.lowered):
+            for gram in ngrams(value):
+                postings[gram].append(position)
+        # Las posiciones se agregan en orden, así que cada lista ya queda ordenada y sin repetidos
+        self.postings = {gram: np.asarray(ids, dtype=np.int64) for gram, ids in postings.items()}
+        print(f"DEBUG - Índice de trigramas: {len(self.values)} valores, {len(self.postings)} trigramas")
+
+    def candidates(self, needle: str) -> Optional[np.ndarray]:
+        """Posiciones que contienen todos los trigramas de needle, o None si es más corto que un trigrama."""
+        grams = ngrams(needle.lower())
+        if not grams:
+            return None
+        lists = []
+        for gram in grams:
+            ids = self.postings.get(gram)
+            if ids is None:
+                return np.empty(0, dtype=np.int64)
+            lists.append(ids)
+        lists.sort(key=len)
+        result = lists[0]
+        for ids in lists[1:]:
+            result = np.intersect1d(result, ids, assume_unique=True)
+            if result.size == 0:
+                break
+        return result
+
+    def search(self, needle: str, case: bool = True) -> np.ndarray:
+        """Máscara booleana sobre los valores que contienen needle como subcadena."""
+        matches = np.zeros(len(self.values), dtype=bool)
+        ids = self.candidates(needle)
+        if ids is None:
+            ids = np.arange(len(self.values))
+        if case:
+            haystack, target = self.values, needle
+        else:
+            haystack, target = self.lowered, needle.lower()
+        for position in ids:
+            if target in haystack[position]:
+                matches[position] = True
+        return matches